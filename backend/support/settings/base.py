@@ -39,6 +39,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # doit être en haut
+    'support.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,6 +138,8 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
+    # Pagination par curseur, activée avec ?page_size=... ou ?cursor=...
+    'DEFAULT_PAGINATION_CLASS': 'tcikets.pagination.CreatedAtCursorPagination',
 }
 
 '''CORS_ALLOWED_ORIGINS = [
@@ -150,6 +153,53 @@ REST_FRAMEWORK = {
 CORS_ORIGIN_ALLOW_ALL = True
 HANDLER404 = 'tcikets.views.custom_404'
 
+# Instrumentation des requêtes (en-tête Server-Timing, histogrammes par endpoint)
+REQUEST_METRICS_ENABLED = True
+# Lever QueryBudgetExceeded quand une vue dépasse son query_budget (à activer dans les tests)
+QUERY_BUDGET_STRICT = False
+
+# Notifications de connexion : un résumé par utilisateur au lieu d'une ligne par ticket
+LOGIN_NOTIFICATIONS_DIGEST = True
+LOGIN_DIGEST_TTL_MINUTES = 60
+
+# Cache partagé entre les workers (compteurs de notifications, métriques...).
+# Sans REDIS_URL, le cache local en mémoire suffit pour un seul processus.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+NOTIFICATION_COUNTS_TTL = 60 * 60
+
+# WebSockets : cache des utilisateurs JWT (par user_id et jti) et des membres des tickets
+WS_AUTH_CACHE_TTL = 60
+TICKET_MEMBERS_CACHE_TTL = 300
+
+# Chat : messages texte diffusés avant d'être écrits par lots (bulk_create), sur option
+CHAT_WRITE_BEHIND = False
+
+# Recherche globale en mode rapide (?mode=fast) : catégories en parallèle, budget en secondes
+GLOBAL_SEARCH_BUDGET = 0.3
+GLOBAL_SEARCH_WORKERS = 8
+
+# Vues des procédures : report en base toutes les N secondes, une vue par IP et par fenêtre
+PROCEDURE_VIEWS_FLUSH_INTERVAL = 10
+PROCEDURE_VIEWS_DEDUPE_WINDOW = 30 * 60
+
+# Export ZIP et import de procédures en arrière-plan : fichiers hors de MEDIA_ROOT, état en cache
+PROCEDURE_TRANSFER_ROOT = BASE_DIR / 'procedure_transfers'
+PROCEDURE_JOB_WORKERS = 1
+PROCEDURE_JOB_TTL = 24 * 60 * 60
+
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=15),   # token court
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),     # ou 30 si "Remember Me"
@@ -165,11 +215,40 @@ AUTH_USER_MODEL = "tcikets.User"
 
 ASGI_APPLICATION = "support.asgi.application"
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+# Channel layer : en mémoire pour un seul worker, Redis (channels_redis) dès que
+# CHANNEL_REDIS_HOSTS est défini. Plusieurs URLs séparées par des virgules
+# répartissent les canaux et les groupes sur plusieurs instances (sharding
+# par hachage cohérent de channels_redis).
+CHANNEL_REDIS_HOSTS = [
+    host.strip()
+    for host in os.environ.get('CHANNEL_REDIS_HOSTS', '').split(',')
+    if host.strip()
+]
+if CHANNEL_REDIS_HOSTS:
+    # channels_redis.pubsub.RedisPubSubChannelLayer est aussi supporté
+    CHANNEL_LAYER_BACKEND = os.environ.get('CHANNEL_LAYER_BACKEND', 'channels_redis.core.RedisChannelLayer')
+    CHANNEL_LAYER_CONFIG = {
+        "hosts": CHANNEL_REDIS_HOSTS,
+        "prefix": os.environ.get('CHANNEL_LAYER_PREFIX', 'support'),
+    }
+    if CHANNEL_LAYER_BACKEND == 'channels_redis.core.RedisChannelLayer':
+        CHANNEL_LAYER_CONFIG.update({
+            "capacity": int(os.environ.get('CHANNEL_LAYER_CAPACITY', 1500)),
+            "expiry": 60,
+            "group_expiry": 86400,
+        })
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": CHANNEL_LAYER_BACKEND,
+            "CONFIG": CHANNEL_LAYER_CONFIG,
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
 
 
 # ================================
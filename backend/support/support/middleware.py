@@ -1,9 +1,12 @@
 from urllib.parse import parse_qs
+import time
 import jwt
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
 from asgiref.sync import sync_to_async
+from support.utils.request_metrics import RequestMetrics, endpoint_metrics
+from support.utils.auth_cache import get_cached_user
 
 User = get_user_model()
 
@@ -23,7 +26,7 @@ class JWTAuthMiddleware:
                 payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
                 user_id = payload.get("user_id")
                 if user_id:
-                    user = await self.get_user(user_id)
+                    user = await self.get_user(user_id, payload.get("jti"))
             except Exception as e:
                 print("JWT error:", e)
 
@@ -31,8 +34,65 @@ class JWTAuthMiddleware:
         return await self.app(scope, receive, send)
 
     @staticmethod
-    async def get_user(user_id):
-        try:
-            return await sync_to_async(User.objects.get)(id=user_id)
-        except User.DoesNotExist:
-            return AnonymousUser()
+    async def get_user(user_id, jti=None):
+        # Cache court par (user_id, jti) : les reconnexions en masse ne touchent pas la base
+        user = await sync_to_async(get_cached_user)(user_id, jti)
+        return user or AnonymousUser()
+
+
+class RequestMetricsMiddleware:
+    """
+    Instrumentation HTTP : nombre de requêtes SQL, temps DB, sérialisation et rendu.
+
+    Les mesures sont renvoyées dans l'en-tête Server-Timing, agrégées par endpoint
+    (voir support.utils.request_metrics) et comparées au `query_budget` de la vue.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'REQUEST_METRICS_ENABLED', True)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        request.metrics = metrics
+        with metrics.capture_queries():
+            response = self.get_response(request)
+        metrics.finish()
+
+        response['Server-Timing'] = metrics.server_timing()
+        if metrics.endpoint:
+            endpoint_metrics.record(metrics.endpoint, metrics)
+        metrics.check_budget()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = getattr(request, 'metrics', None)
+        if metrics is None:
+            return None
+
+        match = request.resolver_match
+        route = match.route if match and match.route else request.path.lstrip('/')
+        metrics.endpoint = f"{request.method} /{route}"
+
+        # Vues DRF : as_view() expose la classe via .cls, les vues Django via .view_class
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is None and view_class is not None:
+            budget = getattr(view_class, 'query_budget', None)
+        metrics.query_budget = budget
+        return None
+
+    def process_template_response(self, request, response):
+        # Les Response DRF sont rendues juste après ce hook
+        metrics = getattr(request, 'metrics', None)
+        if metrics is not None:
+            render_started = time.perf_counter()
+
+            def record_render_time(rendered_response):
+                metrics.timings['render'] += time.perf_counter() - render_started
+
+            response.add_post_render_callback(record_render_time)
+        return response
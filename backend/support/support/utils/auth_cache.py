@@ -0,0 +1,76 @@
+"""
+Cache court des utilisateurs authentifiés par JWT sur les WebSockets.
+
+Les entrées sont indexées par user_id et par le `jti` du jeton. Une version
+par utilisateur, incrémentée à chaque sauvegarde de l'utilisateur ou de son
+profil, rend toutes ses entrées obsolètes d'un coup ; un jeton révoqué
+(déconnexion, blacklist) n'est plus jamais servi depuis le cache.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+
+USER_CACHE_TTL = getattr(settings, 'WS_AUTH_CACHE_TTL', 60)  # secondes
+CACHE_PREFIX = "wsauth"
+
+
+def _version_key(user_id):
+    return f"{CACHE_PREFIX}:user:{user_id}:version"
+
+
+def _revoked_key(jti):
+    return f"{CACHE_PREFIX}:revoked:{jti}"
+
+
+def _user_key(user_id, version, jti):
+    return f"{CACHE_PREFIX}:user:{user_id}:v{version}:{jti}"
+
+
+def load_user(user_id):
+    User = get_user_model()
+    return User.objects.select_related('client_profile', 'technician_profile').filter(id=user_id).first()
+
+
+def get_cached_user(user_id, jti=None):
+    """
+    Utilisateur du jeton, depuis le cache si possible. Renvoie None si
+    l'utilisateur n'existe pas ou si le jeton a été révoqué.
+    """
+    if not jti:
+        return load_user(user_id)
+
+    state = cache.get_many([_version_key(user_id), _revoked_key(jti)])
+    if state.get(_revoked_key(jti)):
+        return None
+
+    version = state.get(_version_key(user_id), 0)
+    key = _user_key(user_id, version, jti)
+    user = cache.get(key)
+    if user is None:
+        user = load_user(user_id)
+        if user is not None:
+            cache.set(key, user, USER_CACHE_TTL)
+    return user
+
+
+def invalidate_user(user_id):
+    """Rendre obsolètes toutes les entrées de l'utilisateur (tous jetons confondus)"""
+    key = _version_key(user_id)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def revoke_token(user_id, jti, exp=None):
+    """Marquer un jeton comme révoqué jusqu'à son expiration"""
+    if not jti:
+        return
+    timeout = max(int(exp - time.time()), 1) if exp else USER_CACHE_TTL
+    cache.set(_revoked_key(jti), True, timeout)
+    if user_id is not None:
+        version = cache.get(_version_key(user_id), 0)
+        cache.delete(_user_key(user_id, version, jti))
@@ -0,0 +1,299 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Levée en mode strict quand un endpoint dépasse son budget de requêtes SQL"""
+
+
+class RequestMetrics:
+    """
+    Mesures d'une requête HTTP : nombre de requêtes SQL, temps base de données,
+    temps de sérialisation et de rendu.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.query_count = 0
+        self.db_time = 0.0
+        self.timings = defaultdict(float)
+        self.endpoint = None
+        self.query_budget = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # Utilisé comme execute_wrapper sur les connexions
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.query_count += 1
+
+    @contextmanager
+    def capture_queries(self):
+        """Compter les requêtes SQL exécutées sur toutes les connexions"""
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    @property
+    def total_time(self):
+        end = self.finished_at or time.perf_counter()
+        return end - self.started_at
+
+    def server_timing(self):
+        """Valeur de l'en-tête Server-Timing (durées en millisecondes)"""
+        parts = [f'db;dur={self.db_time * 1000:.2f};desc="{self.query_count} queries"']
+        for name in ('serialize', 'render'):
+            if name in self.timings:
+                parts.append(f'{name};dur={self.timings[name] * 1000:.2f}')
+        parts.append(f'total;dur={self.total_time * 1000:.2f}')
+        return ', '.join(parts)
+
+    def check_budget(self):
+        if self.query_budget is None or self.query_count <= self.query_budget:
+            return
+        message = (
+            f"{self.endpoint} a exécuté {self.query_count} requêtes SQL "
+            f"(budget: {self.query_budget})"
+        )
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+def get_request_metrics(request):
+    """Retourne les mesures attachées par RequestMetricsMiddleware (request Django ou DRF)"""
+    request = getattr(request, '_request', request)
+    return getattr(request, 'metrics', None)
+
+
+@contextmanager
+def serializer_timer(request):
+    """Compter le bloc comme temps de sérialisation s'il y a des mesures sur la requête"""
+    metrics = get_request_metrics(request)
+    if metrics is None:
+        yield
+        return
+    with metrics.timer('serialize'):
+        yield
+
+
+def time_serializer(request, serializer):
+    """Mesurer le temps passé dans serializer.to_representation (donc dans .data)"""
+    metrics = get_request_metrics(request)
+    if metrics is None:
+        return serializer
+
+    to_representation = serializer.to_representation
+
+    def timed_to_representation(instance):
+        with metrics.timer('serialize'):
+            return to_representation(instance)
+
+    serializer.to_representation = timed_to_representation
+    return serializer
+
+
+class EndpointMetricsRegistry:
+    """
+    Histogramme glissant des latences par endpoint, partagé entre les workers
+    via le cache Django.
+
+    Chaque processus agrège localement et pousse ses compteurs dans le cache
+    (cache.incr) au plus toutes les FLUSH_INTERVAL secondes, par fenêtres de
+    WINDOW_SECONDS conservées RETENTION_WINDOWS fois.
+    """
+    CACHE_PREFIX = "reqmetrics"
+    LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+    WINDOW_SECONDS = 60
+    RETENTION_WINDOWS = 15
+    FLUSH_INTERVAL = 5.0
+    COUNTERS = ('count', 'queries', 'db_us', 'serialize_us', 'render_us', 'total_us')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    # -----------------------------
+    # Clés de cache
+    # -----------------------------
+    @staticmethod
+    def _endpoint_hash(endpoint):
+        return hashlib.md5(endpoint.encode()).hexdigest()[:12]
+
+    def _key(self, window, endpoint_hash, field):
+        return f"{self.CACHE_PREFIX}:{window}:{endpoint_hash}:{field}"
+
+    @property
+    def _index_key(self):
+        return f"{self.CACHE_PREFIX}:endpoints"
+
+    @property
+    def _timeout(self):
+        return self.WINDOW_SECONDS * (self.RETENTION_WINDOWS + 1)
+
+    @property
+    def fields(self):
+        return self.COUNTERS + tuple(f'b{i}' for i in range(len(self.LATENCY_BUCKETS_MS) + 1))
+
+    def _bucket_index(self, duration_ms):
+        for index, upper_bound in enumerate(self.LATENCY_BUCKETS_MS):
+            if duration_ms <= upper_bound:
+                return index
+        return len(self.LATENCY_BUCKETS_MS)
+
+    # -----------------------------
+    # Écriture
+    # -----------------------------
+    def record(self, endpoint, metrics):
+        window = int(time.time() // self.WINDOW_SECONDS)
+        total_ms = metrics.total_time * 1000
+
+        with self._lock:
+            counters = self._pending.setdefault((endpoint, window), defaultdict(int))
+            counters['count'] += 1
+            counters['queries'] += metrics.query_count
+            counters['db_us'] += int(metrics.db_time * 1_000_000)
+            counters['serialize_us'] += int(metrics.timings.get('serialize', 0) * 1_000_000)
+            counters['render_us'] += int(metrics.timings.get('render', 0) * 1_000_000)
+            counters['total_us'] += int(total_ms * 1000)
+            counters[f'b{self._bucket_index(total_ms)}'] += 1
+
+            if time.monotonic() - self._last_flush < self.FLUSH_INTERVAL:
+                return
+            pending = self._take_pending()
+
+        self._flush(pending)
+
+    def _take_pending(self):
+        pending, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+        return pending
+
+    def flush(self):
+        with self._lock:
+            pending = self._take_pending()
+        self._flush(pending)
+
+    def _flush(self, pending):
+        if not pending:
+            return
+        try:
+            index = cache.get(self._index_key) or {}
+            index_changed = False
+            for (endpoint, window), counters in pending.items():
+                endpoint_hash = self._endpoint_hash(endpoint)
+                if endpoint_hash not in index:
+                    index[endpoint_hash] = endpoint
+                    index_changed = True
+                for field, value in counters.items():
+                    self._incr(self._key(window, endpoint_hash, field), value)
+
+            if index_changed:
+                cache.set(self._index_key, index, self._timeout)
+            else:
+                cache.touch(self._index_key, self._timeout)
+        except Exception as e:
+            # Les métriques ne doivent jamais faire échouer une requête
+            logger.warning(f"Impossible d'enregistrer les métriques des endpoints: {e}")
+
+    def _incr(self, key, value):
+        cache.add(key, 0, self._timeout)
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            # La clé a expiré entre add() et incr()
+            cache.set(key, value, self._timeout)
+
+    # -----------------------------
+    # Lecture
+    # -----------------------------
+    def snapshot(self, minutes=None, endpoint=None):
+        """Agrège les fenêtres des `minutes` dernières minutes pour chaque endpoint"""
+        self.flush()
+
+        windows_count = min(minutes or self.RETENTION_WINDOWS, self.RETENTION_WINDOWS)
+        windows_count = max(1, int(windows_count * 60 // self.WINDOW_SECONDS))
+        current = int(time.time() // self.WINDOW_SECONDS)
+        windows = range(current - windows_count + 1, current + 1)
+
+        index = cache.get(self._index_key) or {}
+        if endpoint:
+            index = {h: name for h, name in index.items() if name == endpoint}
+
+        keys = [
+            self._key(window, endpoint_hash, field)
+            for endpoint_hash in index
+            for window in windows
+            for field in self.fields
+        ]
+        values = cache.get_many(keys) if keys else {}
+
+        results = []
+        for endpoint_hash, name in index.items():
+            totals = defaultdict(int)
+            for window in windows:
+                for field in self.fields:
+                    totals[field] += values.get(self._key(window, endpoint_hash, field), 0)
+            if totals['count']:
+                results.append(self._summarize(name, totals))
+
+        return sorted(results, key=lambda item: item['avg_total_ms'], reverse=True)
+
+    def _summarize(self, endpoint, totals):
+        count = totals['count']
+        buckets = [totals[f'b{i}'] for i in range(len(self.LATENCY_BUCKETS_MS) + 1)]
+        labels = [f'<={bound}ms' for bound in self.LATENCY_BUCKETS_MS] + [f'>{self.LATENCY_BUCKETS_MS[-1]}ms']
+        return {
+            'endpoint': endpoint,
+            'count': count,
+            'avg_queries': round(totals['queries'] / count, 2),
+            'avg_db_ms': round(totals['db_us'] / count / 1000, 2),
+            'avg_serialize_ms': round(totals['serialize_us'] / count / 1000, 2),
+            'avg_render_ms': round(totals['render_us'] / count / 1000, 2),
+            'avg_total_ms': round(totals['total_us'] / count / 1000, 2),
+            'p50_ms': self._percentile(buckets, count, 0.50),
+            'p95_ms': self._percentile(buckets, count, 0.95),
+            'p99_ms': self._percentile(buckets, count, 0.99),
+            'histogram': dict(zip(labels, buckets)),
+        }
+
+    def _percentile(self, buckets, count, fraction):
+        """Borne supérieure du seau contenant le percentile (None au-delà du dernier seau)"""
+        threshold = count * fraction
+        cumulative = 0
+        for index, value in enumerate(buckets):
+            cumulative += value
+            if cumulative >= threshold:
+                if index < len(self.LATENCY_BUCKETS_MS):
+                    return self.LATENCY_BUCKETS_MS[index]
+                return None
+        return None
+
+
+endpoint_metrics = EndpointMetricsRegistry()
@@ -0,0 +1,72 @@
+"""
+Attribution de slugs uniques (procédures, tags).
+
+Les slugs déjà pris pour une base (« reseau », « reseau-1 », ...) sont lus en
+une requête par préfixe ; le suffixe libre est calculé en mémoire. Entre la
+lecture et l'INSERT, un autre worker peut prendre le même slug :
+with_unique_slug recommence alors avec un nouveau calcul.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+PREFIX_QUERY_BATCH = 50
+MAX_ATTEMPTS = 3
+
+
+def _base_slug(value, max_length, default):
+    return (slugify(value or '') or default)[:max_length].strip('-') or default
+
+
+def _taken_slugs(model, bases, field):
+    """Slugs existants égaux à une base ou de la forme « base-... »"""
+    taken = set()
+    bases = sorted(set(bases))
+    for start in range(0, len(bases), PREFIX_QUERY_BATCH):
+        condition = Q()
+        for base in bases[start:start + PREFIX_QUERY_BATCH]:
+            condition |= Q(**{field: base}) | Q(**{f"{field}__startswith": f"{base}-"})
+        taken.update(model._default_manager.filter(condition).values_list(field, flat=True))
+    return taken
+
+
+def allocate_slugs(model, values, field='slug', default='item', reserved=()):
+    """
+    Slugs libres et distincts entre eux pour `values`, dans le même ordre.
+    Le premier suffixe libre est pris (« base », puis « base-1 », « base-2 »...).
+    `reserved` : slugs pas encore en base mais déjà promis (même lot).
+    """
+    max_length = model._meta.get_field(field).max_length
+    bases = [_base_slug(value, max_length, default) for value in values]
+    taken = _taken_slugs(model, bases, field) | set(reserved)
+
+    slugs = []
+    for base in bases:
+        slug, counter = base, 1
+        while slug in taken:
+            suffix = f"-{counter}"
+            slug = f"{base[:max_length - len(suffix)]}{suffix}"
+            counter += 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+def allocate_slug(model, value, field='slug', default='item'):
+    return allocate_slugs(model, [value], field, default)[0]
+
+
+def with_unique_slug(model, value, save, field='slug', default='item'):
+    """
+    Appeler save(slug) avec un slug libre ; en cas de collision concurrente
+    sur ce slug, recalculer et réessayer (MAX_ATTEMPTS fois au plus).
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        slug = allocate_slug(model, value, field, default)
+        try:
+            with transaction.atomic():
+                return save(slug)
+        except IntegrityError:
+            # Une autre contrainte (nom unique...) : l'erreur n'est pas la nôtre
+            if attempt + 1 == MAX_ATTEMPTS or not model._default_manager.filter(**{field: slug}).exists():
+                raise
@@ -0,0 +1,97 @@
+"""
+Outils texte partagés : suppression du HTML, repli des accents, découpage en mots.
+"""
+import re
+import unicodedata
+from html import unescape
+
+# Balises après lesquelles on insère un séparateur pour ne pas coller les mots
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'li', 'ul', 'ol', 'tr', 'td', 'th', 'table', 'blockquote',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'section', 'article', 'figure', 'figcaption',
+}
+SKIPPED_TAGS = {'script', 'style', 'head', 'title'}
+
+STOPWORDS = frozenset("""
+    au aux avec ce ces dans de des du elle en et eux il ils je la le les leur lui ma mais me meme
+    mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton
+    tu un une vos votre vous c d j l m n s t y est sont ete etre avoir a
+    the and or of to in on for is are be it this that with as at by from an
+""".split())
+
+MAX_TOKEN_LENGTH = 64
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_SPACES_RE = re.compile(r'\s+')
+
+
+_SKIPPED_RE = re.compile(
+    r'<!--.*?-->|<(' + '|'.join(sorted(SKIPPED_TAGS)) + r')\b[^>]*>.*?</\1\s*>',
+    re.IGNORECASE | re.DOTALL,
+)
+_BLOCK_TAG_RE = re.compile(
+    r'</?(?:' + '|'.join(sorted(BLOCK_TAGS, key=len, reverse=True)) + r')\b[^>]*>',
+    re.IGNORECASE,
+)
+_TAG_RE = re.compile(r'<[^>]*>')
+
+
+def strip_html(html):
+    """
+    Texte brut d'un contenu HTML (CKEditor), espaces normalisés.
+
+    Quelques expressions régulières suffisent pour le HTML produit par
+    l'éditeur (attributs échappés) et évitent le coût d'un parseur complet.
+    """
+    if not html:
+        return ''
+    if '<' in html:
+        html = _SKIPPED_RE.sub(' ', html)
+        html = _BLOCK_TAG_RE.sub(' ', html)
+        html = _TAG_RE.sub('', html)
+    if '&' in html:
+        html = unescape(html)
+    return _SPACES_RE.sub(' ', html).strip()
+
+
+# Ligatures que NFKD ne décompose pas : « nœud » doit donner « noeud », pas « n ud »
+_LIGATURES = str.maketrans({'œ': 'oe', 'Œ': 'OE', 'æ': 'ae', 'Æ': 'AE', 'ß': 'ss', 'ẞ': 'SS'})
+
+
+def _fold_char(char):
+    decomposed = unicodedata.normalize('NFKD', char.translate(_LIGATURES))
+    base = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return base.lower() or ' '
+
+
+def fold_accents(text):
+    """Minuscules sans accents ni ligatures : « Réseau » -> « reseau », « Cœur » -> « coeur »"""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text.translate(_LIGATURES))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def fold_accents_aligned(text):
+    """
+    Comme fold_accents, caractère par caractère, avec pour chaque caractère
+    replié sa position dans `text` (« œ » donne deux caractères rattachés au
+    même). Renvoie (texte replié, positions) ; positions se termine par len(text).
+    """
+    folded, positions = [], []
+    for index, char in enumerate(text):
+        for folded_char in _fold_char(char):
+            folded.append(folded_char)
+            positions.append(index)
+    positions.append(len(text))
+    return ''.join(folded), positions
+
+
+def tokenize(text, keep_stopwords=False):
+    """Mots repliés (sans accents, minuscules) du texte, dans l'ordre"""
+    tokens = _TOKEN_RE.findall(fold_accents(text))
+    return [
+        token[:MAX_TOKEN_LENGTH]
+        for token in tokens
+        if keep_stopwords or token not in STOPWORDS
+    ]
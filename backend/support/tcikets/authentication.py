@@ -11,6 +11,7 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth import authenticate, login, logout
 from django.middleware.csrf import get_token
 from rest_framework_simplejwt.tokens import RefreshToken
+from support.utils.auth_cache import revoke_token
 from .serializers import UserSerializer, UserUpdateSerializer, ClientCreateSerializer,TechnicianCreateSerializer
 from django.contrib.auth import get_user_model
 from .models import Client, Technician
@@ -70,6 +71,9 @@ class LogoutView(generics.GenericAPIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
+        # Le jeton d'accès ne doit plus ouvrir de WebSocket (cache de JWTAuthMiddleware)
+        if request.auth is not None:
+            revoke_token(request.user.pk, request.auth.get('jti'), request.auth.get('exp'))
         logout(request)
         return Response({'message': 'Logout successful'})
 
@@ -0,0 +1,203 @@
+"""
+Autocomplétion (« search-as-you-type ») sur un index de préfixes.
+
+Chaque libellé (code de ticket ou d'intervention, titre de procédure, tag,
+nom d'utilisateur) est enregistré une fois par début de mot dans
+AutocompleteEntry : « TKT-N001-2026 Panne réseau » donne « tkt n001 2026 panne
+reseau », « n001 2026 panne reseau », ..., « reseau ». Une frappe devient une
+recherche par intervalle sur l'index de `key`, sans icontains.
+
+Les résultats sont mis en cache par préfixe et par périmètre ; quand le
+préfixe précédent avait une liste complète, la frappe suivante la filtre en
+mémoire au lieu d'interroger la base. Toute modification de l'index change la
+version des clés de cache.
+"""
+import hashlib
+import re
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from support.utils.text import fold_accents
+from .models import AutocompleteEntry, Intervention, Procedure, ProcedureTag, Ticket, User
+
+MIN_PREFIX_LENGTH = 2
+MAX_WORDS = 12  # débuts de mot indexés par libellé
+FETCH_LIMIT = 50
+DEFAULT_LIMIT = 8
+CACHE_TTL = 60
+VERSION_KEY = "autocomplete:version"
+
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    """« TKT-N001 Réseau » -> « tkt n001 reseau »"""
+    return _NON_ALNUM_RE.sub(' ', fold_accents(text or '')).strip()
+
+
+def prefix_keys(text):
+    """Une clé par début de mot : (clé, rang du mot)"""
+    words = normalize(text).split()
+    keys = {}
+    for position in range(min(len(words), MAX_WORDS)):
+        key = ' '.join(words[position:])[:64].rstrip()
+        keys.setdefault(key, position)
+    return list(keys.items())
+
+
+# -----------------------------
+# Libellés par type d'objet : (texte indexé, libellé affiché, ticket, poids)
+# -----------------------------
+def _ticket_entry(ticket):
+    return f"{ticket.code} {ticket.title}", f"{ticket.code} - {ticket.title}", ticket.pk, 4
+
+
+def _intervention_entry(intervention):
+    return intervention.code, intervention.code, intervention.ticket_id, 3
+
+
+def _procedure_entry(procedure):
+    return procedure.title, procedure.title, None, 2
+
+
+def _tag_entry(tag):
+    return tag.name, tag.name, None, 1
+
+
+def _user_entry(user):
+    label = user.get_full_name() or user.username
+    return f"{user.first_name} {user.last_name} {user.username}", label, None, 1
+
+
+AUTOCOMPLETE_MODELS = {
+    'ticket': (Ticket, _ticket_entry),
+    'intervention': (Intervention, _intervention_entry),
+    'procedure': (Procedure, _procedure_entry),
+    'tag': (ProcedureTag, _tag_entry),
+    'user': (User, _user_entry),
+}
+
+
+def _bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def index_object(kind, obj):
+    """Réécrire les clés de l'objet si son libellé a changé"""
+    _, build = AUTOCOMPLETE_MODELS[kind]
+    text, label, ticket_id, weight = build(obj)
+    label = label[:255]
+    rows = [
+        AutocompleteEntry(
+            key=key, kind=kind, object_id=obj.pk, ticket_id=ticket_id,
+            label=label, position=position, weight=weight,
+        )
+        for key, position in prefix_keys(text)
+    ]
+
+    existing = set(
+        AutocompleteEntry.objects.filter(kind=kind, object_id=obj.pk)
+        .values_list('key', 'label', 'position', 'ticket_id')
+    )
+    if existing == {(row.key, row.label, row.position, row.ticket_id) for row in rows}:
+        return False
+
+    with transaction.atomic():
+        AutocompleteEntry.objects.filter(kind=kind, object_id=obj.pk).delete()
+        AutocompleteEntry.objects.bulk_create(rows)
+    _bump_version()
+    return True
+
+
+def index_instance(kind, pk):
+    """Réindexer un objet à partir de sa clé (appelé après le commit)"""
+    model, _ = AUTOCOMPLETE_MODELS[kind]
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        remove_object(kind, pk)
+        return False
+    return index_object(kind, obj)
+
+
+def remove_object(kind, pk):
+    deleted, _ = AutocompleteEntry.objects.filter(kind=kind, object_id=pk).delete()
+    if deleted:
+        _bump_version()
+
+
+# -----------------------------
+# Recherche
+# -----------------------------
+def _scope(user):
+    """(nom du périmètre pour le cache, filtre sur les entrées liées à un ticket)"""
+    if user.is_staff or getattr(user, 'userType', '') == 'admin':
+        return 'all', Q()
+    if getattr(user, 'userType', '') == 'technician':
+        return f"user:{user.pk}", Q(ticket__isnull=True) | Q(ticket__technician__user=user)
+    if getattr(user, 'userType', '') == 'client':
+        return f"user:{user.pk}", Q(ticket__isnull=True) | Q(ticket__client__user=user)
+    return 'public', Q(ticket__isnull=True)
+
+
+def _cache_key(version, scope, prefix):
+    digest = hashlib.md5(prefix.encode()).hexdigest()
+    return f"autocomplete:{version}:{scope}:{digest}"
+
+
+def _fetch(prefix, scope_filter):
+    # L'intervalle [préfixe, préfixe suivant) utilise l'index de `key` ;
+    # startswith écarte ce que l'ordre de tri de la base y laisserait entrer
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    rows = list(
+        AutocompleteEntry.objects
+        .filter(key__gte=prefix, key__lt=upper, key__startswith=prefix)
+        .filter(scope_filter)
+        .order_by('position', '-weight', 'key')
+        .values_list('key', 'kind', 'object_id', 'label', 'ticket_id')[:FETCH_LIMIT]
+    )
+    return {
+        'complete': len(rows) < FETCH_LIMIT,
+        'rows': [
+            (key, kind, str(object_id), label, str(ticket_id) if ticket_id else None)
+            for key, kind, object_id, label, ticket_id in rows
+        ],
+    }
+
+
+def lookup(query, user, limit=DEFAULT_LIMIT):
+    """Meilleurs libellés commençant (à un début de mot) par la saisie"""
+    prefix = normalize(query)
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return []
+
+    scope, scope_filter = _scope(user)
+    version = cache.get_or_set(VERSION_KEY, 1, None)
+    key = _cache_key(version, scope, prefix)
+    entry = cache.get(key)
+
+    if entry is None:
+        # Saisie prolongée d'un caractère : la liste complète du préfixe précédent suffit
+        previous = cache.get(_cache_key(version, scope, prefix[:-1].rstrip()))
+        if previous is not None and previous['complete']:
+            entry = {
+                'complete': True,
+                'rows': [row for row in previous['rows'] if row[0].startswith(prefix)],
+            }
+        else:
+            entry = _fetch(prefix, scope_filter)
+        cache.set(key, entry, CACHE_TTL)
+
+    results, seen = [], set()
+    for _, kind, object_id, label, ticket_id in entry['rows']:
+        if (kind, object_id) in seen:
+            continue
+        seen.add((kind, object_id))
+        results.append({"type": kind, "id": object_id, "label": label, "ticket_id": ticket_id})
+        if len(results) >= limit:
+            break
+    return results
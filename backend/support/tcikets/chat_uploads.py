@@ -0,0 +1,132 @@
+"""
+Images de chat envoyées avant le message (voir ChatImageUploadView).
+
+Le fichier est écrit dans le stockage par morceaux (File.chunks) pendant la
+requête ; la miniature est calculée après le commit dans un petit pool de
+threads, puis annoncée au salon du ticket si le message est déjà parti.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image as PILImage
+
+from .models import ChatAttachment
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_CONTENT_TYPES = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/webp']
+MAX_UPLOAD_SIZE = getattr(settings, 'CHAT_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+THUMBNAIL_SIZE = (320, 320)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'CHAT_THUMBNAIL_WORKERS', 2),
+    thread_name_prefix='chat-thumbnails',
+)
+
+
+def create_attachment(ticket, user, image_file):
+    """Enregistrer l'image envoyée et planifier sa miniature"""
+    width = height = None
+    try:
+        # Image.open ne lit que l'en-tête : dimensions sans décoder l'image
+        with PILImage.open(image_file) as img:
+            width, height = img.size
+    except Exception:
+        pass
+    image_file.seek(0)
+
+    attachment = ChatAttachment.objects.create(
+        ticket=ticket,
+        uploaded_by=user,
+        file=image_file,
+        content_type=image_file.content_type,
+        file_size=image_file.size,
+        width=width,
+        height=height,
+    )
+    attachment_id = attachment.pk
+    transaction.on_commit(lambda: _executor.submit(_run_thumbnail, attachment_id))
+    return attachment
+
+
+def _run_thumbnail(attachment_id):
+    try:
+        generate_thumbnail(attachment_id)
+    except Exception as e:
+        logger.warning(f"Miniature impossible pour la pièce jointe {attachment_id}: {e}")
+    finally:
+        # Les connexions ouvertes dans ce thread ne seraient jamais fermées
+        connections.close_all()
+
+
+def generate_thumbnail(attachment_id):
+    attachment = ChatAttachment.objects.filter(pk=attachment_id).first()
+    if attachment is None or attachment.thumbnail:
+        return None
+
+    with attachment.file.open('rb') as source:
+        img = PILImage.open(source)
+        # Pour les JPEG, décoder directement à une résolution réduite
+        img.draft('RGB', THUMBNAIL_SIZE)
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.thumbnail(THUMBNAIL_SIZE, PILImage.Resampling.LANCZOS)
+
+        output = BytesIO()
+        img.save(output, format='JPEG', quality=80, optimize=True)
+
+    attachment.thumbnail.save(f"{attachment.pk}.jpg", ContentFile(output.getvalue()), save=False)
+    attachment.save(update_fields=['thumbnail'])
+
+    # Le message a pu être envoyé pendant le calcul de la miniature
+    message_id = ChatAttachment.objects.filter(pk=attachment_id).values_list('message_id', flat=True).first()
+    if message_id:
+        announce_thumbnail(attachment.ticket_id, message_id, attachment.thumbnail.url)
+    return attachment
+
+
+def announce_thumbnail(ticket_id, message_id, thumbnail_url):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(f'ticket_{ticket_id}', {
+        "type": "message_thumbnail",
+        "message_id": str(message_id),
+        "thumbnail_url": thumbnail_url,
+    })
+
+
+def claim_attachment(attachment_id, ticket_id, user):
+    """Pièce jointe envoyée par l'utilisateur sur ce ticket et pas encore utilisée"""
+    return ChatAttachment.objects.filter(
+        pk=attachment_id,
+        ticket_id=ticket_id,
+        uploaded_by=user,
+        message__isnull=True,
+    ).first()
+
+
+def send_with_attachment(message, attachment):
+    """
+    Enregistrer le message et lui rattacher la pièce jointe, une seule fois.
+
+    La miniature est relue après le commit : calculée avant, elle part avec
+    le message ; calculée après, generate_thumbnail voit le message et
+    l'annonce. Sans cette relecture, une miniature terminée entre la lecture
+    de la pièce jointe et le commit n'était jamais envoyée.
+    """
+    with transaction.atomic():
+        message.save()
+        claimed = ChatAttachment.objects.filter(
+            pk=attachment.pk, message__isnull=True
+        ).update(message=message)
+        if not claimed:
+            raise ValueError(f"Attachment {attachment.pk} already used")
+    attachment.refresh_from_db(fields=['thumbnail'])
+    return message
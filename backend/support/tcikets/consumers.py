@@ -5,13 +5,27 @@ import uuid
 import asyncio
 import base64
 import os
-from collections import defaultdict
 from datetime import datetime
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from django.core.files.base import ContentFile
 from django.core.cache import cache
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
 from .models import Ticket, Message
+from .pagination import encode_keyset_token, decode_keyset_token
+from . import presence
+from .permissions import can_access_ticket
+from .message_writer import message_writer
+from .typing_indicators import typing_aggregator
+from .chat_uploads import claim_attachment, send_with_attachment
+from .notifications import (
+    notification_group, serialize_notification, missed_notifications,
+    latest_resume_token, get_notification_counts,
+)
 from django.contrib.auth.models import AnonymousUser
 
 # For rate limiting events
@@ -19,6 +33,13 @@ TYPING_THROTTLE = 0.5  # seconds
 ONLINE_THROTTLE = 5.0  # seconds
 MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
 
+# Broadcast text messages before writing them (see tcikets.message_writer)
+CHAT_WRITE_BEHIND = getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+# History replay
+HISTORY_PAGE_SIZE = 50  # messages sent on connect
+MAX_HISTORY_PAGE_SIZE = 100
+
 def json_serialize(obj):
     """Convert UUID and datetime to JSON-serializable formats."""
     if isinstance(obj, uuid.UUID):
@@ -28,20 +49,7 @@ def json_serialize(obj):
     raise TypeError(f"Type {type(obj)} not serializable")
 
 class TicketChatConsumer(AsyncWebsocketConsumer):
-    # Use Redis for distributed tracking in production
-    CACHE_PREFIX = "ticket_chat_"
-    CACHE_TIMEOUT = 86400  # 24 hours
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.user_id = None
-        self.ticket_id = None
-        self.room_group_name = None
-        self.last_typing_time = 0
-        self.last_online_time = 0
-
-    active_connections = defaultdict(set)  # ticket_id -> set of channel_names
-    user_channels = defaultdict(dict)  # user_id -> {ticket_id: channel_name}
+    # Presence is shared between workers through the cache (see tcikets.presence)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -50,6 +58,8 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
         self.room_group_name = None
         self.last_typing_time = 0
         self.last_online_time = 0
+        self.typing_sources = {}  # worker id -> (users, expires_at), see typing_snapshot
+        self.last_typing_users = []
 
     async def connect(self):
         self.ticket_id = self.scope['url_route']['kwargs']['ticket_id']
@@ -63,10 +73,6 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
         self.user_id = str(user.id)
 
         if await self.has_permission(user, self.ticket_id):
-            # Add to active connections
-            self.active_connections[self.ticket_id].add(self.channel_name)
-            self.user_channels[self.user_id][self.ticket_id] = self.channel_name
-
             # Join room group
             await self.channel_layer.group_add(
                 self.room_group_name,
@@ -74,26 +80,32 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
             )
             
             await self.accept()
+
+            # Register in the shared presence registry
+            await sync_to_async(presence.join)(self.ticket_id, self.channel_name, user)
+            self.last_online_time = time.time()
             
             # Notify others that this user is online
             await self.notify_online(user)
+            await self.send_presence()
+
+            # Replay the latest messages so the client doesn't need the HTTP history
+            await self.send_history()
         else:
             await self.close()
 
     async def disconnect(self, close_code):
-        # Remove from active connections
-        if self.ticket_id and self.channel_name in self.active_connections.get(self.ticket_id, set()):
-            self.active_connections[self.ticket_id].discard(self.channel_name)
-            
-        if self.user_id and self.ticket_id in self.user_channels.get(self.user_id, {}):
-            del self.user_channels[self.user_id][self.ticket_id]
-            if not self.user_channels[self.user_id]:
-                del self.user_channels[self.user_id]
-        
-        # Notify others that this user is offline
+        # Remove from the presence registry
         user = self.scope["user"]
-        if not isinstance(user, AnonymousUser):
-            await self.notify_offline(user)
+        if self.ticket_id and self.user_id:
+            typing_aggregator.stopped(self.room_group_name, self.user_id)
+            still_online = await sync_to_async(presence.leave)(
+                self.ticket_id, self.channel_name, self.user_id
+            )
+
+            # Notify others that this user is offline, unless another connection remains
+            if not still_online and not isinstance(user, AnonymousUser):
+                await self.notify_offline(user)
             
         # Leave room group
         if self.room_group_name:
@@ -109,12 +121,21 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
             msg_type = data.get("type", "chat")
 
             if msg_type == "chat":
+                # Sending a message ends the typing indicator
+                typing_aggregator.stopped(self.room_group_name, str(user.id))
+
                 message = data.get("message", "")
                 message_id = data.get("id")
-                image_data = data.get("image")  # Base64 encoded image
+                image_data = data.get("image")  # Base64 encoded image (legacy path)
+                attachment_id = data.get("attachment_id")  # Image uploaded beforehand over HTTP
+
+                if CHAT_WRITE_BEHIND and message and not image_data and not attachment_id:
+                    # Text only: broadcast now, persist in the next batch
+                    await self.broadcast_then_persist(user, message, message_id)
+                    return
                 
                 # Save message to database
-                saved_message = await self.save_message(message, image_data, message_id)
+                saved_message = await self.save_message(message, image_data, message_id, attachment_id)
                 
                 if saved_message:
                     # Prepare event data
@@ -131,6 +152,9 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
                         event_data["message"] = saved_message.content
                     if saved_message.image:
                         event_data["image_url"] = saved_message.image.url
+                    thumbnail_url = getattr(saved_message, "thumbnail_url", None)
+                    if thumbnail_url:
+                        event_data["thumbnail_url"] = thumbnail_url
                     
                     await self.channel_layer.group_send(
                         self.room_group_name,
@@ -138,21 +162,32 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
                     )
 
             elif msg_type == "typing":
-                current_time = time.time()
-                if current_time - self.last_typing_time > TYPING_THROTTLE:
-                    self.last_typing_time = current_time
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            "type": "user_typing",
-                            "user_id": str(user.id),
-                            "user_name": f"{user.first_name} {user.last_name}",
-                            "channel_name": self.channel_name,
-                        }
-                    )
+                # Coalesced per room and broadcast as periodic snapshots (see tcikets.typing_indicators)
+                if data.get("is_typing", True) is False:
+                    typing_aggregator.stopped(self.room_group_name, str(user.id))
+                else:
+                    current_time = time.time()
+                    if current_time - self.last_typing_time > TYPING_THROTTLE:
+                        self.last_typing_time = current_time
+                        typing_aggregator.typing(
+                            self.room_group_name,
+                            str(user.id),
+                            f"{user.first_name} {user.last_name}",
+                        )
             elif msg_type == "ping":
+                # Ping doubles as the presence heartbeat
+                current_time = time.time()
+                if current_time - self.last_online_time > ONLINE_THROTTLE:
+                    self.last_online_time = current_time
+                    await sync_to_async(presence.heartbeat)(self.ticket_id, self.channel_name, user)
+
                 # Respond to ping with pong to keep connection alive
                 await self.send(text_data=json.dumps({"type": "pong", "timestamp": time.time()}))
+            elif msg_type == "presence":
+                await self.send_presence()
+            elif msg_type == "history":
+                # Page backwards from the cursor returned with the previous page
+                await self.send_history(before=data.get("before"), limit=data.get("limit"))
         except json.JSONDecodeError:
             print("Invalid JSON received")
         except Exception as e:
@@ -173,8 +208,67 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
             response_data["message"] = event["message"]
         if "image_url" in event:
             response_data["image_url"] = event["image_url"]
+        if "thumbnail_url" in event:
+            response_data["thumbnail_url"] = event["thumbnail_url"]
+        if event.get("client_id"):
+            # Lets the sender match its optimistic copy with the server id
+            response_data["client_id"] = event["client_id"]
         
         await self.send(text_data=json.dumps(response_data, default=json_serialize))
+
+    async def typing_snapshot(self, event):
+        # Merge the snapshots of every worker, without our own user
+        now = time.monotonic()
+        self.typing_sources[event["source"]] = (event["users"], now + event["expires_in"])
+        self.typing_sources = {
+            source: value for source, value in self.typing_sources.items() if value[1] > now
+        }
+
+        users = {}
+        for source_users, _ in self.typing_sources.values():
+            for entry in source_users:
+                if entry["user_id"] != self.user_id:
+                    users[entry["user_id"]] = entry
+        users = sorted(users.values(), key=lambda entry: entry["user_id"])
+        if users == self.last_typing_users:
+            return
+
+        previous_ids = {entry["user_id"] for entry in self.last_typing_users}
+        self.last_typing_users = users
+        await self.send(text_data=json.dumps({"type": "typing_snapshot", "users": users}))
+
+        # Per-user "typing" events for clients that don't read snapshots yet
+        for entry in users:
+            if entry["user_id"] not in previous_ids:
+                await self.send(text_data=json.dumps({
+                    "type": "typing",
+                    "user_id": entry["user_id"],
+                    "user_name": entry["user_name"],
+                }))
+
+    async def message_delivery(self, event):
+        # Sent by the write-behind writer once the message is in the database
+        await self.send(text_data=json.dumps({
+            "type": "delivery",
+            "id": event["message_id"],
+            "client_id": event.get("client_id"),
+            "status": event["status"],
+        }))
+
+    async def message_retracted(self, event):
+        # Broadcast message that could not be written: drop it from the conversation
+        await self.send(text_data=json.dumps({
+            "type": "message_retracted",
+            "id": event["message_id"],
+        }))
+
+    async def message_thumbnail(self, event):
+        # Thumbnail generated after the message was sent
+        await self.send(text_data=json.dumps({
+            "type": "thumbnail",
+            "id": event["message_id"],
+            "thumbnail_url": event["thumbnail_url"],
+        }))
        
     
     async def user_online(self, event):
@@ -204,6 +298,76 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
     # -----------------------------
     # Helper methods
     # -----------------------------
+    async def send_presence(self):
+        """Send the users currently online on the ticket, across all workers"""
+        users = await sync_to_async(presence.online_users)(self.ticket_id)
+        await self.send(text_data=json.dumps({
+            "type": "presence",
+            "users": users,
+        }, default=json_serialize))
+
+    async def broadcast_then_persist(self, user, content, client_id=None):
+        """
+        Write-behind path: no database round trip before the broadcast.
+        The id is always assigned here; the client's id is only echoed back
+        as client_id, so it can never collide with or overwrite another message.
+        """
+        client_id = str(client_id)[:64] if client_id else None
+        message = Message(
+            id=uuid.uuid4(),
+            ticket_id=self.ticket_id,
+            user_id=user.id,
+            content=content,
+            timestamp=timezone.now(),
+        )
+        await self.channel_layer.group_send(self.room_group_name, {
+            "type": "chat_message",
+            "user_id": str(user.id),
+            "user_type": getattr(user, 'userType', 'client'),
+            "message_id": str(message.id),
+            "client_id": client_id,
+            "timestamp": message.timestamp.isoformat(),
+            "message": content,
+        })
+        await message_writer.enqueue(
+            message, reply_channel=self.channel_name, group=self.room_group_name, client_id=client_id,
+        )
+
+    async def send_history(self, before=None, limit=None):
+        try:
+            limit = min(int(limit or HISTORY_PAGE_SIZE), MAX_HISTORY_PAGE_SIZE)
+        except (TypeError, ValueError):
+            limit = HISTORY_PAGE_SIZE
+
+        messages, has_more = await self.get_recent_messages(limit=max(limit, 1), before=before)
+        await self.send(text_data=json.dumps({
+            "type": "history",
+            "messages": [self.message_payload(message) for message in messages],
+            "has_more": has_more,
+            # Cursor of the oldest message sent, to request the previous page
+            "before": encode_keyset_token(messages[0].timestamp, messages[0].pk) if messages else None,
+        }, default=json_serialize))
+
+    @staticmethod
+    def message_payload(message):
+        """Same shape as the live "chat" events"""
+        payload = {
+            "type": "chat",
+            "id": str(message.id),
+            "user_id": str(message.user_id),
+            "user_name": f"{message.user.first_name} {message.user.last_name}",
+            "user_type": getattr(message.user, 'userType', 'client'),
+            "timestamp": message.timestamp,
+        }
+        if message.content:
+            payload["message"] = message.content
+        if message.image:
+            payload["image_url"] = message.image.url
+        attachment = getattr(message, "attachment", None)
+        if attachment is not None and attachment.thumbnail:
+            payload["thumbnail_url"] = attachment.thumbnail.url
+        return payload
+
     async def notify_online(self, user):
         await self.channel_layer.group_send(
             self.room_group_name,
@@ -235,33 +399,16 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
     # -----------------------------
     @database_sync_to_async
     def has_permission(self, user, ticket_id):
+        # Ticket membership is cached (see tcikets.permissions.ticket_members)
         try:
-            ticket = Ticket.objects.select_related(
-                'client', 'technician'
-            ).get(id=ticket_id)
-            
-            # Admin users have access to all tickets
-            if getattr(user, 'is_staff', False) or getattr(user, 'userType', '') == 'admin':
-                return True
-                
-            # Client can access their own tickets
-            if hasattr(user, 'client_profile') and user.client_profile == ticket.client:
-                return True
-                
-            # Technician can access assigned tickets
-            if hasattr(user, 'technician_profile') and user.technician_profile == ticket.technician:
-                return True
-                
-            return False
-        except Ticket.DoesNotExist:
-            return False
+            return can_access_ticket(user, ticket_id)
         except Exception as e:
             print(f"Permission check error: {e}")
             return False
         
         
     @database_sync_to_async
-    def save_message(self, content, image_data=None, message_id=None):
+    def save_message(self, content, image_data=None, message_id=None, attachment_id=None):
         """Save message to database, handling images if provided"""
         try:
             user = self.scope["user"]
@@ -273,6 +420,16 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
                 user=user,
                 content=content
             )
+
+            if attachment_id:
+                # The file is already in storage: just point the message at it
+                attachment = claim_attachment(attachment_id, self.ticket_id, user)
+                if attachment is None:
+                    raise ValueError(f"Unknown attachment {attachment_id}")
+                message.image = attachment.file.name
+                send_with_attachment(message, attachment)
+                message.thumbnail_url = attachment.thumbnail_url
+                return message
             
             # Handle image data if provided
             if image_data:
@@ -299,15 +456,119 @@ class TicketChatConsumer(AsyncWebsocketConsumer):
             return None
 
     @database_sync_to_async
-    def get_recent_messages(self, limit=50):
-        """Retrieve recent messages for the ticket"""
+    def get_recent_messages(self, limit=HISTORY_PAGE_SIZE, before=None):
+        """
+        Retrieve the messages preceding the `before` cursor (latest ones without
+        a cursor), oldest first. Returns (messages, has_more).
+        """
         try:
             messages = Message.objects.filter(
                 ticket_id=self.ticket_id
-            ).select_related('user').order_by('-timestamp')[:limit]
-            
+            ).select_related('user', 'attachment').order_by('-timestamp', '-id')
+
+            if before:
+                cursor = decode_keyset_token(before)
+                if cursor is None:
+                    return [], False
+                timestamp, pk = cursor
+                messages = messages.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+            messages = list(messages[:limit + 1])
+            has_more = len(messages) > limit
+
             # Convert to list in reverse order (oldest first)
-            return list(reversed(messages))
+            return list(reversed(messages[:limit])), has_more
         except Exception as e:
             print(f"Error retrieving messages: {e}")
-            return []
+            return [], False
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """
+    Per-user notification stream (ws/notifications/?token=<jwt>&since=<resume_token>).
+
+    New notifications are pushed by tcikets.notifications after commit. Every
+    pushed notification carries a resume_token; a reconnecting client passes the
+    last one it saw as `since` (or sends {"type": "resume", "since": ...}) and
+    only receives what it missed.
+    """
+
+    async def connect(self):
+        user = self.scope["user"]
+        if isinstance(user, AnonymousUser):
+            await self.close()
+            return
+
+        self.user_id = str(user.id)
+        self.group_name = notification_group(self.user_id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        since = query.get("since", [None])[0]
+        if since:
+            await self.send_missed(since)
+        else:
+            await self.send_hello()
+
+    async def disconnect(self, close_code):
+        if getattr(self, "group_name", None):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+
+        msg_type = data.get("type")
+        if msg_type == "resume" and data.get("since"):
+            await self.send_missed(data["since"])
+        elif msg_type == "ping":
+            await self.send(text_data=json.dumps({"type": "pong", "timestamp": time.time()}))
+
+    async def notification_new(self, event):
+        await self.send(text_data=json.dumps({
+            "type": "notification",
+            "notification": event["notification"],
+        }))
+
+    # -----------------------------
+    # Helper methods
+    # -----------------------------
+    async def send_hello(self):
+        """Current counters and the token to resume from, sent on a fresh connection"""
+        total, unread, token = await self.get_state()
+        await self.send(text_data=json.dumps({
+            "type": "hello",
+            "total_notifications": total,
+            "unread_notifications": unread,
+            "resume_token": token,
+        }))
+
+    async def send_missed(self, since):
+        notifications, has_more = await self.get_missed(since)
+        if notifications is None:
+            # Unknown token: the client has to reload the list over HTTP
+            await self.send(text_data=json.dumps({"type": "resync_required"}))
+            await self.send_hello()
+            return
+
+        await self.send(text_data=json.dumps({
+            "type": "missed",
+            "notifications": notifications,
+            "has_more": has_more,
+            "resume_token": notifications[-1]["resume_token"] if notifications else since,
+        }))
+
+    @database_sync_to_async
+    def get_state(self):
+        total, unread = get_notification_counts(self.user_id)
+        return total, unread, latest_resume_token(self.user_id)
+
+    @database_sync_to_async
+    def get_missed(self, since):
+        notifications, has_more = missed_notifications(self.user_id, since)
+        if notifications is None:
+            return None, False
+        return [serialize_notification(n) for n in notifications], has_more
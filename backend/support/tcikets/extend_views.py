@@ -22,7 +22,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import generics
 from rest_framework import permissions
 from django.utils import timezone
-from django.db.models import F
+from django.db.models import F, Max
 
 from rest_framework import generics, permissions
 from .models import Message, Ticket
@@ -56,6 +56,21 @@ from django.shortcuts import get_object_or_404
 from .models import Ticket, Message
 from .serializers import TicketSerializer, MessageSerializer
 from .permissions import IsAdminOrOwner
+from .mixins import CompactTicketListMixin, InstrumentedViewMixin
+from .notifications import get_notification_counts, mark_read
+from . import presence
+from . import chat_uploads
+from .view_counter import pending_views, record_view
+from . import versioning
+from . import procedure_transfer
+from . import procedure_jobs
+from . import procedure_links
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from support.utils.slugs import with_unique_slug
+from .models import ProcedureVersion
+from .serializers import ProcedureVersionSerializer
+from support.utils.request_metrics import endpoint_metrics
 
 from rest_framework.decorators import action
 from rest_framework.response import Response
@@ -114,9 +129,9 @@ class TicketViewSet(viewsets.ModelViewSet):
             serializer = MessageSerializer(message, context={'request': request})
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class ProcedureListCreateView(generics.ListCreateAPIView):
+class ProcedureListCreateView(InstrumentedViewMixin, generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    queryset = Procedure.objects.filter(is_active=True)
+    queryset = Procedure.objects.filter(is_active=True).defer('plain_text')
     serializer_class = ProcedureSerializer
 
     def get_queryset(self):
@@ -135,26 +150,20 @@ class ProcedureListCreateView(generics.ListCreateAPIView):
         # Handle images_ids if provided
         images_ids = self.request.data.get('images_ids', [])
         if images_ids:
-            for image_id in images_ids:
-                try:
-                    image = ProcedureImage.objects.get(id=image_id, procedure__isnull=True)
-                    image.procedure = procedure
-                    image.save()
-                except ProcedureImage.DoesNotExist:
-                    continue
-
-class ProcedureRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
+            procedure_links.link_images(procedure, images_ids)
+
+class ProcedureRetrieveUpdateDestroyView(InstrumentedViewMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    queryset = Procedure.objects.all()
+    queryset = Procedure.objects.defer('plain_text')
     serializer_class = ProcedureSerializer
 
-    def get_object(self):
-        obj = super().get_object()
-        # Increment view count only for GET requests
-        if self.request.method == 'GET':
-            obj.views += 1
-            obj.save(update_fields=['views'])
-        return obj
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        # Vue comptée en différé (view_counter), sans écriture sur la lecture
+        record_view(request, instance.pk)
+        instance.views += pending_views(instance.pk)
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
 
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -170,20 +179,182 @@ class ProcedureRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
         images_ids = request.data.get('images_ids', [])
         if images_ids:
             # Update existing orphaned images to link to this procedure
-            for image_id in images_ids:
-                try:
-                    image = ProcedureImage.objects.get(id=image_id)
-                    if image.procedure is None or image.procedure == instance:
-                        image.procedure = instance
-                        image.save()
-                except ProcedureImage.DoesNotExist:
-                    continue
+            procedure_links.link_images(instance, images_ids)
         
         return super().update(request, *args, **kwargs)
 
+    def perform_update(self, serializer):
+        # Auteur de la version créée par cette modification
+        serializer.instance._changed_by = self.request.user
+        serializer.save()
+
+
+class ProcedureVersionListView(generics.ListAPIView):
+    """Versions d'une procédure, sans leur contenu"""
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = ProcedureVersionSerializer
+    cursor_ordering = ('-version_number', '-id')
+
+    def get_queryset(self):
+        procedure = get_object_or_404(Procedure.objects.only('id'), pk=self.kwargs['pk'])
+        return (
+            ProcedureVersion.objects.filter(procedure=procedure)
+            .select_related('created_by')
+            .defer('content', 'content_delta')
+            .order_by('-version_number')
+        )
+
+
+class ProcedureVersionDetailView(APIView):
+    """Une version avec son contenu reconstruit"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk, version_number):
+        version = get_object_or_404(
+            ProcedureVersion.objects.select_related('created_by'),
+            procedure_id=pk, version_number=version_number,
+        )
+        data = ProcedureVersionSerializer(version).data
+        data['content'] = versioning.cached_version_content(version)
+        return Response(data)
+
+
+class ProcedureVersionDiffView(APIView):
+    """
+    Différence entre deux versions : ?from=<n>&to=<m>. Par défaut `to` est la
+    dernière version et `from` celle qui la précède.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        versions = ProcedureVersion.objects.filter(procedure_id=pk)
+        try:
+            to_number = request.query_params.get('to')
+            to_number = int(to_number) if to_number else versions.aggregate(n=Max('version_number'))['n']
+            from_number = request.query_params.get('from')
+            from_number = int(from_number) if from_number else versions.filter(
+                version_number__lt=to_number or 0
+            ).aggregate(n=Max('version_number'))['n']
+        except ValueError:
+            return Response({'error': 'from et to doivent être des numéros de version'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if to_number is None or from_number is None:
+            return Response({'error': 'Au moins deux versions sont nécessaires'},
+                            status=status.HTTP_404_NOT_FOUND)
+
+        found = {v.version_number: v for v in versions.filter(version_number__in=[from_number, to_number])}
+        if from_number not in found or to_number not in found:
+            return Response({'error': 'Version introuvable'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(versioning.version_diff(found[from_number], found[to_number]))
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def restore_procedure_version(request, pk, version_number):
+    """Remettre la procédure dans l'état d'une version ; crée une nouvelle version"""
+    procedure = get_object_or_404(Procedure, pk=pk)
+    if procedure.author != request.user and not request.user.is_staff:
+        return Response(
+            {'error': 'You do not have permission to update this procedure'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    version = get_object_or_404(ProcedureVersion, procedure=procedure, version_number=version_number)
+
+    procedure.title = version.title
+    procedure.description = version.description
+    procedure.content = versioning.cached_version_content(version)
+    procedure._changed_by = request.user
+    procedure._change_summary = f"Restauration de la version {version.version_number}"
+    procedure.save()
+    return Response(ProcedureSerializer(procedure, context={'request': request}).data)
+
+
+def _can_transfer_procedures(user):
+    return user.is_staff or getattr(user, 'userType', '') == 'admin'
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([permissions.IsAuthenticated])
+def export_procedures(request):
+    """
+    Export en masse. GET ?type=jsonl : lignes JSON sans fichiers, en flux.
+    POST : archive ZIP avec les fichiers, préparée en arrière-plan (202 et
+    job à suivre sur procedures/jobs/<id>/).
+    """
+    if not _can_transfer_procedures(request.user):
+        return Response(
+            {'error': 'You do not have permission to export procedures'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    if request.method == 'POST':
+        job = procedure_jobs.start_export(request.user)
+        return Response(_job_data(request, job), status=status.HTTP_202_ACCEPTED)
+
+    # ?format= est réservé par DRF au choix du renderer
+    export_format = request.query_params.get('type', 'jsonl')
+    if export_format != 'jsonl':
+        return Response({'error': 'type must be jsonl; POST to export a zip archive'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(procedure_transfer.iter_jsonl(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="procedures.jsonl"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+@parser_classes([MultiPartParser, FormParser])
+def import_procedures(request):
+    """Import en masse d'une archive ZIP ou d'un .jsonl, en arrière-plan ; relançable sans doublon"""
+    if not _can_transfer_procedures(request.user):
+        return Response(
+            {'error': 'You do not have permission to import procedures'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    upload = request.FILES.get('file')
+    if not upload:
+        return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
+
+    job = procedure_jobs.start_import(request.user, upload)
+    return Response(_job_data(request, job), status=status.HTTP_202_ACCEPTED)
+
+
+def _job_data(request, job):
+    data = {key: job[key] for key in ('id', 'kind', 'status', 'stats', 'errors', 'error')}
+    data['status_url'] = request.build_absolute_uri(reverse('procedure-job', args=[job['id']]))
+    if job['kind'] == 'export' and job['status'] == procedure_jobs.DONE:
+        data['download_url'] = request.build_absolute_uri(reverse('procedure-job-download', args=[job['id']]))
+    return data
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def procedure_job(request, job_id):
+    """État d'un export ou d'un import de procédures"""
+    job = procedure_jobs.get_job(job_id)
+    if not procedure_jobs.can_view_job(job, request.user):
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(_job_data(request, job))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def download_procedure_export(request, job_id):
+    """Archive d'un export terminé"""
+    job = procedure_jobs.get_job(job_id)
+    if not procedure_jobs.can_view_job(job, request.user) or job['kind'] != 'export':
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    if job['status'] != procedure_jobs.DONE or not procedure_jobs.storage.exists(job['file']):
+        return Response({'error': 'Export not ready'}, status=status.HTTP_409_CONFLICT)
+    return FileResponse(procedure_jobs.storage.open(job['file'], 'rb'), as_attachment=True,
+                        filename='procedures.zip', content_type='application/zip')
+
+
 class ProcedureImageListCreateView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = ProcedureImage.objects.all()
+    cursor_ordering = ('-uploaded_at', '-id')
     serializer_class = ProcedureImageSerializer
     parser_classes = [MultiPartParser, FormParser]
 
@@ -196,6 +367,7 @@ class ProcedureImageListCreateView(generics.ListCreateAPIView):
 class ProcedureAttachmentListCreateView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     queryset = ProcedureAttachment.objects.all()
+    cursor_ordering = ('-uploaded_at', '-id')
     serializer_class = ProcedureAttachmentSerializer
     parser_classes = [MultiPartParser, FormParser]
 
@@ -548,19 +720,9 @@ class ProcedureTagListCreateView(generics.ListCreateAPIView):
     serializer_class = ProcedureTagSerializer
 
     def perform_create(self, serializer):
-        # Auto-generate slug from name
-        from django.utils.text import slugify
+        # Slug libre calculé en une requête, recalculé en cas de collision concurrente
         name = serializer.validated_data['name']
-        slug = slugify(name)
-        
-        # Ensure unique slug
-        original_slug = slug
-        counter = 1
-        while ProcedureTag.objects.filter(slug=slug).exists():
-            slug = f"{original_slug}-{counter}"
-            counter += 1
-            
-        serializer.save(slug=slug)
+        with_unique_slug(ProcedureTag, name, lambda slug: serializer.save(slug=slug), default='tag')
 #new 
 
 '''class ProcedureListView(generics.ListAPIView):
@@ -705,7 +867,7 @@ class NotificationListView(generics.ListAPIView):
         return Notification.objects.filter(user=self.request.user)'''
         
 
-class NotificationListView(generics.ListAPIView):
+class NotificationListView(InstrumentedViewMixin, generics.ListAPIView):
     """Liste toutes les notifications de l'utilisateur connecté"""
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = NotificationSerializer
@@ -735,8 +897,9 @@ class NotificationDetailView(generics.RetrieveUpdateAPIView):
     def update(self, request, *args, **kwargs):
         """Marquer une notification comme lue"""
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        if not notification.is_read:
+            mark_read(request.user.id, Notification.objects.filter(pk=notification.pk))
+            notification.is_read = True
         
         serializer = self.get_serializer(notification)
         return Response(serializer.data)
@@ -745,34 +908,28 @@ class NotificationDetailView(generics.RetrieveUpdateAPIView):
 @permission_classes([IsAuthenticated])
 def mark_notification_read(request, pk):
     """Marquer une notification spécifique comme lue"""
-    try:
-        notification = Notification.objects.get(pk=pk, user=request.user)
-        notification.is_read = True
-        notification.save()
-        return Response({"message": "Notification marquée comme lue"}, status=status.HTTP_200_OK)
-    except Notification.DoesNotExist:
+    notifications = Notification.objects.filter(pk=pk, user=request.user)
+    if not mark_read(request.user.id, notifications) and not notifications.exists():
         return Response({"error": "Notification non trouvée"}, status=status.HTTP_404_NOT_FOUND)
+    return Response({"message": "Notification marquée comme lue"}, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def mark_all_notifications_read(request):
     """Marquer toutes les notifications comme lues"""
-    updated_count = Notification.objects.filter(
-        user=request.user, 
-        is_read=False
-    ).update(is_read=True)
+    updated_count = mark_read(request.user.id, Notification.objects.all())
     
     return Response({
         "message": f"{updated_count} notifications marquées comme lues"
     }, status=status.HTTP_200_OK)
 
 class NotificationStatsView(generics.RetrieveAPIView):
-    """Statistiques des notifications"""
+    """Statistiques des notifications (compteurs en cache, voir notifications.py)"""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 2
 
     def get(self, request, *args, **kwargs):
-        total = Notification.objects.filter(user=request.user).count()
-        unread = Notification.objects.filter(user=request.user, is_read=False).count()
+        total, unread = get_notification_counts(request.user.id)
         
         return Response({
             "total_notifications": total,
@@ -780,7 +937,94 @@ class NotificationStatsView(generics.RetrieveAPIView):
         })
     
 
-class ClientViewSet(viewsets.ModelViewSet):
+class TicketPresenceView(APIView):
+    """Utilisateurs connectés au chat d'un ticket (tous workers confondus)"""
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
+
+    def get(self, request, ticket_id):
+        ticket = get_object_or_404(
+            Ticket.objects.select_related('client__user', 'technician__user'),
+            pk=ticket_id,
+        )
+        self.check_object_permissions(request, ticket)
+        users = presence.online_users(ticket.pk)
+        return Response({
+            'ticket_id': str(ticket.pk),
+            'online_count': len(users),
+            'users': users,
+        })
+
+
+class ChatImageUploadView(APIView):
+    """
+    Envoi d'une image de chat avant le message WebSocket.
+
+    Renvoie l'identifiant de la pièce jointe à passer dans `attachment_id` du
+    message de chat ; la miniature est générée en arrière-plan.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrOwner]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request, ticket_id):
+        ticket = get_object_or_404(
+            Ticket.objects.select_related('client__user', 'technician__user'),
+            pk=ticket_id,
+        )
+        self.check_object_permissions(request, ticket)
+
+        image_file = request.FILES.get('image')
+        if not image_file:
+            return Response(
+                {'error': 'Image file is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if image_file.content_type not in chat_uploads.ALLOWED_CONTENT_TYPES:
+            return Response(
+                {'error': 'Invalid file type. Only JPEG, PNG, GIF, and WebP are allowed.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if image_file.size > chat_uploads.MAX_UPLOAD_SIZE:
+            return Response(
+                {'error': f'File size too large. Maximum size is {chat_uploads.MAX_UPLOAD_SIZE // (1024 * 1024)}MB.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        attachment = chat_uploads.create_attachment(ticket, request.user, image_file)
+        return Response({
+            'id': str(attachment.pk),
+            'image_url': request.build_absolute_uri(attachment.file.url),
+            'thumbnail_url': None,  # annoncée sur le socket quand elle est prête
+            'width': attachment.width,
+            'height': attachment.height,
+            'file_size': attachment.file_size,
+        }, status=status.HTTP_201_CREATED)
+
+
+class EndpointMetricsView(APIView):
+    """Histogramme glissant des latences et requêtes SQL par endpoint (admins)"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        if user.userType != 'admin' and not user.is_staff:
+            return Response(
+                {'error': 'You do not have permission to access endpoint metrics'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        try:
+            minutes = int(request.query_params.get('minutes', endpoint_metrics.RETENTION_WINDOWS))
+        except ValueError:
+            return Response({'error': 'minutes must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        endpoint = request.query_params.get('endpoint')
+        return Response({
+            'window_minutes': min(max(minutes, 1), endpoint_metrics.RETENTION_WINDOWS),
+            'endpoints': endpoint_metrics.snapshot(minutes=max(minutes, 1), endpoint=endpoint),
+        })
+
+
+class ClientViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = Client.objects.all()
     permission_classes = [permissions.IsAuthenticated]
     
@@ -789,7 +1033,7 @@ class ClientViewSet(viewsets.ModelViewSet):
             return ClientCreateSerializer
         return ClientSerializer
 
-class TechnicianViewSet(viewsets.ModelViewSet):
+class TechnicianViewSet(InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = Technician.objects.all()
     permission_classes = [permissions.IsAuthenticated]
     
@@ -800,7 +1044,7 @@ class TechnicianViewSet(viewsets.ModelViewSet):
 
 
     
-class TicketViewSet(viewsets.ModelViewSet):
+class TicketViewSet(CompactTicketListMixin, InstrumentedViewMixin, viewsets.ModelViewSet):
     queryset = Ticket.objects.all()
     permission_classes = [permissions.IsAuthenticated]
 
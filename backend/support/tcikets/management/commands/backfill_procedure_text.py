@@ -0,0 +1,33 @@
+# management/commands/backfill_procedure_text.py
+from django.core.management.base import BaseCommand
+
+from tcikets.models import Procedure
+
+
+class Command(BaseCommand):
+    help = "Calculer texte brut, aperçu, nombre de mots et temps de lecture des procédures existantes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--missing-only', action='store_true',
+                            help="Ne traiter que les procédures sans texte brut calculé")
+
+    def handle(self, *args, **options):
+        queryset = Procedure.objects.only('id', 'content').order_by('pk')
+        if options['missing_only']:
+            queryset = queryset.filter(plain_text='').exclude(content='')
+
+        batch, updated = [], 0
+        for procedure in queryset.iterator(chunk_size=options['batch_size']):
+            procedure.refresh_text_fields()
+            batch.append(procedure)
+            if len(batch) >= options['batch_size']:
+                # bulk_update : ni save() ni signaux, updated_at est conservé
+                Procedure.objects.bulk_update(batch, Procedure.TEXT_FIELDS)
+                updated += len(batch)
+                batch = []
+        if batch:
+            Procedure.objects.bulk_update(batch, Procedure.TEXT_FIELDS)
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"{updated} procédures mises à jour"))
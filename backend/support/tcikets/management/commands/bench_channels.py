@@ -0,0 +1,156 @@
+# management/commands/bench_channels.py
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesurer la diffusion du channel layer : N salons de ticket avec M participants, "
+        "latence de fan-out (group_send -> receive) et débit"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=50, help="Nombre de salons (tickets)")
+        parser.add_argument('--participants', type=int, default=5, help="Participants par salon")
+        parser.add_argument('--messages', type=int, default=20, help="Messages envoyés par salon")
+        parser.add_argument('--rate', type=float, default=0,
+                            help="Messages par seconde et par salon (0 = au plus vite)")
+        parser.add_argument('--payload-size', type=int, default=200, help="Taille du texte des messages")
+        parser.add_argument('--layer', choices=['memory', 'settings', 'redis'], default='memory',
+                            help="memory : couche en mémoire du processus ; settings : CHANNEL_LAYERS ; "
+                                 "redis : RedisChannelLayer sur --hosts")
+        parser.add_argument('--hosts', default='redis://localhost:6379',
+                            help="URLs Redis séparées par des virgules (avec --layer redis)")
+        parser.add_argument('--capacity', type=int, default=1000, help="Capacité des canaux (memory, redis)")
+        parser.add_argument('--timeout', type=float, default=30, help="Attente maximale des réceptions (s)")
+
+    def handle(self, *args, **options):
+        if options['rooms'] < 1 or options['participants'] < 1 or options['messages'] < 1:
+            raise CommandError("--rooms, --participants et --messages doivent être positifs")
+
+        layer = self.build_layer(options)
+        report = asyncio.run(self.run_benchmark(layer, options))
+        self.print_report(report, options)
+
+    def build_layer(self, options):
+        if options['layer'] == 'memory':
+            return InMemoryChannelLayer(capacity=options['capacity'])
+        if options['layer'] == 'settings':
+            layer = get_channel_layer()
+            if layer is None:
+                raise CommandError("Aucun channel layer configuré dans CHANNEL_LAYERS")
+            return layer
+
+        try:
+            from channels_redis.core import RedisChannelLayer
+        except ImportError:
+            raise CommandError("channels_redis n'est pas installé")
+        hosts = [host.strip() for host in options['hosts'].split(',') if host.strip()]
+        return RedisChannelLayer(hosts=hosts, prefix='bench', capacity=options['capacity'])
+
+    async def run_benchmark(self, layer, options):
+        rooms_count = options['rooms']
+        participants = options['participants']
+        messages = options['messages']
+        interval = 1 / options['rate'] if options['rate'] > 0 else 0
+        text = 'x' * options['payload_size']
+
+        # Salons et participants
+        rooms = []
+        for room in range(rooms_count):
+            group = f"bench_ticket_{room}"
+            channels = [await layer.new_channel(prefix=f"bench{room}.") for _ in range(participants)]
+            for channel in channels:
+                await layer.group_add(group, channel)
+            rooms.append((group, channels))
+
+        latencies = []
+
+        async def receive_all(channel):
+            for _ in range(messages):
+                event = await layer.receive(channel)
+                latencies.append(time.perf_counter() - event['sent_at'])
+
+        async def send_all(group):
+            for index in range(messages):
+                await layer.group_send(group, {
+                    "type": "chat_message",
+                    "message_id": f"{group}-{index}",
+                    "message": text,
+                    "sent_at": time.perf_counter(),
+                })
+                if interval:
+                    await asyncio.sleep(interval)
+                else:
+                    # Laisser les récepteurs avancer entre deux envois
+                    await asyncio.sleep(0)
+
+        receivers = [
+            asyncio.ensure_future(receive_all(channel))
+            for _, channels in rooms
+            for channel in channels
+        ]
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send_all(group) for group, _ in rooms))
+        send_elapsed = time.perf_counter() - started
+
+        done, pending = await asyncio.wait(receivers, timeout=options['timeout'])
+        elapsed = time.perf_counter() - started
+        for task in pending:
+            task.cancel()
+
+        for group, channels in rooms:
+            for channel in channels:
+                await layer.group_discard(group, channel)
+
+        return {
+            'sent': rooms_count * messages,
+            'expected': rooms_count * messages * participants,
+            'received': len(latencies),
+            'send_elapsed': send_elapsed,
+            'elapsed': elapsed,
+            'latencies': sorted(latencies),
+        }
+
+    def print_report(self, report, options):
+        latencies = report['latencies']
+        lost = report['expected'] - report['received']
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Channel layer benchmark"))
+        self.stdout.write(
+            f"  couche          : {options['layer']}\n"
+            f"  salons          : {options['rooms']} x {options['participants']} participants\n"
+            f"  messages        : {report['sent']} envoyés, "
+            f"{report['received']}/{report['expected']} reçus"
+        )
+        self.stdout.write(
+            f"  durée           : {report['elapsed']:.3f}s (envoi {report['send_elapsed']:.3f}s)\n"
+            f"  débit envoi     : {report['sent'] / report['send_elapsed']:.0f} group_send/s\n"
+            f"  débit livraison : {report['received'] / report['elapsed']:.0f} messages/s"
+        )
+        if latencies:
+            self.stdout.write(
+                "  latence fan-out : "
+                f"p50 {percentile(latencies, 0.50) * 1000:.2f}ms, "
+                f"p95 {percentile(latencies, 0.95) * 1000:.2f}ms, "
+                f"p99 {percentile(latencies, 0.99) * 1000:.2f}ms, "
+                f"max {latencies[-1] * 1000:.2f}ms"
+            )
+        if lost:
+            # Un message refusé par un canal plein laisse son récepteur en attente jusqu'au --timeout
+            self.stdout.write(self.style.WARNING(
+                f"  {lost} livraisons perdues (canaux pleins) : augmenter --capacity ou réduire --rate"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS("  aucune livraison perdue"))
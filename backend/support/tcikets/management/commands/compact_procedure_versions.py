@@ -0,0 +1,83 @@
+# management/commands/compact_procedure_versions.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tcikets import versioning
+from tcikets.models import ProcedureVersion
+
+
+class Command(BaseCommand):
+    help = (
+        "Compacter les versions des procédures : supprimer les versions identiques "
+        "à la précédente et réencoder le contenu en différences entre versions clés"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--procedure', action='append', help="Identifiant de procédure (répétable)")
+        parser.add_argument('--keyframe-interval', type=int, default=versioning.KEYFRAME_INTERVAL,
+                            help="Une version complète toutes les N versions")
+        parser.add_argument('--dry-run', action='store_true', help="Calculer sans rien modifier")
+
+    def handle(self, *args, **options):
+        procedure_ids = options['procedure'] or list(
+            ProcedureVersion.objects.order_by().values_list('procedure_id', flat=True).distinct()
+        )
+
+        totals = {'versions': 0, 'removed': 0, 'before': 0, 'after': 0}
+        for procedure_id in procedure_ids:
+            try:
+                with transaction.atomic():
+                    stats = self.compact(procedure_id, options['keyframe_interval'], options['dry_run'])
+                    if options['dry_run']:
+                        transaction.set_rollback(True)
+            except versioning.VersionChainError as e:
+                self.stderr.write(self.style.ERROR(f"Procédure {procedure_id} ignorée : {e}"))
+                continue
+            for key, value in stats.items():
+                totals[key] += value
+
+        saved = totals['before'] - totals['after']
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(procedure_ids)} procédures, {totals['versions']} versions, "
+            f"{totals['removed']} doublons supprimés, stockage {totals['before']} -> {totals['after']} "
+            f"caractères ({saved} économisés)"
+            + (" [simulation]" if options['dry_run'] else "")
+        ))
+
+    def compact(self, procedure_id, keyframe_interval, dry_run):
+        versions = list(
+            ProcedureVersion.objects.select_for_update()
+            .filter(procedure_id=procedure_id)
+            .order_by('version_number')
+        )
+        stats = {
+            'versions': len(versions),
+            'removed': 0,
+            'before': sum(len(v.content) + len(v.content_delta) for v in versions),
+            'after': 0,
+        }
+
+        kept, removed_ids = [], []
+        previous = None  # (titre, description, contenu) de la dernière version gardée
+        since_keyframe = keyframe_interval
+        for version, content in versioning.iter_version_contents(versions):
+            state = (version.title, version.description, content)
+            if state == previous:
+                removed_ids.append(version.pk)
+                continue
+
+            keyframe = previous is None or since_keyframe >= keyframe_interval
+            versioning.encode_version_content(version, content, None if previous is None else previous[2], keyframe)
+            since_keyframe = 1 if version.is_keyframe else since_keyframe + 1
+            previous = state
+            kept.append(version)
+
+        stats['removed'] = len(removed_ids)
+        stats['after'] = sum(len(v.content) + len(v.content_delta) for v in kept)
+        if not dry_run:
+            ProcedureVersion.objects.filter(pk__in=removed_ids).delete()
+            ProcedureVersion.objects.bulk_update(
+                kept, ['is_keyframe', 'content', 'content_delta', 'content_checksum'], batch_size=100
+            )
+            transaction.on_commit(lambda: versioning.invalidate_versions(procedure_id))
+        return stats
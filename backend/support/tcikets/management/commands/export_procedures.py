@@ -0,0 +1,29 @@
+# management/commands/export_procedures.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from tcikets import procedure_transfer
+
+
+class Command(BaseCommand):
+    help = "Exporter les procédures (tags, images, pièces jointes) dans une archive ZIP ou un fichier .jsonl"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Fichier de destination (.zip avec les fichiers, .jsonl sans)")
+        parser.add_argument('--chunk-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path.endswith('.jsonl'):
+            count = 0
+            with open(path, 'w', encoding='utf-8') as output:
+                for line in procedure_transfer.iter_jsonl(chunk_size=options['chunk_size']):
+                    output.write(line)
+                    count += 1
+            stats = {'procedures': count}
+        else:
+            stats = procedure_transfer.export_archive(path, chunk_size=options['chunk_size'])
+
+        self.stdout.write(json.dumps(stats))
+        self.stdout.write(self.style.SUCCESS(f"{stats['procedures']} procédures exportées vers {path}"))
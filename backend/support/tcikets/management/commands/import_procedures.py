@@ -0,0 +1,49 @@
+# management/commands/import_procedures.py
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tcikets import procedure_transfer
+from tcikets.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Importer des procédures depuis une archive ZIP ou un fichier .jsonl. "
+        "Les procédures et fichiers déjà présents (même id) sont ignorés : "
+        "un import interrompu peut être relancé sur le même fichier."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--author', help="Auteur des procédures dont l'auteur exporté n'existe pas")
+        parser.add_argument('--batch-size', type=int, default=procedure_transfer.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=procedure_transfer.DEFAULT_WORKERS,
+                            help="Threads d'écriture des fichiers")
+        parser.add_argument('--skip-media', action='store_true', help="Ne pas importer les fichiers")
+
+    def handle(self, *args, **options):
+        author = None
+        if options['author']:
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f"Utilisateur {options['author']} introuvable")
+
+        path = options['path']
+        with open(path, 'rb') as source:
+            stats, errors = procedure_transfer.import_procedures(
+                source,
+                base_dir=os.path.dirname(os.path.abspath(path)),
+                default_author=author,
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                with_media=not options['skip_media'],
+            )
+
+        for error in errors:
+            self.stderr.write(error)
+        self.stdout.write(json.dumps(stats))
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['created']} procédures importées, {stats['skipped']} déjà présentes"
+        ))
@@ -0,0 +1,27 @@
+# management/commands/rebuild_autocomplete.py
+from django.core.management.base import BaseCommand
+
+from tcikets.autocomplete import AUTOCOMPLETE_MODELS, index_object
+from tcikets.models import AutocompleteEntry
+
+
+class Command(BaseCommand):
+    help = "Reconstruire l'index de préfixes de l'autocomplétion"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(AUTOCOMPLETE_MODELS), action='append',
+                            help="Type d'objet à réindexer (répétable, tous par défaut)")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or list(AUTOCOMPLETE_MODELS):
+            model, _ = AUTOCOMPLETE_MODELS[kind]
+            changed = 0
+            for obj in model.objects.all().iterator(chunk_size=options['chunk_size']):
+                changed += index_object(kind, obj)
+
+            existing = model.objects.values('pk')
+            removed, _ = AutocompleteEntry.objects.filter(kind=kind).exclude(object_id__in=existing).delete()
+            self.stdout.write(f"{kind}: {changed} mis à jour, {removed} clés supprimées")
+
+        self.stdout.write(self.style.SUCCESS("Index d'autocomplétion reconstruit"))
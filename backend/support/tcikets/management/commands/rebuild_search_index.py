@@ -0,0 +1,44 @@
+# management/commands/rebuild_search_index.py
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from tcikets.models import SearchDocument
+from tcikets.search_index import INDEXED_MODELS, STATS_CACHE_KEY, index_objects
+
+
+class Command(BaseCommand):
+    help = "Reconstruire l'index de recherche plein texte (tickets, procédures, interventions, messages)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(INDEXED_MODELS), action='append',
+                            help="Type d'objet à réindexer (répétable, tous par défaut)")
+        parser.add_argument('--clear', action='store_true',
+                            help="Supprimer les documents existants avant de réindexer")
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        kinds = options['kind'] or list(INDEXED_MODELS)
+
+        for kind in kinds:
+            model, _ = INDEXED_MODELS[kind]
+            if options['clear']:
+                SearchDocument.objects.filter(kind=kind).delete()
+
+            indexed, chunk = 0, []
+            for obj in model.objects.all().iterator(chunk_size=options['chunk_size']):
+                chunk.append(obj)
+                if len(chunk) >= options['chunk_size']:
+                    index_objects(kind, chunk)
+                    indexed += len(chunk)
+                    chunk = []
+            if chunk:
+                index_objects(kind, chunk)
+                indexed += len(chunk)
+
+            # Documents d'objets supprimés sans passer par les signaux
+            existing = model.objects.values('pk')
+            removed, _ = SearchDocument.objects.filter(kind=kind).exclude(object_id__in=existing).delete()
+            self.stdout.write(f"{kind}: {indexed} indexés, {removed} supprimés")
+
+        cache.delete(STATS_CACHE_KEY)
+        self.stdout.write(self.style.SUCCESS("Index de recherche reconstruit"))
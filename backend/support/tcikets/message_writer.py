@@ -0,0 +1,188 @@
+"""
+Écriture différée (write-behind) des messages de chat.
+
+Le consumer diffuse le message immédiatement puis le confie au writer du
+processus : les messages sont regroupés pendant FLUSH_INTERVAL secondes (ou
+jusqu'à BATCH_SIZE) et écrits avec un seul bulk_create. Un lot en échec est
+réessayé, puis écrit message par message pour isoler les lignes fautives.
+
+L'id d'un message est attribué par le serveur (celui du client n'est qu'un
+écho `client_id`). Un id déjà en base n'est jamais écrasé ni ignoré en
+silence : il est signalé `duplicate` si le message stocké est identique,
+`failed` sinon. L'horodatage diffusé est celui qui est enregistré.
+L'expéditeur reçoit un événement `message_delivery` (persisted / duplicate /
+failed) ; un message définitivement perdu est retiré chez tous les
+participants par un événement `message_retracted` envoyé au groupe.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, Value, When
+
+from .models import Message
+from .search_index import index_messages
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL', 0.01)  # secondes
+BATCH_SIZE = getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 200)
+MAX_RETRIES = 3
+RETRY_DELAY = 0.2  # secondes, doublé à chaque tentative
+
+PERSISTED = 'persisted'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+
+
+class MessageBatchWriter:
+    """File d'écriture par boucle d'événements (un worker ASGI = une boucle)"""
+
+    def __init__(self):
+        self._queue = None
+        self._task = None
+        self._loop = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def enqueue(self, message, reply_channel=None, group=None, client_id=None):
+        """
+        Planifier l'écriture du message ; la confirmation part vers
+        reply_channel, le retrait éventuel vers le groupe qui l'a reçu.
+        """
+        self._ensure_started()
+        await self._queue.put((message, reply_channel, group, client_id))
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._flush(batch)
+            except Exception:
+                # La boucle d'écriture ne doit jamais s'arrêter
+                logger.exception("Échec inattendu de l'écriture des messages de chat")
+
+    async def _flush(self, batch):
+        messages = [message for message, *_ in batch]
+
+        for attempt in range(MAX_RETRIES):
+            try:
+                inserted, statuses = await database_sync_to_async(self._bulk_write)(messages)
+                break
+            except Exception as e:
+                logger.warning(f"Écriture groupée de {len(messages)} messages impossible (essai {attempt + 1}): {e}")
+                await asyncio.sleep(RETRY_DELAY * (2 ** attempt))
+        else:
+            inserted, statuses = await database_sync_to_async(self._write_one_by_one)(messages)
+
+        await self._confirm(batch, statuses)
+
+        # bulk_create n'envoie pas post_save : indexation des seules lignes écrites
+        if inserted:
+            try:
+                await database_sync_to_async(index_messages)(inserted)
+            except Exception as e:
+                logger.warning(f"Indexation de {len(inserted)} messages impossible: {e}")
+
+    @staticmethod
+    def _conflict_statuses(messages):
+        """Statut de chaque message dont l'id est déjà pris (en base ou plus tôt dans le lot), sinon None"""
+        stored = {
+            message.id: message
+            for message in Message.objects.filter(pk__in={message.id for message in messages})
+            .only('id', 'ticket_id', 'user_id', 'content')
+        }
+        statuses = []
+        for message in messages:
+            previous = stored.get(message.id)
+            if previous is None:
+                stored[message.id] = message
+                statuses.append(None)
+            elif (previous.ticket_id, previous.user_id, previous.content) == (
+                    message.ticket_id, message.user_id, message.content):
+                statuses.append(DUPLICATE)
+            else:
+                logger.warning(f"Message {message.id} refusé : id déjà utilisé par un autre message")
+                statuses.append(FAILED)
+        return statuses
+
+    @classmethod
+    def _bulk_write(cls, messages):
+        """
+        Écrire les messages dont l'id est libre ; renvoie (messages écrits,
+        statut de chaque message du lot). Un id pris entre la vérification et
+        l'INSERT fait échouer le lot, qui est alors vérifié à nouveau.
+        """
+        statuses = cls._conflict_statuses(messages)
+        new = [message for message, status in zip(messages, statuses) if status is None]
+        if new:
+            # auto_now_add remplace l'horodatage déjà diffusé : il est remis ensuite
+            broadcast = [(message, message.timestamp) for message in new if message.timestamp]
+            with transaction.atomic():
+                Message.objects.bulk_create(new)
+                if broadcast:
+                    Message.objects.filter(pk__in=[message.pk for message, _ in broadcast]).update(
+                        timestamp=Case(
+                            *[When(pk=message.pk, then=Value(timestamp)) for message, timestamp in broadcast],
+                            output_field=DateTimeField(),
+                        )
+                    )
+            for message, timestamp in broadcast:
+                message.timestamp = timestamp
+        return new, [status or PERSISTED for status in statuses]
+
+    @classmethod
+    def _write_one_by_one(cls, messages):
+        inserted, statuses = [], []
+        for message in messages:
+            try:
+                written, (status,) = cls._bulk_write([message])
+            except Exception as e:
+                logger.error(f"Message {message.id} non enregistré: {e}")
+                written, status = [], FAILED
+            inserted += written
+            statuses.append(status)
+        return inserted, statuses
+
+    async def _confirm(self, batch, statuses):
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        for (message, reply_channel, group, client_id), status in zip(batch, statuses):
+            try:
+                if reply_channel:
+                    await channel_layer.send(reply_channel, {
+                        "type": "message_delivery",
+                        "message_id": str(message.id),
+                        "client_id": client_id,
+                        "status": status,
+                    })
+                if status == FAILED and group:
+                    # Déjà diffusé à la salle : les autres participants le retirent
+                    await channel_layer.group_send(group, {
+                        "type": "message_retracted",
+                        "message_id": str(message.id),
+                    })
+            except Exception as e:
+                logger.warning(f"Confirmation du message {message.id} impossible: {e}")
+
+
+message_writer = MessageBatchWriter()
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tcikets', '0003_list_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketCodeSequence',
+            fields=[
+                ('year', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('last_value', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Séquence de codes ticket',
+                'verbose_name_plural': 'Séquences de codes ticket',
+            },
+        ),
+    ]
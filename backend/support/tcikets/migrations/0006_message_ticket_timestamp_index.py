@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tcikets', '0005_notification_login_digest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['ticket', '-timestamp'], name='tcikets_mes_ticket__38ee4e_idx'),
+        ),
+    ]
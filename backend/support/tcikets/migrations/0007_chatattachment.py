@@ -0,0 +1,38 @@
+# Generated by Django 5.2.5 on 2026-10-18 12:25
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tcikets', '0006_message_ticket_timestamp_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatAttachment',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file', models.ImageField(upload_to='chat_images/%Y/%m/%d/')),
+                ('thumbnail', models.ImageField(blank=True, null=True, upload_to='chat_images/thumbs/%Y/%m/%d/')),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('file_size', models.PositiveIntegerField(blank=True, null=True)),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='attachment', to='tcikets.message')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_attachments', to='tcikets.ticket')),
+                ('uploaded_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_attachments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Pièce jointe de chat',
+                'verbose_name_plural': 'Pièces jointes de chat',
+                'ordering': ['-uploaded_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tcikets', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutocompleteEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('kind', models.CharField(choices=[('ticket', 'Ticket'), ('intervention', 'Intervention'), ('procedure', 'Procédure'), ('tag', 'Tag'), ('user', 'Utilisateur')], max_length=20)),
+                ('object_id', models.UUIDField()),
+                ('label', models.CharField(max_length=255)),
+                ('position', models.PositiveSmallIntegerField(default=0)),
+                ('weight', models.PositiveSmallIntegerField(default=0)),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tcikets.ticket')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key'], name='tcikets_aut_key_2ffbc8_idx'), models.Index(fields=['kind', 'object_id'], name='tcikets_aut_kind_3cab99_idx')],
+            },
+        ),
+    ]
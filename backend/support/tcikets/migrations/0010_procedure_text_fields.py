@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tcikets', '0009_autocompleteentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='procedure',
+            name='plain_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='procedure',
+            name='preview',
+            field=models.CharField(blank=True, default='', editable=False, max_length=210),
+        ),
+        migrations.AddField(
+            model_name='procedure',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='procedure',
+            name='reading_time',
+            field=models.PositiveSmallIntegerField(default=1, editable=False),
+        ),
+    ]
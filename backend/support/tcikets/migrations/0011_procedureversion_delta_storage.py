@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tcikets', '0010_procedure_text_fields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='procedureversion',
+            name='content',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='procedureversion',
+            name='is_keyframe',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='procedureversion',
+            name='content_delta',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='procedureversion',
+            name='content_checksum',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 19:05
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def backfill_indexes(apps, schema_editor):
+    """
+    Index plein texte et autocomplétion des lignes existantes : les signaux
+    n'indexent que ce qui est sauvegardé après le déploiement. L'index de
+    recherche est vidé d'abord, les mots déjà indexés ayant pu être mal repliés
+    (œ, æ, ß). Rien à faire sur une base vide.
+    """
+    sources = ['Ticket', 'Procedure', 'Intervention', 'Message', 'ProcedureTag', 'User']
+    if not any(apps.get_model('tcikets', name).objects.exists() for name in sources):
+        return
+    call_command('rebuild_search_index', clear=True, verbosity=0)
+    call_command('rebuild_autocomplete', verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tcikets', '0011_procedureversion_delta_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_indexes, migrations.RunPython.noop),
+    ]
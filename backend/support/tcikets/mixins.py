@@ -0,0 +1,50 @@
+from rest_framework.response import Response
+
+from support.utils.request_metrics import time_serializer
+from .serializers import TicketListSerializer
+
+
+def wants_compact_tickets(request):
+    """La représentation compacte est demandée avec ?view=compact"""
+    return request.query_params.get('view') == 'compact'
+
+
+class CompactTicketListMixin:
+    """
+    Sert les listes de tickets avec TicketListSerializer quand ?view=compact
+    est passé, le détail garde la représentation complète.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not wants_compact_tickets(request):
+            return super().list(request, *args, **kwargs)
+
+        queryset = TicketListSerializer.setup_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        context = self.get_serializer_context()
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = TicketListSerializer(page, many=True, context=context)
+            time_serializer(request, serializer)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = TicketListSerializer(queryset, many=True, context=context)
+        time_serializer(request, serializer)
+        return Response(serializer.data)
+
+
+class InstrumentedViewMixin:
+    """
+    Mesure le temps de sérialisation de la vue pour RequestMetricsMiddleware.
+
+    `query_budget` déclare le nombre maximum de requêtes SQL attendu pour
+    l'endpoint : un dépassement est journalisé, ou lève QueryBudgetExceeded
+    quand QUERY_BUDGET_STRICT est activé (dans les tests par exemple).
+    """
+    query_budget = None
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        return time_serializer(self.request, serializer)
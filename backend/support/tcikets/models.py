@@ -1,5 +1,7 @@
+import logging
 import uuid
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings
 from django.core.validators import RegexValidator,MinValueValidator,MaxValueValidator
@@ -11,10 +13,14 @@ import uuid
 import os
 from django.utils.text import slugify
 from django_ckeditor_5.fields import CKEditor5Field
+from support.utils.slugs import with_unique_slug
+from support.utils.text import strip_html
 from PIL import Image as PILImage
 from io import BytesIO
 from django.core.files.base import ContentFile
 
+logger = logging.getLogger(__name__)
+
 # Phone validator
 phone_regex = RegexValidator(
     regex=r'^\+?242?\d{9,15}$',
@@ -97,6 +103,9 @@ class User(AbstractUser):
 
     class Meta:
         swappable = 'AUTH_USER_MODEL'
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
 
 class ProcedureTag(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -107,9 +116,15 @@ class ProcedureTag(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        if self.slug:
+            super().save(*args, **kwargs)
+            return
+
+        def save_with_slug(slug):
+            self.slug = slug
+            super(ProcedureTag, self).save(*args, **kwargs)
+
+        with_unique_slug(ProcedureTag, self.name, save_with_slug, default='tag')
     
     def __str__(self):
         return self.name
@@ -167,44 +182,51 @@ class Procedure(models.Model):
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     meta_description = models.CharField(max_length=160, blank=True, help_text="SEO meta description")
     featured = models.BooleanField(default=False, db_index=True)
+
+    # Dérivés du contenu, recalculés à chaque sauvegarde du contenu (voir refresh_text_fields)
+    plain_text = models.TextField(blank=True, default='', editable=False)
+    preview = models.CharField(max_length=210, blank=True, default='', editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveSmallIntegerField(default=1, editable=False)  # minutes
     
     # Relations
     tags = models.ManyToManyField(ProcedureTag, related_name='procedures', blank=True)
     related_procedures = models.ManyToManyField('self', symmetrical=True, blank=True)
     
+    TEXT_FIELDS = ('plain_text', 'preview', 'word_count', 'reading_time')
+    PREVIEW_LENGTH = 200
+    WORDS_PER_MINUTE = 200
+
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = self._generate_unique_slug()
         if not self.meta_description and self.description:
             self.meta_description = self.description[:157] + "..."
-        super().save(*args, **kwargs)
-    
-    def _generate_unique_slug(self):
-        """Generate a unique slug for the procedure"""
-        slug = slugify(self.title)
-        original_slug = slug
-        counter = 1
-        
-        while Procedure.objects.filter(slug=slug).exists():
-            slug = f"{original_slug}-{counter}"
-            counter += 1
-        
-        return slug
-    
-    @property
-    def reading_time(self):
-        """Calculate estimated reading time in minutes"""
-        if not self.content:
-            return 1
-        
-        # Remove HTML tags and count words
-        import re
-        clean = re.compile('<.*?>')
-        plain_text = re.sub(clean, '', self.content)
-        word_count = len(plain_text.split())
-        
-        # Average reading speed: 200 words per minute
-        return max(1, round(word_count / 200))
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.refresh_text_fields()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.TEXT_FIELDS)
+
+        if self.slug:
+            super().save(*args, **kwargs)
+            return
+
+        def save_with_slug(slug):
+            self.slug = slug
+            super(Procedure, self).save(*args, **kwargs)
+
+        with_unique_slug(Procedure, self.title, save_with_slug, default='procedure')
+
+    def refresh_text_fields(self):
+        """Calculer texte brut, aperçu, nombre de mots et temps de lecture depuis `content`"""
+        self.plain_text = strip_html(self.content)
+        if len(self.plain_text) > self.PREVIEW_LENGTH:
+            self.preview = self.plain_text[:self.PREVIEW_LENGTH] + "..."
+        else:
+            self.preview = self.plain_text
+        self.word_count = len(self.plain_text.split())
+        # Vitesse de lecture moyenne : 200 mots par minute
+        self.reading_time = max(1, round(self.word_count / self.WORDS_PER_MINUTE))
     
     @property
     def has_media(self):
@@ -395,7 +417,12 @@ class ProcedureVersion(models.Model):
     version_number = models.PositiveIntegerField()
     title = models.CharField(max_length=200)
     description = models.TextField()
-    content = models.TextField()
+    # Contenu complet pour les versions clés, sinon différence avec la version précédente
+    # (voir tcikets.versioning ; lire le contenu avec versioning.version_content)
+    content = models.TextField(blank=True)
+    is_keyframe = models.BooleanField(default=True)
+    content_delta = models.TextField(blank=True, default='')
+    content_checksum = models.CharField(max_length=32, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     change_summary = models.TextField(blank=True)
@@ -412,22 +439,23 @@ from django.dispatch import receiver
 
 @receiver(post_save, sender=Procedure)
 def create_procedure_version(sender, instance, created, **kwargs):
-    """Create a version record when procedure is saved"""
-    if not created:  # Only for updates, not initial creation
-        try:
-            last_version = instance.versions.first()
-            version_number = (last_version.version_number + 1) if last_version else 1
-            
-            ProcedureVersion.objects.create(
-                procedure=instance,
-                version_number=version_number,
-                title=instance.title,
-                description=instance.description,
-                content=instance.content,
-                created_by=instance.author,
-            )
-        except Exception:
-            pass  # Don't fail procedure save if version creation fails
+    """Create a version record when versioned fields of the procedure change"""
+    if created:  # Only for updates, not initial creation
+        return
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and not set(update_fields) & {'title', 'description', 'content'}:
+        return  # Compteurs (views, likes...) : rien à versionner
+
+    from .versioning import record_version
+    try:
+        # Auteur et résumé éventuels posés par la vue (restauration par exemple)
+        record_version(
+            instance,
+            user=getattr(instance, '_changed_by', None),
+            change_summary=getattr(instance, '_change_summary', ''),
+        )
+    except Exception:
+        logger.exception(f"Version de la procédure {instance.pk} non enregistrée")
 
 @receiver(pre_delete, sender=ProcedureImage)
 def delete_image_file(sender, instance, **kwargs):
@@ -448,6 +476,11 @@ def delete_attachment_file(sender, instance, **kwargs):
             pass
 
 class Notification(models.Model):
+    KIND_CHOICES = [
+        ('standard', 'Standard'),
+        ('login_digest', 'Résumé de connexion'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
     title = models.CharField(max_length=200)
@@ -455,9 +488,22 @@ class Notification(models.Model):
     ticket = models.ForeignKey('Ticket', on_delete=models.CASCADE, null=True, blank=True)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='standard')
+    expires_at = models.DateTimeField(null=True, blank=True)  # Pour les résumés recalculés périodiquement
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+        constraints = [
+            # Un seul résumé de connexion par utilisateur, mis à jour en place
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(kind='login_digest'),
+                name='unique_login_digest_per_user',
+            ),
+        ]
         
     def __str__(self):
         return f"{self.title} - {self.user.username}"
@@ -489,6 +535,11 @@ class Client(models.Model):
 
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.company}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
     
 #=================
 # Technician with UUID
@@ -525,6 +576,77 @@ class Technician(models.Model):
         return f"{self.user.get_full_name()} - {self.get_specialty_display()}"
 
 
+# ========================
+# Ticket code sequence
+# ========================
+class TicketCodeSequence(models.Model):
+    """
+    Compteur annuel des codes ticket (TKT-Nxxx-YYYY).
+
+    Une ligne par année, incrémentée par un UPDATE atomique (verrou de ligne),
+    ce qui évite le scan des codes existants et les doublons quand plusieurs
+    workers créent des tickets en même temps.
+    """
+    CODE_PREFIX = "TKT-N"
+
+    year = models.PositiveIntegerField(primary_key=True)
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Séquence de codes ticket'
+        verbose_name_plural = 'Séquences de codes ticket'
+
+    def __str__(self):
+        return f"{self.year}: {self.last_value}"
+
+    @classmethod
+    def format_code(cls, number, year):
+        return f"{cls.CODE_PREFIX}{number:03d}-{year}"
+
+    @classmethod
+    def reserve(cls, count=1, year=None):
+        """Réserver `count` numéros consécutifs pour l'année, retourne un range"""
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        year = year or timezone.now().year
+
+        with transaction.atomic():
+            updated = cls.objects.filter(year=year).update(last_value=F('last_value') + count)
+            if not updated:
+                cls._create_for_year(year)
+                cls.objects.filter(year=year).update(last_value=F('last_value') + count)
+            last_value = cls.objects.filter(year=year).values_list('last_value', flat=True).get()
+
+        return range(last_value - count + 1, last_value + 1)
+
+    @classmethod
+    def reserve_codes(cls, count=1, year=None):
+        """Réserver `count` codes ticket, pour Ticket.save() ou les créations en masse"""
+        year = year or timezone.now().year
+        return [cls.format_code(number, year) for number in cls.reserve(count, year)]
+
+    @classmethod
+    def _create_for_year(cls, year):
+        """Créer le compteur de l'année en repartant des codes déjà attribués"""
+        suffix = f"-{year}"
+        codes = Ticket.objects.filter(
+            code__startswith=cls.CODE_PREFIX, code__endswith=suffix
+        ).values_list('code', flat=True)
+
+        start = 0
+        for code in codes:
+            number = code[len(cls.CODE_PREFIX):-len(suffix)]
+            if number.isdigit():
+                start = max(start, int(number))
+
+        try:
+            with transaction.atomic():
+                cls.objects.create(year=year, last_value=start)
+        except IntegrityError:
+            # Un autre worker a créé le compteur entre-temps
+            pass
+
+
 # ========================
 # Ticket with UUID
 # ========================
@@ -568,17 +690,13 @@ class Ticket(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.code:
-            year = timezone.now().year
-            # Trouver le dernier ticket créé cette année
-            last_ticket = Ticket.objects.filter(code__endswith=f"-{year}").order_by('created_at').last()
-            if last_ticket:
-                # Extraire le numéro et incrémenter
-                last_number = int(last_ticket.code.split('-')[1][1:])  # 'N001' -> 1
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            self.code = f"TKT-N{new_number:03d}-{year}"
+            self.code = TicketCodeSequence.reserve_codes()[0]
         super().save(*args, **kwargs)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
         
         
         
@@ -715,6 +833,9 @@ class Intervention(models.Model):
         ordering = ['-intervention_date', '-created_at']
         verbose_name = "Intervention"
         verbose_name_plural = "Interventions"
+        indexes = [
+            models.Index(fields=['-created_at']),
+        ]
     
     
 
@@ -791,9 +912,47 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['ticket', '-timestamp']),
+        ]
 
     def __str__(self):
         return f"{self.user}: {self.content[:50] if self.content else 'Image message'}"
+
+
+class ChatAttachment(models.Model):
+    """
+    Image de chat envoyée en HTTP avant le message : le fichier est écrit par
+    morceaux dans le stockage, la miniature est générée en arrière-plan et le
+    message WebSocket ne transporte plus que l'identifiant de la pièce jointe.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='chat_attachments')
+    uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_attachments')
+    message = models.OneToOneField(
+        Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='attachment'
+    )
+    file = models.ImageField(upload_to='chat_images/%Y/%m/%d/')
+    thumbnail = models.ImageField(upload_to='chat_images/thumbs/%Y/%m/%d/', null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    file_size = models.PositiveIntegerField(null=True, blank=True)  # Size in bytes
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-uploaded_at']
+        verbose_name = 'Pièce jointe de chat'
+        verbose_name_plural = 'Pièces jointes de chat'
+
+    @property
+    def thumbnail_url(self):
+        if self.thumbnail:
+            return self.thumbnail.url
+        return None
+
+    def __str__(self):
+        return f"Pièce jointe {self.id} - ticket {self.ticket_id}"
     
     
     
@@ -845,4 +1004,82 @@ class PendingConfirmation(models.Model):
     def is_expired(self):
         return timezone.now() > self.expires_at
     
-# =======
\ No newline at end of file
+# =======
+
+# ========================
+# Index de recherche plein texte
+# ========================
+class SearchDocument(models.Model):
+    """
+    Texte indexé d'un objet (ticket, procédure, intervention, message).
+
+    Maintenu par tcikets.search_index à chaque sauvegarde ; `ticket` permet de
+    limiter les résultats aux tickets visibles par l'utilisateur.
+    """
+    KIND_CHOICES = [
+        ('ticket', 'Ticket'),
+        ('procedure', 'Procédure'),
+        ('intervention', 'Intervention'),
+        ('message', 'Message'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.UUIDField()
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    title = models.CharField(max_length=255, blank=True)
+    body = models.TextField(blank=True)  # Texte brut, utilisé pour les extraits
+    length = models.PositiveIntegerField(default=0)  # Nombre de mots indexés
+    checksum = models.CharField(max_length=32)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='unique_search_document'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+class SearchPosting(models.Model):
+    """Occurrences d'un mot (replié) dans un document"""
+    term = models.CharField(max_length=64)
+    document = models.ForeignKey(SearchDocument, on_delete=models.CASCADE, related_name='postings')
+    frequency = models.PositiveIntegerField(default=1)
+    in_title = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'document'], name='unique_search_posting'),
+        ]
+
+
+class AutocompleteEntry(models.Model):
+    """
+    Clé de préfixe pour l'autocomplétion : une ligne par début de mot du
+    libellé (« configuration reseau », « reseau »), maintenue par tcikets.autocomplete.
+    """
+    KIND_CHOICES = [
+        ('ticket', 'Ticket'),
+        ('intervention', 'Intervention'),
+        ('procedure', 'Procédure'),
+        ('tag', 'Tag'),
+        ('user', 'Utilisateur'),
+    ]
+
+    key = models.CharField(max_length=64)  # Texte replié à partir d'un début de mot
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.UUIDField()
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    label = models.CharField(max_length=255)
+    position = models.PositiveSmallIntegerField(default=0)  # Rang du mot dans le libellé
+    weight = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key']),
+            models.Index(fields=['kind', 'object_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} -> {self.kind} {self.object_id}"
@@ -0,0 +1,336 @@
+"""
+Création des notifications en masse.
+
+Toutes les notifications générées par le serveur passent par fan_out() :
+les lignes sont construites en mémoire puis écrites avec un seul bulk_create.
+
+Les compteurs total / non lues de chaque utilisateur sont gardés dans le cache
+et ajustés à chaque création ou lecture ; ils sont recalculés en une requête
+quand ils ne sont pas en cache.
+
+Les nouvelles notifications sont poussées après le commit sur le groupe
+channels de leur destinataire (NotificationConsumer). Chaque notification
+porte un jeton de reprise (created_at, id) qui permet au client qui se
+reconnecte de ne recevoir que ce qu'il a manqué.
+"""
+import json
+import logging
+from collections import Counter
+from datetime import timedelta
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Notification, Ticket
+from .pagination import encode_keyset_token, decode_keyset_token
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Durée pendant laquelle un résumé de connexion n'est pas recalculé
+LOGIN_DIGEST_TTL = timedelta(minutes=getattr(settings, 'LOGIN_DIGEST_TTL_MINUTES', 60))
+
+# Durée de vie des compteurs en cache, borne la dérive en cas d'écriture manquée
+NOTIFICATION_COUNTS_TTL = getattr(settings, 'NOTIFICATION_COUNTS_TTL', 60 * 60)
+
+# Nombre maximum de notifications renvoyées à la reprise d'une connexion
+RESUME_LIMIT = 100
+
+
+# -----------------------------
+# Compteurs en cache
+# -----------------------------
+def _counts_keys(user_id):
+    return f"notifications:{user_id}:total", f"notifications:{user_id}:unread"
+
+
+def get_notification_counts(user_id):
+    """(total, non lues) depuis le cache, recalculés en une requête si absents"""
+    total_key, unread_key = _counts_keys(user_id)
+    cached = cache.get_many([total_key, unread_key])
+    if total_key in cached and unread_key in cached:
+        return cached[total_key], cached[unread_key]
+
+    counts = Notification.objects.filter(user_id=user_id).aggregate(
+        total=Count('id'),
+        unread=Count('id', filter=Q(is_read=False)),
+    )
+    cache.set_many(
+        {total_key: counts['total'], unread_key: counts['unread']},
+        NOTIFICATION_COUNTS_TTL,
+    )
+    return counts['total'], counts['unread']
+
+
+def _apply_count_deltas(deltas):
+    for user_id, (total, unread) in deltas.items():
+        keys = _counts_keys(user_id)
+        try:
+            if total:
+                cache.incr(keys[0], total)
+            if unread:
+                cache.incr(keys[1], unread)
+        except ValueError:
+            # Compteur absent ou expiré : les deux seront recalculés à la prochaine lecture
+            cache.delete_many(keys)
+
+
+def adjust_notification_counts(deltas):
+    """
+    Appliquer des deltas {user_id: (total, non lues)} aux compteurs après le commit.
+
+    Un compteur absent du cache n'est pas créé : il sera recalculé à la lecture.
+    """
+    deltas = {user_id: delta for user_id, delta in deltas.items() if any(delta)}
+    if deltas:
+        transaction.on_commit(lambda: _apply_count_deltas(deltas))
+
+
+def invalidate_notification_counts(user_id):
+    """Oublier les compteurs d'un utilisateur (changement qu'on ne sait pas compter)"""
+    transaction.on_commit(lambda: cache.delete_many(_counts_keys(user_id)))
+
+
+def count_created(notifications):
+    """Compter des notifications insérées sans passer par save() (bulk_create)"""
+    totals = Counter(notification.user_id for notification in notifications)
+    unread = Counter(notification.user_id for notification in notifications if not notification.is_read)
+    adjust_notification_counts({
+        user_id: (total, unread[user_id]) for user_id, total in totals.items()
+    })
+
+
+# -----------------------------
+# Diffusion temps réel
+# -----------------------------
+def notification_group(user_id):
+    return f"notifications_{user_id}"
+
+
+def encode_resume_token(notification):
+    return encode_keyset_token(notification.created_at, notification.pk)
+
+
+def serialize_notification(notification):
+    """Représentation JSON (types simples) envoyée sur le channel layer"""
+    data = NotificationSerializer(notification).data
+    data = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+    data['resume_token'] = encode_resume_token(notification)
+    return data
+
+
+def push_notifications(notifications):
+    """Envoyer les notifications aux sockets ouvertes de leurs destinataires"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    group_send = async_to_sync(channel_layer.group_send)
+    for notification in notifications:
+        try:
+            group_send(notification_group(notification.user_id), {
+                "type": "notification.new",
+                "notification": serialize_notification(notification),
+            })
+        except Exception as e:
+            # Le client rattrapera la notification avec son jeton de reprise
+            logger.warning(f"Impossible de pousser la notification {notification.pk}: {e}")
+
+
+def publish_created(notifications):
+    """Compter et pousser des notifications qui viennent d'être insérées"""
+    count_created(notifications)
+    transaction.on_commit(partial(push_notifications, list(notifications)), robust=True)
+
+
+def missed_notifications(user_id, token, limit=RESUME_LIMIT):
+    """
+    Notifications créées (ou résumés recalculés) après le jeton, des plus
+    anciennes aux plus récentes. Renvoie (notifications, has_more).
+    """
+    cursor = decode_keyset_token(token)
+    if cursor is None:
+        return None, False
+
+    created_at, pk = cursor
+    notifications = list(
+        Notification.objects.filter(user_id=user_id)
+        .filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        .select_related('ticket')
+        .order_by('created_at', 'id')[:limit + 1]
+    )
+    return notifications[:limit], len(notifications) > limit
+
+
+def latest_resume_token(user_id):
+    latest = Notification.objects.filter(user_id=user_id).order_by('-created_at', '-id').first()
+    return encode_resume_token(latest) if latest else None
+
+
+def mark_read(user_id, queryset):
+    """
+    Marquer comme lues les notifications non lues du queryset, avec un seul
+    UPDATE conditionnel, et décrémenter le compteur du nombre de lignes modifiées.
+    """
+    updated = queryset.filter(user_id=user_id, is_read=False).update(is_read=True)
+    adjust_notification_counts({user_id: (0, -updated)})
+    return updated
+
+
+def admin_recipient_ids():
+    """Identifiants des admins actifs, en une requête"""
+    return list(
+        User.objects.filter(userType='admin', is_active=True).values_list('id', flat=True)
+    )
+
+
+def build_notifications(user_ids, title, message, ticket=None):
+    return [
+        Notification(user_id=user_id, title=title, message=message, ticket=ticket, is_read=False)
+        for user_id in user_ids
+    ]
+
+
+def fan_out(user_ids, title, message, ticket=None):
+    """Créer la même notification pour chaque destinataire avec un seul INSERT"""
+    notifications = build_notifications(user_ids, title, message, ticket=ticket)
+    if not notifications:
+        return []
+    created = Notification.objects.bulk_create(notifications)
+    publish_created(created)
+    return created
+
+
+def fan_out_ticket_created(ticket_id):
+    """Prévenir les admins qu'un ticket a été créé"""
+    ticket = Ticket.objects.select_related('client__user').filter(pk=ticket_id).first()
+    if ticket is None:
+        return []
+
+    return fan_out(
+        admin_recipient_ids(),
+        title="Nouveau ticket créé",
+        message=f"Le ticket '{ticket.title}' a été créé par {ticket.client.user.get_full_name()}.",
+        ticket=ticket,
+    )
+
+
+def fan_out_ticket_assigned(ticket_id):
+    """Prévenir le technicien assigné au ticket"""
+    ticket = Ticket.objects.select_related('technician').filter(pk=ticket_id).first()
+    if ticket is None or ticket.technician is None:
+        return []
+
+    return fan_out(
+        [ticket.technician.user_id],
+        title="Ticket assigné",
+        message=f"Le ticket '{ticket.title}' vous a été assigné. Priorité: {ticket.get_priority_display()}",
+        ticket=ticket,
+    )
+
+
+def _login_digest_content(user):
+    """Titre et message du résumé, à partir d'une seule requête d'agrégation"""
+    if user.userType == 'admin':
+        counts = Ticket.objects.aggregate(
+            open=Count('id', filter=Q(status='open')),
+            in_progress=Count('id', filter=Q(status='in_progress')),
+        )
+        return (
+            "Tickets en attente",
+            f"{counts['open']} tickets nécessitent votre attention, "
+            f"{counts['in_progress']} sont en cours de traitement",
+            True,
+        )
+
+    if user.userType == 'client':
+        tickets = Ticket.objects.filter(client__user=user)
+        in_progress = tickets.aggregate(total=Count('id', filter=Q(status='in_progress')))['total']
+        return (
+            "Tickets en cours",
+            f"{in_progress} de vos tickets sont en cours de traitement",
+            in_progress > 0,
+        )
+
+    if user.userType == 'technician':
+        tickets = Ticket.objects.filter(technician__user=user)
+        in_progress = tickets.aggregate(total=Count('id', filter=Q(status='in_progress')))['total']
+        return (
+            "Tickets assignés",
+            f"{in_progress} tickets vous sont assignés et en cours",
+            in_progress > 0,
+        )
+
+    return None, None, False
+
+
+def upsert_login_digest(user):
+    """
+    Mettre à jour le résumé de connexion de l'utilisateur (une ligne par utilisateur).
+
+    Rien n'est recalculé tant que le résumé existant n'a pas expiré.
+    """
+    now = timezone.now()
+    digest = Notification.objects.filter(user=user, kind='login_digest').first()
+    if digest is not None and digest.expires_at and digest.expires_at > now:
+        return digest
+
+    title, message, relevant = _login_digest_content(user)
+    if not relevant:
+        if digest is not None:
+            digest.delete()
+        return None
+
+    if digest is not None:
+        digest.title = title
+        digest.message = message
+        digest.is_read = False
+        digest.created_at = now
+        digest.expires_at = now + LOGIN_DIGEST_TTL
+        digest.save(update_fields=['title', 'message', 'is_read', 'created_at', 'expires_at'])
+        return digest
+
+    try:
+        with transaction.atomic():
+            return Notification.objects.create(
+                user=user,
+                title=title,
+                message=message,
+                kind='login_digest',
+                expires_at=now + LOGIN_DIGEST_TTL,
+            )
+    except IntegrityError:
+        # Connexion simultanée : l'autre requête a déjà créé le résumé
+        return Notification.objects.filter(user=user, kind='login_digest').first()
+
+
+def notify_in_progress_tickets(user):
+    """Ancien comportement : une notification par ticket en cours, en un seul INSERT"""
+    if user.userType == 'client':
+        tickets = Ticket.objects.filter(client__user=user, status='in_progress')
+        title, template = "Ticket en cours", "Votre ticket #{code} est en cours de traitement"
+    elif user.userType == 'technician':
+        tickets = Ticket.objects.filter(technician__user=user, status='in_progress')
+        title, template = "Ticket assigné", "Le ticket #{code} vous a été assigné"
+    else:
+        return []
+
+    notifications = [
+        Notification(user=user, title=title, message=template.format(code=ticket.code), ticket=ticket)
+        for ticket in tickets.only('id', 'code')
+    ]
+    if not notifications:
+        return []
+    created = Notification.objects.bulk_create(notifications)
+    publish_created(created)
+    return created
@@ -0,0 +1,61 @@
+import base64
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.utils import timezone
+from rest_framework.pagination import CursorPagination
+
+
+def encode_keyset_token(moment, pk):
+    """Jeton opaque pour une position (date, id) dans une liste triée par date puis id"""
+    raw = f"{moment.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_keyset_token(token):
+    """
+    (date avec fuseau, UUID) ou None si le jeton est invalide. Le jeton vient
+    du client : un id qui n'est pas un UUID ferait échouer la requête.
+    """
+    try:
+        moment, pk = base64.urlsafe_b64decode(token.encode()).decode().split('|', 1)
+        moment = datetime.fromisoformat(moment)
+        pk = uuid.UUID(pk)
+    except (ValueError, UnicodeDecodeError, AttributeError):
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, dt_timezone.utc)
+    return moment, pk
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    Pagination par curseur (keyset) sur created_at puis id.
+
+    La pagination est activée à la demande : tant que la requête ne contient
+    ni ``page_size`` ni ``cursor``, la liste est renvoyée entière comme avant
+    pour ne pas casser les clients existants. ``page_size`` est plafonné par
+    ``max_page_size``.
+
+    Une vue peut changer l'ordre du curseur avec l'attribut ``cursor_ordering``
+    (par exemple pour les modèles qui n'ont pas de champ created_at).
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.page_size_query_param in params or self.cursor_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework.permissions import BasePermission
 
 class IsAdminOrOwner(BasePermission):
@@ -30,3 +32,51 @@ class IsAdminOrOwner(BasePermission):
                 return True
 
         return False
+
+
+# Appartenance aux tickets, en cache pour les connexions WebSocket
+TICKET_MEMBERS_TTL = getattr(settings, 'TICKET_MEMBERS_CACHE_TTL', 300)  # secondes
+
+
+def _ticket_members_key(ticket_id):
+    return f"ticket_members:{ticket_id}"
+
+
+def ticket_members(ticket_id):
+    """
+    {'client': user_id, 'technician': user_id} du ticket, ou None s'il n'existe pas.
+    Invalidé par les signaux à chaque sauvegarde ou suppression du ticket.
+    """
+    key = _ticket_members_key(ticket_id)
+    members = cache.get(key)
+    if members is not None:
+        return members or None
+
+    from .models import Ticket
+    row = Ticket.objects.filter(pk=ticket_id).values('client__user_id', 'technician__user_id').first()
+    members = {}
+    if row is not None:
+        members = {
+            'client': str(row['client__user_id']) if row['client__user_id'] else None,
+            'technician': str(row['technician__user_id']) if row['technician__user_id'] else None,
+        }
+    # Un ticket inexistant est mis en cache comme {} pour couper les reconnexions répétées
+    cache.set(key, members, TICKET_MEMBERS_TTL)
+    return members or None
+
+
+def forget_ticket_members(ticket_id):
+    cache.delete(_ticket_members_key(ticket_id))
+
+
+def can_access_ticket(user, ticket_id):
+    """Même règle que TicketChatConsumer.has_permission, sans charger le ticket ni les profils"""
+    members = ticket_members(ticket_id)
+    if members is None:
+        return False
+
+    if user.is_staff or getattr(user, 'userType', '') == 'admin':
+        return True
+
+    # Client propriétaire ou technicien assigné
+    return str(user.id) in (members['client'], members['technician'])
@@ -0,0 +1,98 @@
+"""
+Présence des utilisateurs sur les tickets, partagée entre les workers ASGI via le cache.
+
+Chaque connexion WebSocket a sa propre clé, qui expire après PRESENCE_TTL
+secondes sans heartbeat (message `ping` du client). L'index du ticket liste
+les connexions connues ; il est nettoyé à la lecture et reconstruit par les
+heartbeats si une écriture concurrente l'a perdu.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 90)  # secondes sans heartbeat avant expiration
+CACHE_PREFIX = "presence"
+
+
+def _connection_key(ticket_id, channel_name):
+    return f"{CACHE_PREFIX}:{ticket_id}:conn:{channel_name}"
+
+
+def _index_key(ticket_id):
+    return f"{CACHE_PREFIX}:{ticket_id}:index"
+
+
+def _add_to_index(ticket_id, channel_name):
+    index = cache.get(_index_key(ticket_id)) or set()
+    if channel_name not in index:
+        index.add(channel_name)
+        cache.set(_index_key(ticket_id), index, PRESENCE_TTL * 2)
+    else:
+        cache.touch(_index_key(ticket_id), PRESENCE_TTL * 2)
+
+
+def join(ticket_id, channel_name, user):
+    """Enregistrer une connexion de l'utilisateur sur le ticket"""
+    cache.set(_connection_key(ticket_id, channel_name), {
+        'user_id': str(user.id),
+        'user_name': f"{user.first_name} {user.last_name}",
+        'user_type': getattr(user, 'userType', 'client'),
+        'connected_at': time.time(),
+    }, PRESENCE_TTL)
+    _add_to_index(ticket_id, channel_name)
+
+
+def heartbeat(ticket_id, channel_name, user):
+    """Prolonger la présence d'une connexion, la réenregistrer si elle a expiré"""
+    if not cache.touch(_connection_key(ticket_id, channel_name), PRESENCE_TTL):
+        join(ticket_id, channel_name, user)
+        return
+    _add_to_index(ticket_id, channel_name)
+
+
+def leave(ticket_id, channel_name, user_id):
+    """
+    Retirer une connexion. Renvoie True si l'utilisateur reste connecté au
+    ticket par une autre connexion (autre onglet, autre worker).
+    """
+    cache.delete(_connection_key(ticket_id, channel_name))
+
+    index = cache.get(_index_key(ticket_id)) or set()
+    index.discard(channel_name)
+    if index:
+        cache.set(_index_key(ticket_id), index, PRESENCE_TTL * 2)
+    else:
+        cache.delete(_index_key(ticket_id))
+
+    return any(entry['user_id'] == str(user_id) for entry in _live_connections(ticket_id, index))
+
+
+def _live_connections(ticket_id, index):
+    if not index:
+        return []
+    keys = {_connection_key(ticket_id, channel_name): channel_name for channel_name in index}
+    values = cache.get_many(list(keys))
+    return [values[key] for key in keys if key in values]
+
+
+def online_users(ticket_id):
+    """Utilisateurs connectés au ticket (une entrée par utilisateur)"""
+    index = cache.get(_index_key(ticket_id)) or set()
+    keys = {_connection_key(ticket_id, channel_name): channel_name for channel_name in index}
+    values = cache.get_many(list(keys)) if keys else {}
+
+    # Oublier les connexions expirées
+    live = {channel_name for key, channel_name in keys.items() if key in values}
+    if live != index:
+        if live:
+            cache.set(_index_key(ticket_id), live, PRESENCE_TTL * 2)
+        else:
+            cache.delete(_index_key(ticket_id))
+
+    users = {}
+    for entry in values.values():
+        current = users.get(entry['user_id'])
+        if current is None or entry['connected_at'] < current['connected_at']:
+            users[entry['user_id']] = entry
+    return sorted(users.values(), key=lambda entry: entry['connected_at'])
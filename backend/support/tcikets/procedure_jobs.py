@@ -0,0 +1,150 @@
+"""
+Export ZIP et import de procédures hors de la requête HTTP.
+
+La vue enregistre le fichier reçu (import), crée le job et répond 202 ; un
+petit pool de threads exécute procedure_transfer. L'état du job (pending,
+running, done, failed, avec statistiques et erreurs) est gardé dans le cache
+pendant PROCEDURE_JOB_TTL secondes, lisible depuis n'importe quel worker.
+
+Les fichiers (archive exportée, fichier à importer) sont écrits dans
+PROCEDURE_TRANSFER_ROOT, hors de MEDIA_ROOT : ils ne sont pas servis
+publiquement. Le fichier importé est supprimé après l'import, les archives
+à l'export suivant une fois leur job expiré. Avec plusieurs machines, ce
+dossier doit être partagé.
+Un job interrompu par l'arrêt du processus reste « running » jusqu'à
+l'expiration de son état : l'import se relance sans doublon.
+"""
+import logging
+import os
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import procedure_transfer
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+JOB_TTL = getattr(settings, 'PROCEDURE_JOB_TTL', 24 * 60 * 60)
+MAX_ERRORS = 100
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+storage = FileSystemStorage(location=getattr(
+    settings, 'PROCEDURE_TRANSFER_ROOT', os.path.join(settings.BASE_DIR, 'procedure_transfers')
+))
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PROCEDURE_JOB_WORKERS', 1),
+    thread_name_prefix='procedure-jobs',
+)
+
+
+def _job_key(job_id):
+    return f"procedure_job:{job_id}"
+
+
+def get_job(job_id):
+    return cache.get(_job_key(job_id))
+
+
+def _save_job(job):
+    cache.set(_job_key(job['id']), job, JOB_TTL)
+
+
+def _update_job(job_id, **changes):
+    job = get_job(job_id)
+    if job is None:
+        return
+    job.update(changes)
+    _save_job(job)
+
+
+def _start(kind, user, **extra):
+    job = {'id': str(uuid.uuid4()), 'kind': kind, 'status': PENDING, 'user_id': str(user.pk),
+           'stats': None, 'errors': [], 'error': None, 'file': None}
+    job.update(extra)
+    _save_job(job)
+    return job
+
+
+def _run(job_id, work):
+    close_old_connections()
+    _update_job(job_id, status=RUNNING)
+    try:
+        changes = work()
+    except Exception as e:
+        logger.exception(f"Job de procédures {job_id} en échec")
+        _update_job(job_id, status=FAILED, error=str(e))
+    else:
+        _update_job(job_id, status=DONE, **changes)
+    finally:
+        close_old_connections()
+
+
+def _purge_exports():
+    """Archives dont le job a expiré"""
+    limit = timezone.now() - timedelta(seconds=JOB_TTL)
+    try:
+        _, names = storage.listdir('exports')
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = f"exports/{name}"
+        if storage.get_modified_time(path) < limit:
+            storage.delete(path)
+
+
+def start_export(user):
+    """Planifier l'export ZIP ; renvoie le job"""
+    job = _start('export', user)
+    job_id = job['id']
+
+    def work():
+        _purge_exports()
+        with tempfile.TemporaryFile() as archive:
+            stats = procedure_transfer.export_archive(archive)
+            archive.seek(0)
+            name = storage.save(f"exports/{job_id}.zip", File(archive))
+        return {'stats': stats, 'file': name}
+
+    _executor.submit(_run, job_id, work)
+    return job
+
+
+def start_import(user, upload):
+    """Enregistrer le fichier reçu puis planifier son import ; renvoie le job"""
+    name = storage.save(f"imports/{uuid.uuid4()}", upload)
+    job = _start('import', user)
+    job_id, user_id = job['id'], user.pk
+
+    def work():
+        author = User.objects.filter(pk=user_id).first()
+        try:
+            with storage.open(name, 'rb') as fileobj:
+                try:
+                    stats, errors = procedure_transfer.import_procedures(fileobj, default_author=author)
+                except (zipfile.BadZipFile, KeyError, UnicodeDecodeError) as e:
+                    raise ValueError(f"Invalid import file: {e}")
+        finally:
+            storage.delete(name)
+        return {'stats': stats, 'errors': errors[:MAX_ERRORS]}
+
+    _executor.submit(_run, job_id, work)
+    return job
+
+
+def can_view_job(job, user):
+    return job is not None and (job['user_id'] == str(user.pk) or user.is_staff)
@@ -0,0 +1,110 @@
+"""
+Tags et images d'une procédure, en un nombre fixe de requêtes.
+
+- resolve_tags : tous les noms lus en une requête, les tags manquants créés
+  avec un seul bulk_create ;
+- set_tags : seule la différence avec les tags actuels est écrite dans la
+  table de liaison (un DELETE, un INSERT) ;
+- link_images : les images orphelines rattachées avec un seul UPDATE.
+
+Ces écritures passent à côté de save() et des signaux : les tags créés sont
+ajoutés à l'autocomplétion ici ; l'index de recherche ne contient pas les
+tags des procédures, rien d'autre n'écoute m2m_changed.
+"""
+import uuid
+from functools import partial
+
+from django.db import transaction
+
+from support.utils.slugs import allocate_slugs
+from . import autocomplete
+from .models import Procedure, ProcedureImage, ProcedureTag
+
+TAG_NAME_LENGTH = ProcedureTag._meta.get_field('name').max_length
+MAX_ATTEMPTS = 3
+
+
+def clean_tag_names(names):
+    """Noms non vides, sans doublon, dans l'ordre reçu"""
+    cleaned = {}
+    for name in names or []:
+        name = (name or '').strip()[:TAG_NAME_LENGTH]
+        if name:
+            cleaned.setdefault(name, None)
+    return list(cleaned)
+
+
+def resolve_tags(names):
+    """name -> ProcedureTag, en créant les tags manquants"""
+    names = clean_tag_names(names)
+    if not names:
+        return {}
+
+    tags = {tag.name: tag for tag in ProcedureTag.objects.filter(name__in=names)}
+    for _ in range(MAX_ATTEMPTS):
+        missing = [name for name in names if name not in tags]
+        if not missing:
+            break
+        slugs = allocate_slugs(ProcedureTag, missing, default='tag')
+        # Nom ou slug pris en parallèle : ignoré ici, relu juste après
+        ProcedureTag.objects.bulk_create(
+            [ProcedureTag(name=name, slug=slug) for name, slug in zip(missing, slugs)],
+            ignore_conflicts=True,
+        )
+        created = list(ProcedureTag.objects.filter(name__in=missing))
+        tags.update({tag.name: tag for tag in created})
+        for tag in created:
+            transaction.on_commit(partial(autocomplete.index_instance, 'tag', tag.pk), robust=True)
+    return tags
+
+
+def set_tags(procedure, names, created=False):
+    """
+    Remplacer les tags de la procédure par `names`. `created` : procédure
+    tout juste créée, sans tag à relire.
+    """
+    tags = resolve_tags(names)
+    wanted = {tag.pk for tag in tags.values()}
+    through = Procedure.tags.through
+
+    current = set() if created else set(
+        through.objects.filter(procedure_id=procedure.pk).values_list('proceduretag_id', flat=True)
+    )
+    removed = current - wanted
+    added = wanted - current
+    if removed:
+        through.objects.filter(procedure_id=procedure.pk, proceduretag_id__in=removed).delete()
+    if added:
+        through.objects.bulk_create(
+            [through(procedure_id=procedure.pk, proceduretag_id=tag_id) for tag_id in added],
+            ignore_conflicts=True,
+        )
+
+    # Les tags éventuellement préchargés ne sont plus à jour
+    getattr(procedure, '_prefetched_objects_cache', {}).pop('tags', None)
+    return bool(removed or added)
+
+
+def _valid_ids(values):
+    ids = []
+    for value in values or []:
+        try:
+            ids.append(value if isinstance(value, uuid.UUID) else uuid.UUID(str(value)))
+        except ValueError:
+            continue
+    return ids
+
+
+def link_images(procedure, image_ids):
+    """
+    Rattacher à la procédure les images encore orphelines parmi `image_ids`
+    (celles d'une autre procédure ne sont pas déplacées). Les dimensions ont
+    été calculées à l'envoi : un UPDATE suffit, sans relire les fichiers.
+    """
+    ids = _valid_ids(image_ids)
+    if not ids:
+        return 0
+    linked = ProcedureImage.objects.filter(id__in=ids, procedure__isnull=True).update(procedure=procedure)
+    if linked:
+        getattr(procedure, '_prefetched_objects_cache', {}).pop('images', None)
+    return linked
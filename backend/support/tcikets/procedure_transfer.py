@@ -0,0 +1,460 @@
+"""
+Import / export en masse des procédures (tags, images, pièces jointes).
+
+Format : une archive ZIP contenant `procedures.jsonl` (une procédure par
+ligne) et les fichiers sous `media/`, ou un simple fichier `.jsonl` dont les
+chemins de fichiers sont relatifs à son dossier.
+
+L'import lit le fichier en flux, par lots de `batch_size` lignes :
+- procédures déjà présentes (même id) ignorées : un import interrompu se
+  relance sur le même fichier sans doublon, et celles que la première passe
+  a créées sans les indexer sont indexées à la reprise ;
+- slugs de l'export gardés s'ils sont libres, sinon recalculés ; un slug pris
+  en parallèle fait recommencer le lot (MAX_ATTEMPTS fois au plus) ;
+- tags résolus en une requête par lot, les manquants créés avec bulk_create ;
+- procédures et liens M2M créés avec bulk_create (sans signaux : l'index de
+  recherche et l'autocomplétion sont mis à jour explicitement) ;
+- fichiers écrits dans le stockage par un pool de threads ; un média dont
+  l'id existe déjà est ignoré, ce qui rend aussi cette étape reprenable.
+"""
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, close_old_connections, transaction
+
+from support.utils.slugs import allocate_slugs
+from . import autocomplete, procedure_links, search_index
+from .models import (
+    AutocompleteEntry, Procedure, ProcedureAttachment, ProcedureImage, ProcedureTag, SearchDocument, User,
+)
+
+logger = logging.getLogger(__name__)
+
+RECORDS_NAME = 'procedures.jsonl'
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_WORKERS = 4
+MAX_ATTEMPTS = 3
+
+# Champs copiés tels quels entre l'export et l'import
+PROCEDURE_FIELDS = [
+    'title', 'description', 'content', 'category', 'difficulty', 'estimated_time',
+    'is_active', 'status', 'meta_description', 'featured',
+]
+IMAGE_FIELDS = ['caption', 'alt_text', 'order']
+ATTACHMENT_FIELDS = ['name', 'file_type', 'file_size', 'attachment_type', 'description', 'is_public']
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def _media_name(kind, obj, field_file):
+    ext = os.path.splitext(field_file.name)[1]
+    return f"media/{kind}/{obj.pk}{ext}"
+
+
+def procedure_record(procedure, media_names=None):
+    """Ligne d'export d'une procédure (relations préchargées)"""
+    record = {'id': str(procedure.pk), 'slug': procedure.slug}
+    record.update({field: getattr(procedure, field) for field in PROCEDURE_FIELDS})
+    record['author'] = procedure.author.username if procedure.author_id else None
+    record['created_at'] = procedure.created_at.isoformat() if procedure.created_at else None
+    record['tags'] = [tag.name for tag in procedure.tags.all()]
+    record['related'] = [str(related.pk) for related in procedure.related_procedures.all()]
+    media_names = media_names or {}
+    record['images'] = [
+        dict({field: getattr(image, field) for field in IMAGE_FIELDS},
+             id=str(image.pk), file=media_names.get(image.pk))
+        for image in procedure.images.all()
+    ]
+    record['attachments'] = [
+        dict({field: getattr(attachment, field) for field in ATTACHMENT_FIELDS},
+             id=str(attachment.pk), file=media_names.get(attachment.pk))
+        for attachment in procedure.attachments.all()
+    ]
+    return record
+
+
+def export_queryset(queryset=None):
+    queryset = queryset if queryset is not None else Procedure.objects.all()
+    return (
+        queryset.select_related('author')
+        .prefetch_related('tags', 'images', 'attachments', 'related_procedures')
+        .order_by('created_at', 'pk')
+    )
+
+
+def iter_jsonl(queryset=None, chunk_size=200):
+    """Lignes JSON des procédures, sans les fichiers (réponse HTTP en flux)"""
+    for procedure in export_queryset(queryset).iterator(chunk_size=chunk_size):
+        yield json.dumps(procedure_record(procedure), ensure_ascii=False) + '\n'
+
+
+def export_archive(destination, queryset=None, chunk_size=200):
+    """
+    Écrire l'archive ZIP dans `destination` (chemin ou fichier binaire).
+    Les lignes sont d'abord écrites dans un fichier temporaire : un membre
+    ZIP ne peut pas être écrit pendant qu'on ajoute les fichiers médias.
+    """
+    stats = {'procedures': 0, 'files': 0, 'missing_files': 0}
+    with zipfile.ZipFile(destination, 'w', compression=zipfile.ZIP_DEFLATED) as archive, \
+            tempfile.TemporaryFile('w+', encoding='utf-8') as records:
+        for procedure in export_queryset(queryset).iterator(chunk_size=chunk_size):
+            media_names = {}
+            media = [('images', image, image.image) for image in procedure.images.all()]
+            media += [('attachments', attachment, attachment.file) for attachment in procedure.attachments.all()]
+            for kind, obj, field_file in media:
+                if not field_file:
+                    continue
+                name = _media_name(kind, obj, field_file)
+                try:
+                    with field_file.open('rb') as source, archive.open(name, 'w') as target:
+                        shutil.copyfileobj(source, target)
+                except (FileNotFoundError, OSError) as e:
+                    logger.warning(f"Fichier {field_file.name} absent de l'export: {e}")
+                    stats['missing_files'] += 1
+                    continue
+                media_names[obj.pk] = name
+                stats['files'] += 1
+
+            records.write(json.dumps(procedure_record(procedure, media_names), ensure_ascii=False) + '\n')
+            stats['procedures'] += 1
+
+        records.seek(0)
+        with archive.open(RECORDS_NAME, 'w') as target:
+            for line in records:
+                target.write(line.encode('utf-8'))
+    return stats
+
+
+# -----------------------------
+# Import
+# -----------------------------
+class _Source:
+    """Lignes et fichiers d'une archive ZIP ou d'un fichier .jsonl"""
+
+    def __init__(self, fileobj, base_dir=None):
+        self.archive = zipfile.ZipFile(fileobj) if zipfile.is_zipfile(fileobj) else None
+        if self.archive is None:
+            fileobj.seek(0)
+        self.fileobj = fileobj
+        self.base_dir = base_dir
+
+    def lines(self):
+        if self.archive is not None:
+            raw = self.archive.open(RECORDS_NAME)
+        else:
+            raw = self.fileobj
+        stream = raw if isinstance(raw, io.TextIOBase) else io.TextIOWrapper(raw, encoding='utf-8')
+        for number, line in enumerate(stream, start=1):
+            if line.strip():
+                yield number, line
+
+    def read(self, name):
+        if not name:
+            return None
+        if self.archive is not None:
+            try:
+                return self.archive.read(name)
+            except KeyError:
+                return None
+        if self.base_dir:
+            path = os.path.normpath(os.path.join(self.base_dir, name))
+            if path.startswith(os.path.normpath(self.base_dir) + os.sep) and os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+        return None
+
+
+def _clean_id(value, label):
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise ValueError(f"{label} invalide: {value!r}")
+
+
+def clean_record(record):
+    """
+    Valider une ligne avant son lot : une ligne fautive est comptée invalide
+    au lieu de faire échouer les requêtes (et les autres lignes) du lot.
+    Les ids sont normalisés sous leur forme canonique.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("la ligne n'est pas un objet JSON")
+    if not record.get('id') or not record.get('title'):
+        raise ValueError("id et title sont obligatoires")
+    record['id'] = _clean_id(record['id'], 'id')
+
+    for name in PROCEDURE_FIELDS:
+        if record.get(name) is not None:
+            try:
+                record[name] = Procedure._meta.get_field(name).clean(record[name], None)
+            except ValidationError as e:
+                raise ValueError(f"{name}: {' '.join(e.messages)}")
+    if record.get('slug'):
+        if not isinstance(record['slug'], str):
+            raise ValueError("slug doit être une chaîne")
+        try:
+            record['slug'] = Procedure._meta.get_field('slug').clean(record['slug'], None)
+        except ValidationError as e:
+            raise ValueError(f"slug: {' '.join(e.messages)}")
+    if record.get('author') is not None and not isinstance(record['author'], str):
+        raise ValueError("author doit être un nom d'utilisateur")
+
+    for name in ('tags', 'related', 'images', 'attachments'):
+        if not isinstance(record.get(name) or [], list):
+            raise ValueError(f"{name} doit être une liste")
+    if not all(isinstance(tag, str) for tag in record.get('tags') or []):
+        raise ValueError("tags doit être une liste de noms")
+    record['related'] = [_clean_id(pk, 'related') for pk in record.get('related') or []]
+    for kind in ('images', 'attachments'):
+        for item in record.get(kind) or []:
+            if not isinstance(item, dict) or not item.get('id'):
+                raise ValueError(f"{kind}: chaque fichier doit être un objet avec un id")
+            item['id'] = _clean_id(item['id'], f"{kind}.id")
+            if item.get('file') is not None and not isinstance(item['file'], str):
+                raise ValueError(f"{kind}.file doit être un chemin")
+    return record
+
+
+def _build_procedure(record, authors, default_author):
+    procedure = Procedure(id=record['id'])
+    for field in PROCEDURE_FIELDS:
+        if field in record and record[field] is not None:
+            setattr(procedure, field, record[field])
+    procedure.author = authors.get(record.get('author')) or default_author
+    if not procedure.meta_description and procedure.description:
+        procedure.meta_description = procedure.description[:157] + "..."
+    # bulk_create n'appelle pas save() : champs dérivés calculés ici
+    procedure.refresh_text_fields()
+    return procedure
+
+
+def _save_media(kind, procedure_id, item, data):
+    close_old_connections()
+    try:
+        name = os.path.basename(item['file'])
+        if kind == 'images':
+            obj = ProcedureImage(id=item['id'], procedure_id=procedure_id,
+                                 **{field: item[field] for field in IMAGE_FIELDS if field in item})
+            obj.image.save(name, ContentFile(data), save=False)
+        else:
+            obj = ProcedureAttachment(id=item['id'], procedure_id=procedure_id,
+                                      **{field: item[field] for field in ATTACHMENT_FIELDS if field in item})
+            obj.file.save(name, ContentFile(data), save=False)
+        obj.save(force_insert=True)
+    finally:
+        close_old_connections()
+
+
+def _assign_slugs(procedures, wanted):
+    """Slugs de l'export gardés s'ils sont libres, sinon recalculés depuis le titre"""
+    taken = set(Procedure.objects.filter(slug__in=[slug for slug in wanted if slug]).values_list('slug', flat=True))
+    seen = set()
+    to_allocate = []
+    for procedure, slug in zip(procedures, wanted):
+        if slug and slug not in taken and slug not in seen:
+            procedure.slug = slug
+            seen.add(slug)
+        else:
+            to_allocate.append(procedure)
+    # Les slugs gardés ne sont pas encore en base : réservés pour le calcul
+    slugs = allocate_slugs(Procedure, [procedure.title for procedure in to_allocate],
+                           default='procedure', reserved=seen)
+    for procedure, slug in zip(to_allocate, slugs):
+        procedure.slug = slug
+
+
+class ProcedureImporter:
+    def __init__(self, default_author=None, batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS,
+                 with_media=True):
+        self.default_author = default_author
+        self.batch_size = batch_size
+        self.workers = workers
+        self.with_media = with_media
+        self.stats = {
+            'read': 0, 'created': 0, 'skipped': 0, 'invalid': 0,
+            'tags_created': 0, 'files': 0, 'missing_files': 0, 'failed_files': 0,
+        }
+        self.errors = []
+        self._related = []  # (procedure_id, [related_id, ...])
+
+    def run(self, fileobj, base_dir=None):
+        source = _Source(fileobj, base_dir)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='procedure-import') as executor:
+            self._executor, self._pending = executor, set()
+            batch = []
+            for number, line in source.lines():
+                try:
+                    record = clean_record(json.loads(line))
+                except ValueError as e:
+                    self.stats['invalid'] += 1
+                    self.errors.append(f"ligne {number}: {e}")
+                    continue
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    self._import_batch(batch, source)
+                    batch = []
+            if batch:
+                self._import_batch(batch, source)
+            self._drain(0)
+
+        self._link_related()
+        return self.stats
+
+    def _import_batch(self, records, source):
+        self.stats['read'] += len(records)
+        # Une ligne répétée dans le fichier : la dernière l'emporte
+        records = list({str(record['id']): record for record in records}.values())
+        existing = {str(pk) for pk in Procedure.objects.filter(pk__in=[r['id'] for r in records])
+                    .values_list('pk', flat=True)}
+        new_records = [record for record in records if str(record['id']) not in existing]
+        self.stats['skipped'] += len(records) - len(new_records)
+
+        if existing:
+            self._index_missing(existing)
+        if new_records:
+            self._create_procedures(new_records)
+        for record in records:
+            if record.get('related'):
+                self._related.append((record['id'], record['related']))
+        if self.with_media:
+            self._schedule_media(records, source)
+
+    def _create_procedures(self, records):
+        usernames = {record.get('author') for record in records if record.get('author')}
+        authors = {user.username: user for user in User.objects.filter(username__in=usernames)}
+        tag_count = ProcedureTag.objects.count()
+        tags = procedure_links.resolve_tags(name for record in records for name in record.get('tags') or [])
+        self.stats['tags_created'] += ProcedureTag.objects.count() - tag_count
+
+        procedures = [_build_procedure(record, authors, self.default_author) for record in records]
+        wanted = [record.get('slug') for record in records]
+
+        through = Procedure.tags.through
+        for attempt in range(MAX_ATTEMPTS):
+            _assign_slugs(procedures, wanted)
+            try:
+                with transaction.atomic():
+                    Procedure.objects.bulk_create(procedures)
+                    through.objects.bulk_create(
+                        [
+                            through(procedure_id=procedure.pk, proceduretag_id=tags[name].pk)
+                            for procedure, record in zip(procedures, records)
+                            for name in procedure_links.clean_tag_names(record.get('tags'))
+                            if name in tags
+                        ],
+                        ignore_conflicts=True,
+                    )
+                break
+            except IntegrityError:
+                # Slug (ou id) pris entre la lecture et l'INSERT : lot recalculé
+                if attempt + 1 == MAX_ATTEMPTS:
+                    raise
+                created = {str(pk) for pk in Procedure.objects.filter(
+                    pk__in=[procedure.pk for procedure in procedures]).values_list('pk', flat=True)}
+                self.stats['skipped'] += len(created)
+                kept = [i for i, procedure in enumerate(procedures) if str(procedure.pk) not in created]
+                procedures = [procedures[i] for i in kept]
+                records = [records[i] for i in kept]
+                wanted = [wanted[i] for i in kept]
+                if not procedures:
+                    return
+        self.stats['created'] += len(procedures)
+        self._index(procedures)
+
+    def _index(self, procedures):
+        try:
+            search_index.index_objects('procedure', procedures)
+        except Exception as e:
+            logger.warning(f"Indexation de {len(procedures)} procédures importées impossible: {e}")
+        for procedure in procedures:
+            try:
+                autocomplete.index_object('procedure', procedure)
+            except Exception as e:
+                logger.warning(f"Autocomplétion de la procédure importée {procedure.pk} impossible: {e}")
+
+    def _index_missing(self, ids):
+        """
+        Procédures déjà présentes sans document de recherche ou sans clé
+        d'autocomplétion : un import interrompu après le commit d'un lot mais
+        avant son indexation est complété à la reprise.
+        """
+        indexed = set(SearchDocument.objects.filter(kind='procedure', object_id__in=ids)
+                      .values_list('object_id', flat=True))
+        indexed &= set(AutocompleteEntry.objects.filter(kind='procedure', object_id__in=ids)
+                       .values_list('object_id', flat=True))
+        missing = set(ids) - {str(pk) for pk in indexed}
+        if missing:
+            self._index(list(Procedure.objects.filter(pk__in=missing)))
+
+    def _schedule_media(self, records, source):
+        items = [
+            (kind, record['id'], item)
+            for record in records
+            for kind in ('images', 'attachments')
+            for item in record.get(kind) or []
+            if item.get('id')
+        ]
+        if not items:
+            return
+        existing = {str(pk) for pk in ProcedureImage.objects.filter(
+            pk__in=[item['id'] for kind, _, item in items if kind == 'images']).values_list('pk', flat=True)}
+        existing |= {str(pk) for pk in ProcedureAttachment.objects.filter(
+            pk__in=[item['id'] for kind, _, item in items if kind == 'attachments']).values_list('pk', flat=True)}
+
+        for kind, procedure_id, item in items:
+            if str(item['id']) in existing:
+                continue
+            data = source.read(item.get('file'))
+            if data is None:
+                self.stats['missing_files'] += 1
+                continue
+            # Mémoire bornée : au plus 2 fichiers en attente par thread
+            self._drain(2 * self.workers)
+            future = self._executor.submit(_save_media, kind, procedure_id, item, data)
+            future.media_id = item['id']
+            self._pending.add(future)
+
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    future.result()
+                    self.stats['files'] += 1
+                except Exception as e:
+                    self.stats['failed_files'] += 1
+                    self.errors.append(f"fichier {future.media_id}: {e}")
+
+    def _link_related(self):
+        """Procédures liées, une fois toutes les procédures du fichier créées"""
+        if not self._related:
+            return
+        ids = {str(pk) for pk in Procedure.objects.filter(
+            pk__in={pk for source, targets in self._related for pk in [source, *targets]}
+        ).values_list('pk', flat=True)}
+        through = Procedure.related_procedures.through
+        rows = []
+        for source, targets in self._related:
+            for target in targets:
+                if str(source) in ids and str(target) in ids and str(source) != str(target):
+                    # Relation symétrique : une ligne dans chaque sens
+                    rows.append(through(from_procedure_id=source, to_procedure_id=target))
+                    rows.append(through(from_procedure_id=target, to_procedure_id=source))
+        through.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+def import_procedures(fileobj, base_dir=None, **options):
+    """Importer une archive ou un .jsonl ; renvoie (statistiques, erreurs)"""
+    importer = ProcedureImporter(**options)
+    stats = importer.run(fileobj, base_dir)
+    return stats, importer.errors
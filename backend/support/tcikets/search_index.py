@@ -0,0 +1,348 @@
+"""
+Index de recherche plein texte (index inversé dans la base, SQLite comme PostgreSQL).
+
+Chaque ticket, procédure, intervention et message a un SearchDocument et une
+ligne SearchPosting par mot replié (minuscules, sans accents). Les documents
+sont mis à jour après chaque sauvegarde (voir signals.py) ; la commande
+`rebuild_search_index` reconstruit l'index complet.
+
+Le classement est un BM25 calculé en SQL sur les seules lignes des mots de la
+requête : le coût dépend du nombre de documents qui contiennent ces mots, pas
+de la taille de l'historique.
+"""
+import hashlib
+import math
+import re
+import uuid
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Case, Count, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.html import escape
+
+from support.utils.text import fold_accents_aligned, tokenize
+from .models import Intervention, Message, Procedure, SearchDocument, SearchPosting, Ticket
+
+# Paramètres BM25
+K1 = 1.2
+B = 0.75
+TITLE_BOOST = 1.5  # poids supplémentaire d'un mot présent dans le titre
+MAX_QUERY_TERMS = 8
+SNIPPET_LENGTH = 160
+STATS_CACHE_KEY = "search:stats"
+STATS_CACHE_TTL = 300
+
+
+# -----------------------------
+# Contenu indexé par type d'objet
+# -----------------------------
+def _ticket_document(ticket):
+    return {
+        'ticket_id': ticket.pk,
+        'title': f"{ticket.code} {ticket.title}".strip(),
+        'body': ' '.join(filter(None, [
+            ticket.description, ticket.problem_type, ticket.material_name, ticket.tags,
+        ])),
+    }
+
+
+def _procedure_document(procedure):
+    return {
+        'ticket_id': None,
+        'title': procedure.title,
+        'body': ' '.join(filter(None, [procedure.description, procedure.plain_text])),
+    }
+
+
+def _intervention_document(intervention):
+    return {
+        'ticket_id': intervention.ticket_id,
+        'title': intervention.code or '',
+        'body': intervention.report or '',
+    }
+
+
+def _message_document(message):
+    return {
+        'ticket_id': message.ticket_id,
+        'title': '',
+        'body': message.content or '',
+    }
+
+
+INDEXED_MODELS = {
+    'ticket': (Ticket, _ticket_document),
+    'procedure': (Procedure, _procedure_document),
+    'intervention': (Intervention, _intervention_document),
+    'message': (Message, _message_document),
+}
+
+
+# -----------------------------
+# Mise à jour de l'index
+# -----------------------------
+def _document_id(pk):
+    # Un objet construit avec un id en texte (import) garde une str jusqu'au rechargement
+    return pk if isinstance(pk, uuid.UUID) else uuid.UUID(str(pk))
+
+
+def index_objects(kind, objects, retry=True):
+    """
+    Créer ou mettre à jour les documents d'un lot d'objets en un nombre fixe
+    de requêtes : une lecture des documents existants, un INSERT des
+    nouveaux, un UPDATE et un DELETE des postings pour ceux qui ont changé,
+    un INSERT de tous les postings. Les documents inchangés ne sont pas réécrits.
+    """
+    _, build = INDEXED_MODELS[kind]
+    entries, empty = {}, []
+    for obj in objects:
+        data = build(obj)
+        title, body = data['title'][:255], data['body']
+        if not title and not body:
+            empty.append(obj.pk)
+            continue
+        entries[_document_id(obj.pk)] = (data['ticket_id'], title, body)
+
+    if empty:
+        SearchDocument.objects.filter(kind=kind, object_id__in=empty).delete()
+    if not entries:
+        return []
+
+    existing = {
+        document.object_id: document
+        for document in SearchDocument.objects.filter(kind=kind, object_id__in=list(entries))
+    }
+    documents, created, changed, postings = [], [], [], []
+    now = timezone.now()
+    for object_id, (ticket_id, title, body) in entries.items():
+        checksum = hashlib.md5(f"{title}\0{body}".encode()).hexdigest()
+        document = existing.get(object_id)
+        if document is not None and document.checksum == checksum and document.ticket_id == ticket_id:
+            documents.append(document)
+            continue
+
+        title_tokens = tokenize(title)
+        counts = Counter(title_tokens)
+        counts.update(tokenize(body))
+        title_terms = set(title_tokens)
+
+        if document is None:
+            document = SearchDocument(kind=kind, object_id=object_id)
+            created.append(document)
+        else:
+            changed.append(document)
+        document.ticket_id = ticket_id
+        document.title = title
+        document.body = body
+        document.length = sum(counts.values())
+        document.checksum = checksum
+        document.updated_at = now
+        documents.append(document)
+        postings.append((document, [
+            (term, frequency, term in title_terms) for term, frequency in counts.items()
+        ]))
+
+    if not postings:
+        return documents
+
+    try:
+        with transaction.atomic():
+            if created:
+                SearchDocument.objects.bulk_create(created)
+                if any(document.pk is None for document in created):
+                    # Base sans RETURNING : clés relues
+                    ids = dict(
+                        SearchDocument.objects.filter(kind=kind, object_id__in=[d.object_id for d in created])
+                        .values_list('object_id', 'id')
+                    )
+                    for document in created:
+                        document.pk = ids[document.object_id]
+            if changed:
+                SearchDocument.objects.bulk_update(
+                    changed, ['ticket', 'title', 'body', 'length', 'checksum', 'updated_at']
+                )
+                SearchPosting.objects.filter(document__in=changed).delete()
+            SearchPosting.objects.bulk_create([
+                SearchPosting(document=document, term=term, frequency=frequency, in_title=in_title)
+                for document, terms in postings
+                for term, frequency, in_title in terms
+            ])
+    except IntegrityError:
+        # Document créé en parallèle : relu puis mis à jour au second passage
+        if not retry:
+            raise
+        return index_objects(kind, objects, retry=False)
+    return documents
+
+
+def index_object(kind, obj):
+    """Créer ou mettre à jour le document de l'objet ; rien n'est réécrit s'il n'a pas changé"""
+    documents = index_objects(kind, [obj])
+    return documents[0] if documents else None
+
+
+def index_instance(kind, pk):
+    """Réindexer un objet à partir de sa clé (appelé après le commit)"""
+    model, _ = INDEXED_MODELS[kind]
+    obj = model.objects.filter(pk=pk).first()
+    if obj is None:
+        remove_object(kind, pk)
+        return None
+    return index_object(kind, obj)
+
+
+def index_messages(messages):
+    """Indexer des messages écrits avec bulk_create (sans signal post_save), en un lot"""
+    return index_objects('message', messages)
+
+
+def remove_object(kind, pk):
+    SearchDocument.objects.filter(kind=kind, object_id=pk).delete()
+
+
+# -----------------------------
+# Recherche
+# -----------------------------
+def _collection_stats():
+    stats = cache.get(STATS_CACHE_KEY)
+    if stats is None:
+        stats = SearchDocument.objects.aggregate(total=Count('id'), avg_length=Avg('length'))
+        stats['avg_length'] = stats['avg_length'] or 1.0
+        cache.set(STATS_CACHE_KEY, stats, STATS_CACHE_TTL)
+    return stats
+
+
+def visible_documents_filter(user):
+    """Q sur SearchPosting : procédures pour tous, tickets et leurs contenus selon le rôle"""
+    if user is None or user.is_staff or getattr(user, 'userType', '') == 'admin':
+        return Q()
+    if getattr(user, 'userType', '') == 'technician':
+        return Q(document__kind='procedure') | Q(document__ticket__technician__user=user)
+    if getattr(user, 'userType', '') == 'client':
+        return Q(document__kind='procedure') | Q(document__ticket__client__user=user)
+    return Q(document__kind='procedure')
+
+
+def prepare_query(query):
+    """
+    Mots de la requête présents dans l'index et leur poids (idf) ; None si
+    aucun ne l'est. Partagé entre les recherches d'une même requête HTTP.
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+
+    stats = _collection_stats()
+    frequencies = dict(
+        SearchPosting.objects.filter(term__in=terms)
+        .values('term').annotate(n=Count('id')).values_list('term', 'n')
+    )
+    terms = [term for term in terms if term in frequencies]
+    if not terms:
+        return None
+
+    total = max(stats['total'], sum(frequencies.values()))
+    return {
+        'terms': terms,
+        'avg_length': stats['avg_length'],
+        'idf': {
+            term: math.log(1 + (total - frequencies[term] + 0.5) / (frequencies[term] + 0.5))
+            for term in terms
+        },
+    }
+
+
+def search(query, user=None, kinds=None, limit=20, prepared=None):
+    """
+    Documents classés pour la requête : liste de dicts
+    {kind, id, ticket_id, title, snippet, score, matched}.
+    """
+    if prepared is None:
+        prepared = prepare_query(query)
+    if prepared is None:
+        return []
+    terms, idf = prepared['terms'], prepared['idf']
+
+    # Saturation BM25 du nombre d'occurrences, normalisée par la longueur du document
+    frequency = Cast('frequency', FloatField())
+    term_weight = frequency * Value(K1 + 1) / (
+        frequency
+        + Value(K1 * (1 - B))
+        + Value(K1 * B / prepared['avg_length']) * Cast('document__length', FloatField())
+    )
+    whens = []
+    for term in terms:
+        whens.append(When(term=term, in_title=True, then=term_weight * Value(idf[term] * (1 + TITLE_BOOST))))
+        whens.append(When(term=term, then=term_weight * Value(idf[term])))
+
+    postings = SearchPosting.objects.filter(term__in=terms).filter(visible_documents_filter(user))
+    if kinds:
+        postings = postings.filter(document__kind__in=kinds)
+
+    ranked = list(
+        postings.values('document_id')
+        .annotate(
+            matched=Count('term'),
+            score=Sum(Case(*whens, default=Value(0.0), output_field=FloatField())),
+        )
+        .order_by('-matched', '-score', 'document_id')[:limit]
+    )
+    if not ranked:
+        return []
+
+    documents = SearchDocument.objects.in_bulk([row['document_id'] for row in ranked])
+    results = []
+    for row in ranked:
+        document = documents.get(row['document_id'])
+        if document is None:
+            continue
+        results.append({
+            'kind': document.kind,
+            'id': str(document.object_id),
+            'ticket_id': str(document.ticket_id) if document.ticket_id else None,
+            'title': document.title,
+            'snippet': make_snippet(document.body, terms),
+            'score': round(row['score'], 4),
+            'matched': row['matched'],
+        })
+    return results
+
+
+def make_snippet(text, terms, length=SNIPPET_LENGTH):
+    """Extrait autour de la première occurrence, mots trouvés entourés de <mark>"""
+    if not text:
+        return ''
+
+    folded, positions = fold_accents_aligned(text)
+    pattern = re.compile(
+        r'(?<![a-z0-9])(?:' + '|'.join(re.escape(term) for term in terms) + r')[a-z0-9]*'
+    )
+    # Occurrences reportées sur le texte d'origine (une ligature y est un seul caractère)
+    matches = [
+        (positions[match.start()], positions[match.end() - 1] + 1)
+        for match in pattern.finditer(folded)
+    ]
+    start = 0
+    if matches and matches[0][0] > length // 3:
+        start = text.rfind(' ', 0, matches[0][0] - length // 3) + 1
+    end = min(len(text), start + length)
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        if space > start:
+            end = space
+
+    parts = ['… ' if start > 0 else '']
+    position = start
+    for match_start, match_end in matches:
+        if match_start < start or match_end > end:
+            continue
+        parts.append(escape(text[position:match_start]))
+        parts.append(f"<mark>{escape(text[match_start:match_end])}</mark>")
+        position = match_end
+    parts.append(escape(text[position:end]))
+    if end < len(text):
+        parts.append(' …')
+    return ''.join(parts)
@@ -1,9 +1,156 @@
 # support/search_views.py
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from django.conf import settings
+from django.db import close_old_connections
 from django.db.models import Q
-from .models import User,Ticket,Intervention,Procedure
-from .serializers import UserSerializer,TicketSerializer,ProcedureSerializer,InterventionSerializer
+from .models import User,Ticket,Intervention,Procedure,TicketCodeSequence
+from .serializers import UserSerializer,TicketSerializer,TicketListSerializer,ProcedureSerializer,InterventionSerializer
+from .serializers import (
+    TicketSearchResultSerializer, ProcedureSearchResultSerializer,
+    InterventionSearchResultSerializer, UserSearchResultSerializer,
+)
+from .mixins import wants_compact_tickets
+from support.utils.request_metrics import serializer_timer
+from .search_index import prepare_query, search
+from . import autocomplete
+
+CATEGORY_LIMIT = 10
+HITS_LIMIT = 20
+SEARCH_LIMIT = 50
+SEARCH_BUDGET = getattr(settings, 'GLOBAL_SEARCH_BUDGET', 0.3)  # secondes
+
+logger = logging.getLogger(__name__)
+
+# Catégories de la recherche globale exécutées en parallèle (?mode=fast)
+_search_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'GLOBAL_SEARCH_WORKERS', 8),
+    thread_name_prefix='global-search',
+)
+
+
+def ranked_objects(queryset, hits):
+    """Objets des résultats de l'index, dans l'ordre du classement"""
+    ids = [hit['id'] for hit in hits]
+    objects = {str(obj.pk): obj for obj in queryset.filter(pk__in=ids)}
+    return [objects[pk] for pk in ids if pk in objects]
+
+
+def visible_tickets(queryset, user):
+    """Tickets du périmètre de l'utilisateur (mêmes règles que l'index)"""
+    if user.is_staff or getattr(user, 'userType', '') == 'admin':
+        return queryset
+    if getattr(user, 'userType', '') == 'technician':
+        return queryset.filter(technician__user=user)
+    if getattr(user, 'userType', '') == 'client':
+        return queryset.filter(client__user=user)
+    return queryset.none()
+
+
+_TICKET_NUMBER_RE = re.compile(r'(?:TKT-?)?N?(\d{1,6})(?:-(\d{4}))?')
+_INTERVENTION_CODE_RE = re.compile(r'(?:INT-?)?([0-9A-F]{1,8})')
+
+
+def code_prefix(query, model):
+    """
+    Début de code correspondant à la saisie (« 42 » -> « TKT-N042- »,
+    « int-1a2b » -> « INT-1A2B »), ou None si la saisie n'a pas l'air d'un code.
+    """
+    query = query.strip().upper()
+    if model is Ticket:
+        if query.startswith(TicketCodeSequence.CODE_PREFIX):
+            return query
+        match = _TICKET_NUMBER_RE.fullmatch(query)
+        if match:
+            number, year = match.groups()
+            return TicketCodeSequence.format_code(int(number), year or '')
+    elif model is Intervention:
+        match = _INTERVENTION_CODE_RE.fullmatch(query)
+        # Au moins un chiffre : « CAFE » est un mot, pas un code
+        if match and any(char.isdigit() for char in match.group(1)):
+            return f"INT-{match.group(1)}"
+    return None
+
+
+def with_code_matches(objects, queryset, query, limit):
+    """
+    Compléter avec les codes partiels (« 0042 ») que l'index par mots ne
+    retrouve pas. Seulement pour une saisie en forme de code, et par début de
+    code : le LIKE 'préfixe%' utilise l'index unique de `code`.
+    """
+    if len(objects) >= limit:
+        return objects
+    prefix = code_prefix(query, queryset.model)
+    if prefix is None:
+        return objects
+    seen = {obj.pk for obj in objects}
+    extra = queryset.filter(code__startswith=prefix).exclude(pk__in=seen).order_by('code')[:limit - len(objects)]
+    return objects + list(extra)
+
+
+def wants_fast_search(request):
+    """Le mode parallèle, à résultats allégés, est demandé avec ?mode=fast"""
+    return request.query_params.get('mode') == 'fast'
+
+
+def with_snippets(data, hits):
+    """Ajouter l'extrait de l'index à chaque résultat sérialisé"""
+    snippets = {hit['id']: hit['snippet'] for hit in hits}
+    results = []
+    for item in data:
+        item = dict(item)
+        item['snippet'] = snippets.get(str(item['id']))
+        results.append(item)
+    return results
+
+
+def _run_in_worker(task):
+    # Les threads du pool ont leur propre connexion : même cycle de vie qu'une requête
+    close_old_connections()
+    try:
+        return task()
+    finally:
+        close_old_connections()
+
+
+def _fast_tickets(query, user, prepared):
+    hits = search(query, user, ['ticket'], CATEGORY_LIMIT, prepared)
+    tickets = Ticket.objects.only(*TicketSearchResultSerializer.Meta.fields)
+    tickets = with_code_matches(ranked_objects(tickets, hits), visible_tickets(tickets, user), query, CATEGORY_LIMIT)
+    return with_snippets(TicketSearchResultSerializer(tickets, many=True).data, hits), hits
+
+
+def _fast_procedures(query, user, prepared):
+    hits = search(query, user, ['procedure'], CATEGORY_LIMIT, prepared)
+    procedures = ranked_objects(Procedure.objects.only(*ProcedureSearchResultSerializer.Meta.fields), hits)
+    return with_snippets(ProcedureSearchResultSerializer(procedures, many=True).data, hits), hits
+
+
+def _fast_interventions(query, user, prepared):
+    hits = search(query, user, ['intervention'], CATEGORY_LIMIT, prepared)
+    interventions = Intervention.objects.only('id', 'code', 'ticket', 'intervention_date')
+    interventions = with_code_matches(
+        ranked_objects(interventions, hits),
+        interventions.filter(ticket__in=visible_tickets(Ticket.objects.all(), user)),
+        query, CATEGORY_LIMIT,
+    )
+    return with_snippets(InterventionSearchResultSerializer(interventions, many=True).data, hits), hits
+
+
+def _fast_messages(query, user, prepared):
+    return [], search(query, user, ['message'], CATEGORY_LIMIT, prepared)
+
+
+def _fast_users(query):
+    users = User.objects.filter(
+        Q(username__icontains=query) | Q(email__icontains=query)
+    ).only(*UserSearchResultSerializer.Meta.fields)[:CATEGORY_LIMIT]
+    return list(UserSearchResultSerializer(users, many=True).data), []
 
 
 class GlobalSearchView(APIView):
@@ -12,39 +159,113 @@ class GlobalSearchView(APIView):
         if not query:
             return Response({"error": "Missing query"}, status=400)
 
-        procedures = Procedure.objects.filter(
-            Q(title__icontains=query) | Q(description__icontains=query)
-        )[:10]
+        if wants_fast_search(request):
+            return self.get_fast(request, query)
 
-        tickets = Ticket.objects.filter(
-            Q(title__icontains=query) | Q(description__icontains=query) | Q(code__icontains=query)
-        )[:10]
+        # Une seule lecture des fréquences pour toutes les catégories
+        prepared = prepare_query(query)
+        ticket_hits = search(query, request.user, ['ticket'], CATEGORY_LIMIT, prepared)
+        procedure_hits = search(query, request.user, ['procedure'], CATEGORY_LIMIT, prepared)
+        intervention_hits = search(query, request.user, ['intervention'], CATEGORY_LIMIT, prepared)
+        message_hits = search(query, request.user, ['message'], CATEGORY_LIMIT, prepared)
 
-        interventions = Intervention.objects.filter(
-             Q(code__icontains=query)
-        )[:10]
+        procedures = ranked_objects(Procedure.objects.defer('plain_text'), procedure_hits)
+
+        tickets = Ticket.objects.all()
+        if wants_compact_tickets(request):
+            tickets = TicketListSerializer.setup_queryset(tickets)
+            ticket_serializer_class = TicketListSerializer
+        else:
+            ticket_serializer_class = TicketSerializer
+        tickets = with_code_matches(
+            ranked_objects(tickets, ticket_hits), visible_tickets(tickets, request.user), query, CATEGORY_LIMIT
+        )
+
+        interventions = with_code_matches(
+            ranked_objects(Intervention.objects.all(), intervention_hits),
+            Intervention.objects.filter(ticket__in=visible_tickets(Ticket.objects.all(), request.user)),
+            query, CATEGORY_LIMIT,
+        )
+
+        hits = sorted(
+            ticket_hits + procedure_hits + intervention_hits + message_hits,
+            key=lambda hit: (-hit['matched'], -hit['score']),
+        )[:HITS_LIMIT]
 
         users = User.objects.filter(
             Q(username__icontains=query) | Q(email__icontains=query)
         )[:10]
 
-        return Response({
-            "procedures": ProcedureSerializer(procedures, many=True).data,
-            "tickets": TicketSerializer(tickets, many=True).data,
-            "interventions": InterventionSerializer(interventions, many=True).data,
-            "users": UserSerializer(users, many=True).data,
-        })
+        with serializer_timer(request):
+            data = {
+                "procedures": ProcedureSerializer(procedures, many=True).data,
+                "tickets": ticket_serializer_class(tickets, many=True).data,
+                "interventions": InterventionSerializer(interventions, many=True).data,
+                "users": UserSerializer(users, many=True).data,
+                "hits": hits,
+            }
+        return Response(data)
+
+    def get_fast(self, request, query):
+        """
+        Catégories exécutées en parallèle dans le budget SEARCH_BUDGET : une
+        catégorie trop lente est rendue vide et listée dans `timed_out`.
+        """
+        prepared = prepare_query(query)
+        tasks = {
+            "tickets": partial(_fast_tickets, query, request.user, prepared),
+            "procedures": partial(_fast_procedures, query, request.user, prepared),
+            "interventions": partial(_fast_interventions, query, request.user, prepared),
+            "messages": partial(_fast_messages, query, request.user, prepared),
+            "users": partial(_fast_users, query),
+        }
+        futures = {_search_executor.submit(_run_in_worker, task): name for name, task in tasks.items()}
+        done, pending = wait(futures, timeout=SEARCH_BUDGET)
+
+        data = {"procedures": [], "tickets": [], "interventions": [], "users": []}
+        hits, timed_out, failed = [], [], []
+        for future in pending:
+            # Une requête déjà lancée se termine dans son thread, son résultat est ignoré
+            future.cancel()
+            timed_out.append(futures[future])
+        for future in done:
+            name = futures[future]
+            try:
+                results, category_hits = future.result()
+            except Exception:
+                logger.exception(f"Recherche globale : échec de la catégorie {name}")
+                failed.append(name)
+                continue
+            if name in data:
+                data[name] = results
+            hits.extend(category_hits)
+
+        data["hits"] = sorted(hits, key=lambda hit: (-hit['matched'], -hit['score']))[:HITS_LIMIT]
+        data["partial"] = bool(timed_out or failed)
+        data["timed_out"] = sorted(timed_out)
+        data["failed"] = sorted(failed)
+        return Response(data)
+
+
+class AutocompleteView(APIView):
+    """Suggestions pendant la frappe : libellés courts, sans sérialiseurs complets"""
+
+    def get(self, request):
+        query = request.GET.get("q", "").strip()
+        try:
+            limit = min(max(int(request.GET.get("limit", autocomplete.DEFAULT_LIMIT)), 1), 20)
+        except ValueError:
+            limit = autocomplete.DEFAULT_LIMIT
+        return Response({"query": query, "results": autocomplete.lookup(query, request.user, limit)})
 
 
 class TicketSearchView(APIView):
     def get(self, request):
         query = request.GET.get("q", "").strip()
-        tickets = Ticket.objects.filter(
-            tickets = Ticket.objects.filter(
-                    Q(title__icontains=query) | 
-                    Q(description__icontains=query) |
-                    Q(code__icontains=query)
-                )
+        hits = search(query, request.user, ['ticket'], limit=SEARCH_LIMIT)
+        tickets = with_code_matches(
+            ranked_objects(Ticket.objects.all(), hits),
+            visible_tickets(Ticket.objects.all(), request.user), query, SEARCH_LIMIT,
         )
         return Response(TicketSerializer(tickets, many=True).data)
 
@@ -52,17 +273,19 @@ class TicketSearchView(APIView):
 class ProcedureSearchView(APIView):
     def get(self, request):
         query = request.GET.get("q", "").strip()
-        procedures = Procedure.objects.filter(
-            Q(title__icontains=query) | Q(description__icontains=query)
-        )
+        hits = search(query, request.user, ['procedure'], limit=SEARCH_LIMIT)
+        procedures = ranked_objects(Procedure.objects.defer('plain_text'), hits)
         return Response(ProcedureSerializer(procedures, many=True).data)
 
 
 class InterventionSearchView(APIView):
     def get(self, request):
         query = request.GET.get("q", "").strip()
-        interventions = Intervention.objects.filter(
-            Q(title__icontains=query) | Q(description__icontains=query)
+        hits = search(query, request.user, ['intervention'], limit=SEARCH_LIMIT)
+        interventions = with_code_matches(
+            ranked_objects(Intervention.objects.all(), hits),
+            Intervention.objects.filter(ticket__in=visible_tickets(Ticket.objects.all(), request.user)),
+            query, SEARCH_LIMIT,
         )
         return Response(InterventionSerializer(interventions, many=True).data)
 
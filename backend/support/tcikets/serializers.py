@@ -1,8 +1,11 @@
 from rest_framework import serializers
 from .models import Client, Technician, Ticket, Intervention,ProcedureTag, TicketImage,TechnicianRating,ClientRating, Message,ProcedureTag, ProcedureImage, ProcedureAttachment
 from django.contrib.auth import get_user_model
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Substr
 import uuid
-from .models import Procedure, Notification
+from .models import Procedure, Notification, ProcedureVersion
+from . import procedure_links
 from django.utils import timezone
 from django.utils.timesince import timesince
 User = get_user_model()
@@ -131,66 +134,29 @@ class ProcedureSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Procedure
-        fields = '__all__'
+        exclude = ['plain_text']  # texte brut réservé à l'indexation
         read_only_fields = [
             'id', 'author', 'created_at', 'updated_at', 'views', 
             'likes', 'bookmarks'
         ]
 
     def get_content_preview(self, obj):
-        """Generate a plain text preview of the content"""
-        if not obj.content:
-            return ""
-        
-        # Remove HTML tags for preview
-        import re
-        clean = re.compile('<.*?>')
-        plain_text = re.sub(clean, '', obj.content)
-        
-        # Return first 200 characters
-        return plain_text[:200] + "..." if len(plain_text) > 200 else plain_text
-    
+        """Aperçu texte du contenu, calculé à la sauvegarde"""
+        return obj.preview
+
     def get_reading_time(self, obj):
-        """Calculate estimated reading time"""
+        """Temps de lecture estimé, calculé à la sauvegarde"""
         if not obj.content:
             return "0 min"
-        
-        # Remove HTML tags
-        import re
-        clean = re.compile('<.*?>')
-        plain_text = re.sub(clean, '', obj.content)
-        
-        # Calculate reading time (average 200 words per minute)
-        word_count = len(plain_text.split())
-        reading_time = max(1, round(word_count / 200))
-        
-        return f"{reading_time} min"
+        return f"{obj.reading_time} min"
 
     def create(self, validated_data):
         tag_names = validated_data.pop('tag_names', [])
         images_ids = validated_data.pop('images_ids', [])
         
         procedure = Procedure.objects.create(**validated_data)
-        
-        # Handle tags
-        for tag_name in tag_names:
-            tag_name = tag_name.strip()
-            if tag_name:
-                tag, created = ProcedureTag.objects.get_or_create(
-                    name=tag_name,
-                    defaults={'slug': self._generate_slug(tag_name)}
-                )
-                procedure.tags.add(tag)
-        
-        # Handle images
-        for image_id in images_ids:
-            try:
-                image = ProcedureImage.objects.get(id=image_id, procedure__isnull=True)
-                image.procedure = procedure
-                image.save()
-            except ProcedureImage.DoesNotExist:
-                continue
-        
+        procedure_links.set_tags(procedure, tag_names, created=True)
+        procedure_links.link_images(procedure, images_ids)
         return procedure
 
     def update(self, instance, validated_data):
@@ -202,43 +168,13 @@ class ProcedureSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         instance.save()
         
-        # Handle tags if provided
+        # Seule la différence avec les tags actuels est écrite
         if tag_names is not None:
-            instance.tags.clear()
-            for tag_name in tag_names:
-                tag_name = tag_name.strip()
-                if tag_name:
-                    tag, created = ProcedureTag.objects.get_or_create(
-                        name=tag_name,
-                        defaults={'slug': self._generate_slug(tag_name)}
-                    )
-                    instance.tags.add(tag)
-        
-        # Handle images if provided
+            procedure_links.set_tags(instance, tag_names)
         if images_ids is not None:
-            for image_id in images_ids:
-                try:
-                    image = ProcedureImage.objects.get(id=image_id)
-                    if image.procedure is None or image.procedure == instance:
-                        image.procedure = instance
-                        image.save()
-                except ProcedureImage.DoesNotExist:
-                    continue
-        
+            procedure_links.link_images(instance, images_ids)
+
         return instance
-    
-    def _generate_slug(self, name):
-        """Generate a unique slug for a tag"""
-        from django.utils.text import slugify
-        slug = slugify(name)
-        original_slug = slug
-        counter = 1
-        
-        while ProcedureTag.objects.filter(slug=slug).exists():
-            slug = f"{original_slug}-{counter}"
-            counter += 1
-        
-        return slug
 '''class NotificationSerializer(serializers.ModelSerializer):
     ticket_code = serializers.CharField(source='ticket.code', read_only=True, allow_null=True)
     ticket_title = serializers.CharField(source='ticket.title', read_only=True, allow_null=True)
@@ -461,9 +397,67 @@ class TicketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ticket
         fields = '__all__'
-        
-   
-    
+
+
+class TicketListSerializer(serializers.ModelSerializer):
+    """Représentation compacte des tickets pour les listes (sans messages imbriqués)"""
+    PREVIEW_LENGTH = 120
+
+    id = serializers.UUIDField(read_only=True)
+    client_id = serializers.UUIDField(read_only=True)
+    client_name = serializers.SerializerMethodField()
+    client_company = serializers.CharField(source='client.company', read_only=True)
+    technician_id = serializers.UUIDField(read_only=True, allow_null=True)
+    technician_name = serializers.SerializerMethodField()
+    message_count = serializers.IntegerField(read_only=True)
+    image_count = serializers.IntegerField(read_only=True)
+    last_message_preview = serializers.CharField(read_only=True, allow_null=True)
+    last_message_at = serializers.DateTimeField(read_only=True, allow_null=True)
+
+    class Meta:
+        model = Ticket
+        fields = [
+            'id', 'code', 'title', 'status', 'priority', 'problem_type',
+            'created_at', 'updated_at',
+            'client_id', 'client_name', 'client_company',
+            'technician_id', 'technician_name',
+            'message_count', 'image_count', 'last_message_preview', 'last_message_at',
+        ]
+
+    @classmethod
+    def setup_queryset(cls, queryset):
+        """Annoter le queryset pour produire la liste en une seule requête"""
+        def count_of(model):
+            counts = (
+                model.objects.filter(ticket=OuterRef('pk'))
+                .order_by()
+                .values('ticket')
+                .annotate(total=Count('pk'))
+                .values('total')[:1]
+            )
+            return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+        last_message = Message.objects.filter(ticket=OuterRef('pk')).order_by('-timestamp')
+
+        return queryset.select_related('client__user', 'technician__user').annotate(
+            message_count=count_of(Message),
+            image_count=count_of(TicketImage),
+            last_message_preview=Subquery(
+                last_message.annotate(
+                    preview=Substr('content', 1, cls.PREVIEW_LENGTH)
+                ).values('preview')[:1]
+            ),
+            last_message_at=Subquery(last_message.values('timestamp')[:1]),
+        )
+
+    def get_client_name(self, obj):
+        return obj.client.user.get_full_name()
+
+    def get_technician_name(self, obj):
+        if obj.technician:
+            return obj.technician.user.get_full_name()
+        return None
+
 
 
 class TicketCreateSerializer(serializers.ModelSerializer):
@@ -591,4 +585,47 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         if request and request.user:
             validated_data['user'] = request.user
         
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+# Résultats de la recherche globale (mode rapide) : champs plats, aucune relation chargée
+class TicketSearchResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Ticket
+        fields = ['id', 'code', 'title', 'status', 'priority', 'created_at']
+
+
+class ProcedureSearchResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Procedure
+        fields = ['id', 'title', 'slug', 'description', 'category', 'difficulty', 'status', 'updated_at']
+
+
+class InterventionSearchResultSerializer(serializers.ModelSerializer):
+    ticket_id = serializers.UUIDField(read_only=True)
+
+    class Meta:
+        model = Intervention
+        fields = ['id', 'code', 'ticket_id', 'intervention_date']
+
+
+class UserSearchResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name', 'email', 'userType']
+
+
+class ProcedureVersionSerializer(serializers.ModelSerializer):
+    """Version de procédure sans son contenu (reconstruit à la demande)"""
+    created_by_name = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ProcedureVersion
+        fields = [
+            'id', 'version_number', 'title', 'description', 'created_at',
+            'created_by', 'created_by_name', 'change_summary',
+        ]
+
+    def get_created_by_name(self, obj):
+        if obj.created_by is None:
+            return None
+        return obj.created_by.get_full_name() or obj.created_by.username
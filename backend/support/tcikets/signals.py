@@ -1,13 +1,31 @@
 # signals.py
+from functools import partial
 from django.contrib.auth.signals import user_logged_in
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
 from django.dispatch import receiver
-from .models import Ticket, Notification
-from django.db.models.signals import post_save
+from .models import Ticket, Notification, Client, Technician, Procedure, Intervention, Message, ProcedureTag
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from support.utils.auth_cache import invalidate_user, revoke_token
+from .permissions import forget_ticket_members
+from .search_index import index_instance, remove_object
+from . import autocomplete
+from .notifications import (
+    fan_out_ticket_created, fan_out_ticket_assigned,
+    upsert_login_digest, notify_in_progress_tickets,
+    adjust_notification_counts, invalidate_notification_counts, push_notifications,
+)
 
 @receiver(user_logged_in)
 def create_login_notifications(sender, request, user, **kwargs):
+    if getattr(settings, 'LOGIN_NOTIFICATIONS_DIGEST', True):
+        # Un seul résumé par utilisateur, recalculé au plus une fois par LOGIN_DIGEST_TTL
+        upsert_login_digest(user)
+        return
+
     if user.userType == 'admin':
         pending_tickets = Ticket.objects.filter(status='open').count()
         Notification.objects.create(
@@ -15,62 +33,116 @@ def create_login_notifications(sender, request, user, **kwargs):
             title="Tickets en attente",
             message=f"{pending_tickets} tickets nécessitent votre attention",
         )
-    
-    elif user.userType == 'client':
-        client_tickets = Ticket.objects.filter(
-            client__user=user, 
-            status='in_progress'
-        )
-        for ticket in client_tickets:
-            Notification.objects.create(
-                user=user,
-                title="Ticket en cours",
-                message=f"Votre ticket #{ticket.code} est en cours de traitement",
-                ticket=ticket
-            )
-    
-    elif user.userType == 'technician':
-        technician_tickets = Ticket.objects.filter(
-            technician__user=user,
-            status='in_progress'
-        )
-        for ticket in technician_tickets:
-            Notification.objects.create(
-                user=user,
-                title="Ticket assigné",
-                message=f"Le ticket #{ticket.code} vous a été assigné",
-                ticket=ticket
-            )
-            
+    else:
+        notify_in_progress_tickets(user)
+
 
 User = get_user_model()
 
 @receiver(post_save, sender=Ticket)
 def handle_ticket_notifications(sender, instance, created, **kwargs):
     """
-    Crée des notifications automatiques pour les tickets
+    Crée des notifications automatiques pour les tickets, après le commit
+    de la transaction et en un seul bulk_create par événement
     """
     if created:
         # Notification pour les admins lorsqu'un ticket est créé
-        admins = User.objects.filter(userType='admin', is_active=True)
-        for admin in admins:
-            Notification.objects.create(
-                user=admin,
-                title="Nouveau ticket créé",
-                message=f"Le ticket '{instance.title}' a été créé par {instance.client.user.get_full_name()}.",
-                ticket=instance,
-                is_read=False
-            )
-    
+        transaction.on_commit(partial(fan_out_ticket_created, instance.pk), robust=True)
+
     # Vérifier si le technicien a été assigné ou modifié
-    if instance.technician and instance.technician.user:
-        # Vérifier si c'est une nouvelle assignation
-        if kwargs.get('update_fields') is None or 'technician' in kwargs.get('update_fields', []):
+    if instance.technician_id:
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'technician' in update_fields:
             # Notification pour le technicien assigné
-            Notification.objects.create(
-                user=instance.technician.user,
-                title="Ticket assigné",
-                message=f"Le ticket '{instance.title}' vous a été assigné. Priorité: {instance.get_priority_display()}",
-                ticket=instance,
-                is_read=False
-            )
\ No newline at end of file
+            transaction.on_commit(partial(fan_out_ticket_assigned, instance.pk), robust=True)
+
+
+@receiver(post_save, sender=Notification)
+def update_notification_counts(sender, instance, created, **kwargs):
+    """
+    Tenir à jour les compteurs en cache et pousser aux sockets les notifications
+    créées avec save() (bulk_create passe par notifications.publish_created)
+    """
+    if created:
+        adjust_notification_counts({instance.user_id: (1, 0 if instance.is_read else 1)})
+    else:
+        # On ne connaît pas l'état précédent de is_read : recalcul à la prochaine lecture
+        invalidate_notification_counts(instance.user_id)
+
+    if created or instance.kind == 'login_digest':
+        # Un résumé recalculé est renvoyé comme une nouvelle notification
+        transaction.on_commit(partial(push_notifications, [instance]), robust=True)
+
+
+@receiver(post_delete, sender=Notification)
+def forget_notification_counts(sender, instance, **kwargs):
+    invalidate_notification_counts(instance.user_id)
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def forget_cached_ticket_members(sender, instance, **kwargs):
+    # Client ou technicien modifié : l'accès WebSocket est recalculé
+    forget_ticket_members(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_save, sender=Technician)
+@receiver(post_delete, sender=Client)
+@receiver(post_delete, sender=Technician)
+def forget_cached_profile_user(sender, instance, **kwargs):
+    # Le profil est chargé avec l'utilisateur mis en cache
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Ticket, dispatch_uid='search_index_ticket')
+@receiver(post_save, sender=Procedure, dispatch_uid='search_index_procedure')
+@receiver(post_save, sender=Intervention, dispatch_uid='search_index_intervention')
+@receiver(post_save, sender=Message, dispatch_uid='search_index_message')
+def update_search_index(sender, instance, **kwargs):
+    # Indexé après le commit, une fois les données définitives
+    kind = sender._meta.model_name
+    transaction.on_commit(partial(index_instance, kind, instance.pk), robust=True)
+
+
+@receiver(post_delete, sender=Ticket, dispatch_uid='search_unindex_ticket')
+@receiver(post_delete, sender=Procedure, dispatch_uid='search_unindex_procedure')
+@receiver(post_delete, sender=Intervention, dispatch_uid='search_unindex_intervention')
+@receiver(post_delete, sender=Message, dispatch_uid='search_unindex_message')
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_object(sender._meta.model_name, instance.pk)
+
+@receiver(post_save, sender=Ticket, dispatch_uid='autocomplete_ticket')
+@receiver(post_save, sender=Intervention, dispatch_uid='autocomplete_intervention')
+@receiver(post_save, sender=Procedure, dispatch_uid='autocomplete_procedure')
+@receiver(post_save, sender=ProcedureTag, dispatch_uid='autocomplete_tag')
+@receiver(post_save, sender=User, dispatch_uid='autocomplete_user')
+def update_autocomplete(sender, instance, **kwargs):
+    kind = 'tag' if sender is ProcedureTag else sender._meta.model_name
+    transaction.on_commit(partial(autocomplete.index_instance, kind, instance.pk), robust=True)
+
+
+@receiver(post_delete, sender=Ticket, dispatch_uid='autocomplete_remove_ticket')
+@receiver(post_delete, sender=Intervention, dispatch_uid='autocomplete_remove_intervention')
+@receiver(post_delete, sender=Procedure, dispatch_uid='autocomplete_remove_procedure')
+@receiver(post_delete, sender=ProcedureTag, dispatch_uid='autocomplete_remove_tag')
+@receiver(post_delete, sender=User, dispatch_uid='autocomplete_remove_user')
+def remove_from_autocomplete(sender, instance, **kwargs):
+    kind = 'tag' if sender is ProcedureTag else sender._meta.model_name
+    autocomplete.remove_object(kind, instance.pk)
+
+if apps.is_installed('rest_framework_simplejwt.token_blacklist'):
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+    @receiver(post_save, sender=BlacklistedToken)
+    def forget_blacklisted_token(sender, instance, created, **kwargs):
+        # Le jeton d'accès lié n'est pas connu : oublier toutes les entrées de l'utilisateur
+        token = instance.token
+        revoke_token(token.user_id, token.jti, token.expires_at.timestamp() if token.expires_at else None)
+        if token.user_id:
+            invalidate_user(token.user_id)
@@ -1,3 +1,440 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import tempfile
+import uuid
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from support.utils.text import fold_accents, fold_accents_aligned, tokenize
+from .autocomplete import normalize
+from . import chat_uploads, procedure_jobs, versioning, view_counter
+from .consumers import TicketChatConsumer
+from .models import (
+    AutocompleteEntry, ChatAttachment, Client, Intervention, Message, Notification, Procedure,
+    ProcedureVersion, SearchDocument, Ticket, User,
+)
+from .notifications import encode_resume_token, missed_notifications
+from .pagination import decode_keyset_token, encode_keyset_token
+from .procedure_transfer import import_procedures
+from .search_index import make_snippet
+from .search_views import code_prefix
+
+
+class TokenizeTests(SimpleTestCase):
+    def test_accents_are_folded(self):
+        self.assertEqual(tokenize("Réseau Élevé"), ['reseau', 'eleve'])
+
+    def test_ligatures_are_expanded(self):
+        self.assertEqual(tokenize("nœud"), ['noeud'])
+        self.assertEqual(tokenize("Cœur du réseau"), ['coeur', 'reseau'])
+        self.assertEqual(tokenize("Lætitia"), ['laetitia'])
+        self.assertEqual(tokenize("Straße"), ['strasse'])
+        self.assertEqual(fold_accents("ŒUVRE Æ"), 'oeuvre ae')
+
+    def test_query_matches_indexed_form(self):
+        # La saisie sans ligature retrouve le mot indexé avec
+        self.assertEqual(tokenize("noeud"), tokenize("nœud"))
+
+    def test_autocomplete_normalize(self):
+        self.assertEqual(normalize("Nœud-Réseau"), 'noeud reseau')
+
+    def test_aligned_fold_positions(self):
+        folded, positions = fold_accents_aligned("Le nœud")
+        self.assertEqual(folded, 'le noeud')
+        self.assertEqual(len(positions), len(folded) + 1)
+        self.assertEqual(positions[4], positions[5])  # « o » et « e » viennent de « œ »
+        self.assertEqual(positions[-1], len("Le nœud"))
+
+    def test_snippet_marks_original_text(self):
+        self.assertEqual(make_snippet("Le nœud réseau", ['noeud']), "Le <mark>nœud</mark> réseau")
+        self.assertEqual(make_snippet("Cœur et nœud", ['noeud']), "Cœur et <mark>nœud</mark>")
+
+
+class CodePrefixTests(SimpleTestCase):
+    def test_ticket_numbers(self):
+        self.assertEqual(code_prefix("42", Ticket), 'TKT-N042-')
+        self.assertEqual(code_prefix("n042", Ticket), 'TKT-N042-')
+        self.assertEqual(code_prefix("042-2026", Ticket), 'TKT-N042-2026')
+        self.assertEqual(code_prefix("tkt-n04", Ticket), 'TKT-N04')
+
+    def test_intervention_codes(self):
+        self.assertEqual(code_prefix("int-1a2b", Intervention), 'INT-1A2B')
+        self.assertEqual(code_prefix("1A2B", Intervention), 'INT-1A2B')
+
+    def test_words_do_not_fall_back_to_codes(self):
+        # Pas de LIKE sur `code` pour une recherche ordinaire
+        self.assertIsNone(code_prefix("réseau", Ticket))
+        self.assertIsNone(code_prefix("cafe", Intervention))
+        self.assertIsNone(code_prefix("panne imprimante", Intervention))
+
+
+def forged_token(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+class KeysetTokenTests(SimpleTestCase):
+    def test_round_trip(self):
+        moment, pk = timezone.now(), uuid.uuid4()
+        self.assertEqual(decode_keyset_token(encode_keyset_token(moment, pk)), (moment, pk))
+
+    def test_invalid_tokens(self):
+        for token in ["", "pas-du-base64!", forged_token("2026-01-01T00:00:00|foo"),
+                      forged_token(f"hier|{uuid.uuid4()}"), forged_token("2026-01-01T00:00:00")]:
+            self.assertIsNone(decode_keyset_token(token), token)
+
+    def test_naive_datetime_is_made_aware(self):
+        moment, _ = decode_keyset_token(forged_token(f"2026-01-01T00:00:00|{uuid.uuid4()}"))
+        self.assertTrue(timezone.is_aware(moment))
+
+
+class MissedNotificationsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='tech', password='x')
+        self.first = Notification.objects.create(user=self.user, title='a', message='a')
+        self.second = Notification.objects.create(user=self.user, title='b', message='b')
+
+    def test_resume_after_token(self):
+        notifications, has_more = missed_notifications(self.user.pk, encode_resume_token(self.first))
+        self.assertEqual(notifications, [self.second])
+        self.assertFalse(has_more)
+
+    def test_forged_token_asks_for_resync(self):
+        # Avant : ValidationError sur id__gt='foo', qui fermait le socket
+        token = forged_token("2026-01-01T00:00:00|foo")
+        self.assertEqual(missed_notifications(self.user.pk, token), (None, False))
+
+
+def client_ticket(user):
+    client, _ = Client.objects.get_or_create(user=user, defaults={'company': 'ACME'})
+    return Ticket.objects.create(title='Panne', description='Écran noir', client=client)
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='client', password='x')
+        ticket = client_ticket(self.user)
+        self.messages = [Message.objects.create(ticket=ticket, user=self.user, content=str(i)) for i in range(3)]
+        start = timezone.now()
+        for i, message in enumerate(self.messages):
+            message.timestamp = start + timedelta(seconds=i)
+            Message.objects.filter(pk=message.pk).update(timestamp=message.timestamp)
+        self.consumer = TicketChatConsumer()
+        self.consumer.ticket_id = ticket.pk
+
+    def history(self, limit, before=None):
+        return async_to_sync(self.consumer.get_recent_messages)(limit, before=before)
+
+    def test_pages_with_cursor(self):
+        latest, has_more = self.history(2)
+        self.assertEqual(latest, self.messages[1:])
+        self.assertTrue(has_more)
+        cursor = encode_keyset_token(latest[0].timestamp, latest[0].pk)
+        self.assertEqual(self.history(2, before=cursor), (self.messages[:1], False))
+
+    def test_forged_cursor_returns_nothing(self):
+        self.assertEqual(self.history(2, before=forged_token("2026-01-01T00:00:00|foo")), ([], False))
+        self.assertEqual(self.history(2, before="pas-un-jeton"), ([], False))
+
+
+def jsonl(*records):
+    return io.BytesIO(''.join(json.dumps(record) + '\n' for record in records).encode())
+
+
+def procedure_line(title, slug=None):
+    return {'id': str(uuid.uuid4()), 'title': title, 'slug': slug, 'description': title,
+            'content': f"<p>{title}</p>", 'estimated_time': '1h'}
+
+
+class ProcedureImportTests(TestCase):
+    def test_slugs_avoid_database_and_batch(self):
+        Procedure.objects.create(title='Réseau', description='d', content='c', estimated_time='1h', slug='reseau')
+        taken = procedure_line('Réseau', slug='reseau')
+        kept = procedure_line('Autre', slug='reseau-1')
+        stats, errors = import_procedures(jsonl(taken, kept), with_media=False)
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(Procedure.objects.get(pk=kept['id']).slug, 'reseau-1')
+        self.assertEqual(Procedure.objects.get(pk=taken['id']).slug, 'reseau-2')
+
+    def test_invalid_slug_is_rejected(self):
+        stats, errors = import_procedures(
+            jsonl(procedure_line('A', slug='pas un slug'), procedure_line('B', slug='b' * 256),
+                  procedure_line('C', slug=3), procedure_line('D')),
+            with_media=False,
+        )
+        self.assertEqual((stats['created'], stats['invalid']), (1, 3))
+
+    def test_rerun_indexes_skipped_procedures(self):
+        line = procedure_line('Imprimante bloquée')
+        import_procedures(jsonl(line), with_media=False)
+        # Import interrompu entre le commit du lot et son indexation
+        SearchDocument.objects.filter(object_id=line['id']).delete()
+        AutocompleteEntry.objects.filter(object_id=line['id']).delete()
+
+        stats, _ = import_procedures(jsonl(line), with_media=False)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertTrue(SearchDocument.objects.filter(kind='procedure', object_id=line['id']).exists())
+        self.assertTrue(AutocompleteEntry.objects.filter(kind='procedure', object_id=line['id']).exists())
+
+
+class ProcedureJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='admin', password='x', userType='admin')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = FileSystemStorage(location=directory.name)
+        # Jobs exécutés dans le thread du test
+        run_now = mock.Mock(submit=lambda function, *args: function(*args))
+        for name, value in (('storage', storage), ('_executor', run_now)):
+            patcher = mock.patch.object(procedure_jobs, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_import_job(self):
+        line = procedure_line('Sauvegarde')
+        upload = SimpleUploadedFile('procedures.jsonl', jsonl(line, {'id': 'x'}).getvalue())
+        job = procedure_jobs.start_import(self.user, upload)
+
+        job = procedure_jobs.get_job(job['id'])
+        self.assertEqual(job['status'], procedure_jobs.DONE)
+        self.assertEqual((job['stats']['created'], job['stats']['invalid']), (1, 1))
+        self.assertEqual(Procedure.objects.get(pk=line['id']).author, self.user)
+        # Fichier reçu supprimé après l'import
+        self.assertEqual(procedure_jobs.storage.listdir('imports'), ([], []))
+
+    def test_invalid_import_file_fails_job(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('autre.txt', 'sans procedures.jsonl')
+        upload = SimpleUploadedFile('procedures.zip', archive.getvalue())
+        with self.assertLogs('tcikets.procedure_jobs', 'ERROR'):
+            job = procedure_jobs.start_import(self.user, upload)
+        job = procedure_jobs.get_job(job['id'])
+        self.assertEqual(job['status'], procedure_jobs.FAILED)
+        self.assertIn('Invalid import file', job['error'])
+
+    def test_export_job(self):
+        Procedure.objects.create(title='Réseau', description='d', content='c', estimated_time='1h')
+        job = procedure_jobs.get_job(procedure_jobs.start_export(self.user)['id'])
+        self.assertEqual((job['status'], job['stats']['procedures']), (procedure_jobs.DONE, 1))
+        with procedure_jobs.storage.open(job['file'], 'rb') as archive:
+            self.assertIn('procedures.jsonl', zipfile.ZipFile(archive).namelist())
+
+    def test_job_visibility(self):
+        job = procedure_jobs.start_export(self.user)
+        other = User.objects.create_user(username='other', password='x')
+        self.assertTrue(procedure_jobs.can_view_job(job, self.user))
+        self.assertFalse(procedure_jobs.can_view_job(job, other))
+        self.assertFalse(procedure_jobs.can_view_job(None, self.user))
+
+
+class ChatThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user(username='client', password='x')
+        self.ticket = client_ticket(self.user)
+        image = io.BytesIO()
+        Image.new('RGB', (640, 480)).save(image, format='PNG')
+        self.attachment = ChatAttachment.objects.create(
+            ticket=self.ticket, uploaded_by=self.user, content_type='image/png',
+            file=SimpleUploadedFile('photo.png', image.getvalue()),
+        )
+
+    def send(self):
+        attachment = chat_uploads.claim_attachment(self.attachment.pk, self.ticket.pk, self.user)
+        message = Message(ticket=self.ticket, user=self.user, content='photo')
+        return attachment, message
+
+    def test_thumbnail_done_before_commit_is_sent_with_message(self):
+        attachment, message = self.send()
+        # Miniature terminée après la lecture de la pièce jointe, avant le commit
+        with mock.patch.object(chat_uploads, 'announce_thumbnail') as announce:
+            chat_uploads.generate_thumbnail(self.attachment.pk)
+        announce.assert_not_called()
+
+        chat_uploads.send_with_attachment(message, attachment)
+        self.assertIsNotNone(attachment.thumbnail_url)
+
+    def test_thumbnail_done_after_commit_is_announced(self):
+        attachment, message = self.send()
+        chat_uploads.send_with_attachment(message, attachment)
+        self.assertIsNone(attachment.thumbnail_url)
+
+        with mock.patch.object(chat_uploads, 'announce_thumbnail') as announce:
+            chat_uploads.generate_thumbnail(self.attachment.pk)
+        announce.assert_called_once()
+        self.assertEqual(announce.call_args.args[1], message.pk)
+
+
+class ProcedureViewCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # Pas de minuteur : les reports sont déclenchés par le test
+        patcher = mock.patch.object(view_counter, '_ensure_timer')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.procedure = Procedure.objects.create(title='Réseau', description='d', content='c', estimated_time='1h')
+
+    def view(self, ip):
+        request = RequestFactory().get('/', REMOTE_ADDR=ip)
+        request.user = AnonymousUser()
+        view_counter.record_view(request, self.procedure.pk)
+
+    def views(self):
+        return Procedure.objects.values_list('views', flat=True).get(pk=self.procedure.pk)
+
+    def test_anonymous_views_are_flushed_once(self):
+        for ip in ('10.0.0.1', '10.0.0.2', '10.0.0.1'):
+            self.view(ip)
+        self.assertEqual(view_counter.pending_views(self.procedure.pk), 2)
+        self.assertEqual(view_counter.flush(), 2)
+        self.assertEqual(view_counter.flush(), 0)
+        self.assertEqual(self.views(), 2)
+
+        self.view('10.0.0.3')
+        self.assertEqual(view_counter.flush(), 1)
+        self.assertEqual(self.views(), 3)
+
+    def test_dirty_procedures_are_shared_through_cache(self):
+        self.view('10.0.0.1')
+        # Un autre worker (sans état en mémoire) retrouve la procédure à reporter
+        self.assertEqual(view_counter._dirty_procedures(), {str(self.procedure.pk)})
+        self.assertEqual(view_counter.flush(), 1)
+        self.assertEqual(self.views(), 1)
+
+    def test_failed_flush_keeps_views_pending(self):
+        self.view('10.0.0.1')
+        with mock.patch.object(view_counter, '_count_new_viewers', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                view_counter.flush()
+        self.assertEqual(view_counter.flush(), 1)
+        self.assertEqual(self.views(), 1)
+
+
+class VersionDeltaTests(SimpleTestCase):
+    def test_delta_round_trip(self):
+        cases = [
+            ("", "<p>Nouveau</p>"),
+            ("<p>Redémarrer le routeur</p>", ""),
+            ("<p>Redémarrer le routeur</p>", "<p>Redémarrer le <b>switch</b> puis le routeur</p>"),
+            ("<ul><li>un</li><li>deux</li></ul>", "<ul><li>deux</li><li>trois</li></ul>"),
+            ("a  b\n<c", "a b\n\n<c d"),
+        ]
+        for base, target in cases:
+            self.assertEqual(versioning.apply_delta(base, versioning.encode_delta(base, target)), target)
+
+    def chain(self, contents):
+        versions, previous = [], None
+        for number, content in enumerate(contents, start=1):
+            version = ProcedureVersion(version_number=number)
+            versioning.encode_version_content(version, content, previous, keyframe=previous is None)
+            versions.append(version)
+            previous = content
+        return versions
+
+    def test_rebuild_chain(self):
+        body = "<p>Débrancher le routeur, attendre trente secondes puis le rebrancher.</p>" * 5
+        contents = [f"<h1>Étape {i}</h1>{body}<p>{'vérifier ' * i}le câble</p>" for i in range(1, 6)]
+        chain = self.chain(contents)
+        self.assertTrue(chain[0].is_keyframe)
+        self.assertFalse(any(version.is_keyframe for version in chain[1:]))
+        for end in range(1, len(chain) + 1):
+            self.assertEqual(versioning._rebuild_chain(chain[:end]), contents[end - 1])
+
+    def test_rebuild_chain_errors(self):
+        body = "<p>Débrancher le routeur, attendre trente secondes puis le rebrancher.</p>" * 5
+        chain = self.chain([f"{body}<p>quatre</p>", f"{body}<p>cinq</p>"])
+        self.assertFalse(chain[1].is_keyframe)
+        with self.assertRaises(versioning.VersionChainError):
+            versioning._rebuild_chain(chain[1:])
+        chain[1].content_checksum = versioning.content_checksum('autre chose')
+        with self.assertRaises(versioning.VersionChainError):
+            versioning._rebuild_chain(chain)
+
+
+class ProcedureVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.procedure = Procedure.objects.create(
+            title='Réseau', description='d', content='<p>Version 0 du contenu de la procédure</p>',
+            estimated_time='1h',
+        )
+
+    def edit(self, count):
+        for i in range(1, count + 1):
+            self.procedure.content = f"<p>Version {i} du contenu de la procédure</p>"
+            self.procedure.save()
+
+    def versions(self):
+        return list(self.procedure.versions.order_by('version_number'))
+
+    def test_keyframe_interval(self):
+        self.edit(2 * versioning.KEYFRAME_INTERVAL + 1)
+        versions = self.versions()
+        self.assertEqual(
+            [version.version_number for version in versions if version.is_keyframe],
+            [1, versioning.KEYFRAME_INTERVAL + 1, 2 * versioning.KEYFRAME_INTERVAL + 1],
+        )
+        for number, version in enumerate(versions, start=1):
+            self.assertEqual(versioning.version_content(version), f"<p>Version {number} du contenu de la procédure</p>")
+
+    def test_unchanged_save_records_nothing(self):
+        self.edit(1)
+        self.procedure.save()
+        self.assertEqual(len(self.versions()), 1)
+
+    def test_concurrent_version_number_falls_back_to_keyframe(self):
+        self.edit(2)
+        original = versioning._versions_since_keyframe
+
+        def concurrent_save(procedure_id, latest_number):
+            # Autre worker : même numéro de version enregistré juste avant nous
+            ProcedureVersion.objects.create(
+                procedure=self.procedure, version_number=latest_number + 1,
+                title='x', description='x', content='<p>x</p>',
+            )
+            return original(procedure_id, latest_number)
+
+        self.procedure.content = "<p>Version 3 du contenu de la procédure</p>"
+        with mock.patch.object(versioning, '_versions_since_keyframe', side_effect=concurrent_save):
+            version = versioning.record_version(self.procedure)
+        self.assertEqual((version.version_number, version.is_keyframe), (4, True))
+        self.assertEqual(versioning.version_content(version), self.procedure.content)
+        # La transaction englobante reste utilisable
+        self.assertEqual(len(self.versions()), 4)
+
+    def test_compaction_is_idempotent(self):
+        self.edit(5)
+        # Doublons et contenu stocké en entier, comme avant les différences
+        for version in self.versions():
+            versioning.encode_version_content(version, versioning.version_content(version), keyframe=True)
+            version.save()
+        duplicate = self.versions()[-1]
+        duplicate.pk, duplicate.version_number = None, 6
+        duplicate.save()
+
+        call_command('compact_procedure_versions', stdout=io.StringIO())
+        first = [(v.version_number, v.is_keyframe, v.content, v.content_delta) for v in self.versions()]
+        call_command('compact_procedure_versions', stdout=io.StringIO())
+        second = [(v.version_number, v.is_keyframe, v.content, v.content_delta) for v in self.versions()]
+
+        self.assertEqual(first, second)
+        self.assertEqual([number for number, *_ in first], [1, 2, 3, 4, 5])
+        self.assertEqual([keyframe for _, keyframe, *_ in first], [True, False, False, False, False])
+        for number, version in enumerate(self.versions(), start=1):
+            self.assertEqual(versioning.version_content(version), f"<p>Version {number} du contenu de la procédure</p>")
@@ -0,0 +1,103 @@
+"""
+Agrégation des indicateurs de frappe par salon de ticket.
+
+Les frames `typing` ne sont plus diffusées une à une : chaque worker garde
+la liste des utilisateurs en train d'écrire sur ses connexions et envoie au
+plus une photo (« snapshot ») par salon toutes les SNAPSHOT_INTERVAL secondes,
+seulement si elle a changé ou doit être rafraîchie. Les consumers fusionnent
+les photos des différents workers ; une entrée non rafraîchie expire après
+TYPING_EXPIRY secondes.
+"""
+import asyncio
+import logging
+import uuid
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = getattr(settings, 'CHAT_TYPING_SNAPSHOT_INTERVAL', 0.5)  # secondes
+TYPING_EXPIRY = getattr(settings, 'CHAT_TYPING_EXPIRY', 3.0)  # secondes
+
+# Identifie les photos envoyées par ce processus
+WORKER_ID = uuid.uuid4().hex
+
+
+class TypingAggregator:
+    """Utilisateurs en train d'écrire, par groupe de salon, pour la boucle du worker"""
+
+    def __init__(self):
+        self._rooms = {}  # group -> {user_id: {"user_name", "expires_at"}}
+        self._dirty = set()
+        self._task = None
+        self._loop = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    def typing(self, group, user_id, user_name):
+        self._ensure_started()
+        room = self._rooms.setdefault(group, {})
+        entry = room.get(user_id)
+        expires_at = self._loop.time() + TYPING_EXPIRY
+        if entry is None:
+            room[user_id] = {"user_name": user_name, "expires_at": expires_at}
+            self._dirty.add(group)
+        else:
+            # Rafraîchir avant que les autres workers ne fassent expirer l'entrée
+            if entry["expires_at"] - self._loop.time() < TYPING_EXPIRY / 2:
+                self._dirty.add(group)
+            entry["expires_at"] = expires_at
+
+    def stopped(self, group, user_id):
+        room = self._rooms.get(group)
+        if room and room.pop(user_id, None) is not None:
+            self._ensure_started()
+            self._dirty.add(group)
+
+    def snapshot(self, group):
+        return [
+            {"user_id": user_id, "user_name": entry["user_name"]}
+            for user_id, entry in self._rooms.get(group, {}).items()
+        ]
+
+    def _expire(self):
+        now = self._loop.time()
+        for group, room in list(self._rooms.items()):
+            expired = [user_id for user_id, entry in room.items() if entry["expires_at"] <= now]
+            for user_id in expired:
+                del room[user_id]
+            if expired:
+                self._dirty.add(group)
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+            self._expire()
+            dirty, self._dirty = self._dirty, set()
+
+            for group in dirty:
+                try:
+                    await channel_layer.group_send(group, {
+                        "type": "typing_snapshot",
+                        "source": WORKER_ID,
+                        "users": self.snapshot(group),
+                        "expires_in": TYPING_EXPIRY,
+                    })
+                except Exception as e:
+                    logger.warning(f"Indicateur de frappe non diffusé pour {group}: {e}")
+                if not self._rooms.get(group):
+                    self._rooms.pop(group, None)
+
+            if not self._rooms and not self._dirty:
+                # Plus personne n'écrit : la tâche sera relancée à la prochaine frappe
+                self._task = None
+                return
+
+
+typing_aggregator = TypingAggregator()
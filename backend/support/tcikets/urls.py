@@ -3,6 +3,7 @@ from . import views
 from . import extend_views
 from .search_views import (
     GlobalSearchView,
+    AutocompleteView,
     TicketSearchView,
     ProcedureSearchView,
     InterventionSearchView,
@@ -25,6 +26,8 @@ urlpatterns = [
     path("tickets/export/<str:file_format>/", views.ExportTicketPDFView.as_view(), name='export-tickets'),
     path('tickets/', views.TicketListCreateView.as_view(), name='ticket-list'),
     path('tickets/<uuid:id>/', views.TicketRetrieveUpdateDestroyView.as_view(), name='ticket-detail'),
+    path('tickets/<uuid:ticket_id>/chat/uploads/', extend_views.ChatImageUploadView.as_view(), name='ticket-chat-upload'),
+    path('tickets/<uuid:ticket_id>/presence/', extend_views.TicketPresenceView.as_view(), name='ticket-presence'),
     path('tickets/<uuid:pk>/<str:action>/', views.TicketActionsView.as_view(), name='ticket-actions'),
     path('tickets/<uuid:ticket_id>/interventions/', views.InterventionByTicketView.as_view(), name='ticket-interventions'),
 
@@ -69,6 +72,9 @@ urlpatterns = [
     path('notifications/<uuid:pk>/read/', extend_views.mark_notification_read, name='mark-notification-read'),
     path('notifications/mark-all-read/', extend_views.mark_all_notifications_read, name='mark-all-read'),
     path('notifications/stats/', extend_views.NotificationStatsView.as_view(), name='notification-stats'),
+
+    # Instrumentation
+    path('metrics/endpoints/', extend_views.EndpointMetricsView.as_view(), name='endpoint-metrics'),
     
     path('tickets/<uuid:ticket_id>/send-to-client/', views.send_to_client, name='send_to_client'),
     path('tickets/<uuid:ticket_id>/send-to-technician/', views.send_to_technician, name='send_to_technician'),
@@ -79,6 +85,14 @@ urlpatterns = [
     
     path('procedures/', extend_views.ProcedureListCreateView.as_view(), name='procedure-list'),
     path('procedures/<uuid:pk>/', extend_views.ProcedureRetrieveUpdateDestroyView.as_view(), name='procedure-detail'),
+    path('procedures/export/', extend_views.export_procedures, name='procedure-export'),
+    path('procedures/import/', extend_views.import_procedures, name='procedure-import'),
+    path('procedures/jobs/<uuid:job_id>/', extend_views.procedure_job, name='procedure-job'),
+    path('procedures/jobs/<uuid:job_id>/download/', extend_views.download_procedure_export, name='procedure-job-download'),
+    path('procedures/<uuid:pk>/versions/', extend_views.ProcedureVersionListView.as_view(), name='procedure-version-list'),
+    path('procedures/<uuid:pk>/versions/diff/', extend_views.ProcedureVersionDiffView.as_view(), name='procedure-version-diff'),
+    path('procedures/<uuid:pk>/versions/<int:version_number>/', extend_views.ProcedureVersionDetailView.as_view(), name='procedure-version-detail'),
+    path('procedures/<uuid:pk>/versions/<int:version_number>/restore/', extend_views.restore_procedure_version, name='procedure-version-restore'),
     #path('procedures/upload_image/', extend_views.upload_procedure_image, name='procedure-upload-image'),
     #path('procedures/images/<uuid:image_id>/', extend_views.delete_procedure_image, name='procedure-delete-image'),
     path('procedures/<uuid:procedure_id>/interaction/', extend_views.procedure_interaction, name='procedure-interaction'),   
@@ -97,6 +111,7 @@ urlpatterns = [
     #serach section
     
     path("search/", GlobalSearchView.as_view(), name="global-search"),
+    path("search/autocomplete/", AutocompleteView.as_view(), name="search-autocomplete"),
     path("search/tickets/", TicketSearchView.as_view(), name="search-tickets"),
     path("search/procedures/", ProcedureSearchView.as_view(), name="search-procedures"),
     path("search/interventions/", InterventionSearchView.as_view(), name="search-interventions"),
@@ -0,0 +1,302 @@
+"""
+Versions des procédures stockées par différences.
+
+Une version n'est créée que si le titre, la description ou le contenu ont
+changé depuis la dernière. Le contenu est stocké en entier dans une version
+clé (« keyframe ») toutes les KEYFRAME_INTERVAL versions ; entre deux, chaque
+version ne garde que la différence avec la précédente. Une version se
+reconstruit depuis la dernière clé qui la précède (au plus KEYFRAME_INTERVAL
+différences à appliquer).
+
+Format d'une différence (JSON) : liste d'opérations sur les morceaux du
+contenu précédent (balises, mots, espaces) — entier positif : recopier n
+morceaux, entier négatif : en sauter n, chaîne : texte inséré.
+"""
+import hashlib
+import json
+import re
+import uuid
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .models import ProcedureVersion
+
+VERSIONED_FIELDS = ('title', 'description', 'content')
+KEYFRAME_INTERVAL = getattr(settings, 'PROCEDURE_VERSION_KEYFRAME_INTERVAL', 10)
+# Au-delà de cette taille relative, la différence coûte plus qu'une copie complète
+MAX_DELTA_RATIO = 0.5
+VERSION_CACHE_TTL = getattr(settings, 'PROCEDURE_VERSION_CACHE_TTL', 60 * 60)
+DIFF_CONTEXT = 120  # caractères gardés autour d'un passage modifié
+
+_CHUNK_RE = re.compile(r'<[^>]*>|[^<\s]+|\s+|<')
+
+
+class VersionChainError(Exception):
+    """Chaîne de versions incomplète ou contenu reconstruit incohérent"""
+
+
+def content_checksum(content):
+    return hashlib.md5((content or '').encode()).hexdigest()
+
+
+def split_chunks(content):
+    return _CHUNK_RE.findall(content or '')
+
+
+# -----------------------------
+# Différences
+# -----------------------------
+def encode_delta(base, target):
+    """Opérations qui transforment `base` en `target`"""
+    a, b = split_chunks(base), split_chunks(target)
+    operations = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b).get_opcodes():
+        if tag == 'equal':
+            operations.append(i2 - i1)
+            continue
+        if tag in ('replace', 'delete'):
+            operations.append(-(i2 - i1))
+        if tag in ('replace', 'insert'):
+            operations.append(''.join(b[j1:j2]))
+    return operations
+
+
+def apply_delta(base, operations):
+    chunks = split_chunks(base)
+    position, output = 0, []
+    for operation in operations:
+        if isinstance(operation, str):
+            output.append(operation)
+        elif operation > 0:
+            output.extend(chunks[position:position + operation])
+            position += operation
+        else:
+            position -= operation
+    return ''.join(output)
+
+
+def encode_version_content(version, content, base_content=None, keyframe=False):
+    """
+    Renseigner le stockage du contenu de `version` : copie complète si
+    `keyframe` ou si la différence avec `base_content` n'est pas rentable.
+    """
+    version.content_checksum = content_checksum(content)
+    if not keyframe and base_content is not None:
+        delta = json.dumps(encode_delta(base_content, content), ensure_ascii=False, separators=(',', ':'))
+        if len(delta) <= MAX_DELTA_RATIO * len(content):
+            version.is_keyframe = False
+            version.content = ''
+            version.content_delta = delta
+            return version
+
+    version.is_keyframe = True
+    version.content = content
+    version.content_delta = ''
+    return version
+
+
+# -----------------------------
+# Reconstruction
+# -----------------------------
+def _rebuild_chain(chain):
+    """Contenu de la dernière version d'une chaîne qui commence par une version clé"""
+    if not chain or not chain[0].is_keyframe:
+        raise VersionChainError("La chaîne de versions ne commence pas par une version clé")
+
+    content = chain[0].content
+    for version in chain[1:]:
+        if version.is_keyframe:
+            content = version.content
+        else:
+            content = apply_delta(content, json.loads(version.content_delta))
+
+    expected = chain[-1].content_checksum
+    if expected and content_checksum(content) != expected:
+        raise VersionChainError(f"Contenu reconstruit invalide pour la version {chain[-1].pk}")
+    return content
+
+
+def version_content(version):
+    """Contenu complet d'une version (une ou deux requêtes pour une différence)"""
+    if version.is_keyframe:
+        return version.content
+
+    versions = ProcedureVersion.objects.filter(procedure_id=version.procedure_id)
+    keyframe_number = (
+        versions.filter(is_keyframe=True, version_number__lt=version.version_number)
+        .order_by('-version_number')
+        .values_list('version_number', flat=True)
+        .first()
+    )
+    if keyframe_number is None:
+        raise VersionChainError(f"Aucune version clé avant la version {version.pk}")
+
+    chain = list(
+        versions.filter(version_number__gte=keyframe_number, version_number__lte=version.version_number)
+        .only('id', 'version_number', 'is_keyframe', 'content', 'content_delta', 'content_checksum')
+        .order_by('version_number')
+    )
+    return _rebuild_chain(chain)
+
+
+def iter_version_contents(versions):
+    """(version, contenu) pour des versions d'une procédure triées par numéro croissant"""
+    content = None
+    for version in versions:
+        if version.is_keyframe:
+            content = version.content
+        elif content is None:
+            content = version_content(version)
+        else:
+            content = apply_delta(content, json.loads(version.content_delta))
+        yield version, content
+
+
+# -----------------------------
+# Écriture
+# -----------------------------
+def _versions_since_keyframe(procedure_id, latest_number):
+    keyframe_number = (
+        ProcedureVersion.objects.filter(procedure_id=procedure_id, is_keyframe=True)
+        .order_by('-version_number')
+        .values_list('version_number', flat=True)
+        .first()
+    )
+    if keyframe_number is None:
+        return KEYFRAME_INTERVAL
+    return latest_number - keyframe_number + 1
+
+
+def record_version(procedure, user=None, change_summary=''):
+    """
+    Enregistrer l'état versionné de la procédure s'il diffère de la dernière
+    version ; renvoie la version créée ou None.
+    """
+    latest = procedure.versions.order_by('-version_number').first()
+    content = procedure.content or ''
+
+    if latest is not None:
+        latest_content = cached_version_content(latest)
+        if (latest.title, latest.description, latest_content) == (procedure.title, procedure.description, content):
+            return None
+
+    version = ProcedureVersion(
+        procedure=procedure,
+        version_number=latest.version_number + 1 if latest else 1,
+        title=procedure.title,
+        description=procedure.description,
+        created_by=user or procedure.author,
+        change_summary=change_summary,
+    )
+    keyframe = latest is None or _versions_since_keyframe(procedure.pk, latest.version_number) >= KEYFRAME_INTERVAL
+    encode_version_content(version, content, None if latest is None else latest_content, keyframe)
+
+    try:
+        with transaction.atomic():
+            version.save()
+    except IntegrityError:
+        # Version enregistrée en parallèle avec le même numéro : la suivante est une clé.
+        # Dans son propre savepoint : un second échec ne casse pas la transaction de l'appelant
+        with transaction.atomic():
+            version.version_number = procedure.versions.order_by('-version_number').values_list(
+                'version_number', flat=True
+            ).first() + 1
+            encode_version_content(version, content, keyframe=True)
+            version.save()
+
+    procedure_id = procedure.pk
+    transaction.on_commit(lambda: invalidate_versions(procedure_id), robust=True)
+    return version
+
+
+# -----------------------------
+# Cache des contenus reconstruits et des différences
+# -----------------------------
+def _generation_key(procedure_id):
+    return f"procedure_versions:generation:{procedure_id}"
+
+
+def versions_generation(procedure_id):
+    """Génération des versions en cache ; changée à chaque écriture de version"""
+    generation = cache.get(_generation_key(procedure_id))
+    if generation is None:
+        generation = uuid.uuid4().hex
+        if not cache.add(_generation_key(procedure_id), generation, None):
+            generation = cache.get(_generation_key(procedure_id), generation)
+    return generation
+
+
+def invalidate_versions(procedure_id):
+    cache.set(_generation_key(procedure_id), uuid.uuid4().hex, None)
+
+
+def cached_version_content(version):
+    key = f"procedure_versions:{version.procedure_id}:{versions_generation(version.procedure_id)}:content:{version.version_number}"
+    content = cache.get(key)
+    if content is None:
+        content = version_content(version)
+        cache.set(key, content, VERSION_CACHE_TTL)
+    return content
+
+
+def _text_changes(old, new, split=split_chunks):
+    """
+    Passages de `old` à `new` : liste de {"op": equal|insert|delete, "text"}.
+    Les longs passages inchangés sont réduits à leur contexte et à `skipped`.
+    """
+    a, b = split(old), split(new)
+    changes = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b).get_opcodes():
+        if tag == 'equal':
+            text = ''.join(a[i1:i2])
+            if len(text) > 2 * DIFF_CONTEXT:
+                first = not changes
+                last = j2 == len(b) and i2 == len(a)
+                head = '' if first else text[:DIFF_CONTEXT]
+                tail = '' if last else text[-DIFF_CONTEXT:]
+                changes.append({
+                    "op": "equal", "text": head, "skipped": len(text) - len(head) - len(tail), "tail": tail,
+                })
+            else:
+                changes.append({"op": "equal", "text": text})
+            continue
+        if tag in ('replace', 'delete'):
+            changes.append({"op": "delete", "text": ''.join(a[i1:i2])})
+        if tag in ('replace', 'insert'):
+            changes.append({"op": "insert", "text": ''.join(b[j1:j2])})
+    return changes
+
+
+def version_diff(old_version, new_version):
+    """Différence structurée entre deux versions d'une même procédure (mise en cache)"""
+    procedure_id = new_version.procedure_id
+    key = (
+        f"procedure_versions:{procedure_id}:{versions_generation(procedure_id)}"
+        f":diff:{old_version.version_number}:{new_version.version_number}"
+    )
+    diff = cache.get(key)
+    if diff is not None:
+        return diff
+
+    old_content = cached_version_content(old_version)
+    new_content = cached_version_content(new_version)
+    content_changes = _text_changes(old_content, new_content)
+    diff = {
+        "from_version": old_version.version_number,
+        "to_version": new_version.version_number,
+        "title": None if old_version.title == new_version.title else {
+            "old": old_version.title, "new": new_version.title,
+        },
+        "description": None if old_version.description == new_version.description else
+            _text_changes(old_version.description, new_version.description),
+        "content": None if old_content == new_content else content_changes,
+        "stats": {
+            "inserted": sum(len(c["text"]) for c in content_changes if c["op"] == "insert"),
+            "deleted": sum(len(c["text"]) for c in content_changes if c["op"] == "delete"),
+        },
+    }
+    cache.set(key, diff, VERSION_CACHE_TTL)
+    return diff
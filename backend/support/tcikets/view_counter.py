@@ -0,0 +1,242 @@
+"""
+Compteur de vues des procédures en écriture différée (write-behind).
+
+Une lecture ne fait plus d'écriture en base :
+- un visiteur anonyme est compté une fois par adresse IP et par fenêtre de
+  VIEW_DEDUPE_WINDOW secondes, dans un compteur en cache ;
+- un utilisateur connecté est compté une seule fois par procédure : sa vue est
+  retenue en mémoire et n'est comptée que si aucune ProcedureInteraction
+  `view` n'existe encore (vérifiée au flush, en une requête).
+
+Les procédures dont le compteur anonyme passe à 1 sont inscrites dans un
+journal partagé en cache (un emplacement numéroté par un incr) : le flush de
+n'importe quel worker les retrouve, même si le processus qui a compté la vue
+a disparu. Chaque flush relit aussi les DIRTY_REREAD derniers emplacements,
+pour ceux réservés mais pas encore écrits lors de sa lecture ; un compteur
+déjà réservé est à 0, le relire ne compte rien deux fois.
+
+Toutes les FLUSH_INTERVAL secondes, un thread minuteur du processus (démarré
+à la première vue) reporte les compteurs en base avec un UPDATE
+views = views + n par montant, sans save() (donc sans verrou de ligne
+prolongé, sans signal ni nouvelle version), que d'autres vues arrivent ou
+non. Les vues des utilisateurs connectés restent en mémoire : un processus
+tué sans arrêt propre en perd au plus FLUSH_INTERVAL secondes ; un arrêt
+normal les reporte (atexit).
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.db.models import F
+
+from .models import Procedure, ProcedureInteraction
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'PROCEDURE_VIEWS_FLUSH_INTERVAL', 10)  # secondes
+VIEW_DEDUPE_WINDOW = getattr(settings, 'PROCEDURE_VIEWS_DEDUPE_WINDOW', 30 * 60)  # secondes
+PENDING_TTL = 24 * 60 * 60
+DIRTY_REREAD = 100  # emplacements du journal relus à chaque flush
+
+DIRTY_SEQ_KEY = "procedure_views:dirty:seq"  # dernier emplacement réservé
+DIRTY_FLUSHED_KEY = "procedure_views:dirty:flushed"  # dernier emplacement lu
+
+_lock = threading.Lock()
+_viewers = {}  # (user_id, procedure_id) -> (ip, user_agent)
+_timer_pid = None  # processus qui a démarré le minuteur (un fork ne l'hérite pas)
+
+
+def _pending_key(procedure_id):
+    return f"procedure_views:pending:{procedure_id}"
+
+
+def _seen_key(procedure_id, viewer):
+    return f"procedure_views:seen:{procedure_id}:{viewer}"
+
+
+def _dirty_key(slot):
+    return f"procedure_views:dirty:{slot}"
+
+
+def client_ip(request):
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if forwarded:
+        return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR')
+
+
+def record_view(request, procedure_id):
+    """Compter une lecture de la procédure ; aucune requête SQL"""
+    user = request.user
+    viewer = f"user:{user.pk}" if user.is_authenticated else f"ip:{client_ip(request)}"
+    _ensure_timer()
+    if not cache.add(_seen_key(procedure_id, viewer), 1, VIEW_DEDUPE_WINDOW):
+        return
+
+    if user.is_authenticated:
+        with _lock:
+            _viewers[(user.pk, procedure_id)] = (
+                client_ip(request), request.META.get('HTTP_USER_AGENT', '')[:500],
+            )
+        return
+
+    key = _pending_key(procedure_id)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        count = 1 if cache.add(key, 1, PENDING_TTL) else cache.incr(key)
+    if count == 1:
+        # Première vue depuis le dernier report : procédure à reporter
+        _mark_dirty(procedure_id)
+
+
+def _mark_dirty(procedure_id):
+    """Inscrire la procédure dans le journal partagé des compteurs à reporter"""
+    try:
+        slot = cache.incr(DIRTY_SEQ_KEY)
+    except ValueError:
+        slot = 1 if cache.add(DIRTY_SEQ_KEY, 1, None) else cache.incr(DIRTY_SEQ_KEY)
+    cache.set(_dirty_key(slot), str(procedure_id), PENDING_TTL)
+
+
+def _dirty_procedures():
+    """Procédures inscrites depuis le dernier flush, tous processus confondus"""
+    last = cache.get(DIRTY_SEQ_KEY) or 0
+    flushed = cache.get(DIRTY_FLUSHED_KEY) or 0
+    if flushed > last:
+        # Séquence perdue (éviction du cache) : elle repart de 1
+        flushed = 0
+    cache.set(DIRTY_FLUSHED_KEY, last, None)
+    slots = range(max(flushed - DIRTY_REREAD, 0) + 1, last + 1)
+    return set(cache.get_many([_dirty_key(slot) for slot in slots]).values())
+
+
+def pending_views(procedure_id):
+    """Vues anonymes pas encore reportées en base (pour l'affichage)"""
+    return cache.get(_pending_key(procedure_id)) or 0
+
+
+def _ensure_timer():
+    """Démarrer le minuteur de report dans ce processus s'il ne tourne pas"""
+    global _timer_pid
+    if _timer_pid == os.getpid():
+        return
+    with _lock:
+        if _timer_pid == os.getpid():
+            return
+        _timer_pid = os.getpid()
+    threading.Thread(target=_flush_periodically, name='procedure-views', daemon=True).start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        close_old_connections()
+        try:
+            flush()
+        except Exception:
+            logger.exception("Report des vues de procédures impossible")
+        finally:
+            close_old_connections()
+
+
+def _claim(key):
+    """Retirer du cache le compteur en attente ; renvoie le nombre réservé"""
+    pending = cache.get(key)
+    if not pending:
+        return 0
+    try:
+        remaining = cache.decr(key, pending)
+    except ValueError:
+        return 0
+    if remaining < 0:
+        # Un autre worker a réservé une partie entre-temps
+        cache.incr(key, -remaining)
+        return pending + remaining
+    return pending
+
+
+def flush():
+    """Reporter en base les vues anonymes en attente et les vues connectées de ce processus"""
+    with _lock:
+        viewers = dict(_viewers)
+        _viewers.clear()
+
+    claimed_views = {}
+    for procedure_id in _dirty_procedures():
+        claimed = _claim(_pending_key(procedure_id))
+        if claimed:
+            claimed_views[procedure_id] = claimed
+
+    try:
+        increments = Counter(claimed_views)
+        increments.update(_count_new_viewers(viewers))
+
+        # Un UPDATE par montant plutôt que par procédure
+        by_amount = defaultdict(list)
+        for procedure_id, amount in increments.items():
+            by_amount[amount].append(procedure_id)
+        for amount, procedure_ids in by_amount.items():
+            Procedure.objects.filter(pk__in=procedure_ids).update(views=F('views') + amount)
+    except Exception:
+        # Remettre en attente pour le prochain flush
+        for procedure_id, claimed in claimed_views.items():
+            try:
+                cache.incr(_pending_key(procedure_id), claimed)
+            except ValueError:
+                cache.set(_pending_key(procedure_id), claimed, PENDING_TTL)
+            _mark_dirty(procedure_id)
+        with _lock:
+            for pair, details in viewers.items():
+                _viewers.setdefault(pair, details)
+        raise
+
+    return sum(increments.values())
+
+
+def _count_new_viewers(viewers):
+    """Créer les interactions `view` manquantes ; vues à compter par procédure"""
+    if not viewers:
+        return Counter()
+
+    procedure_ids = {procedure_id for _, procedure_id in viewers}
+    existing_procedures = set(Procedure.objects.filter(pk__in=procedure_ids).values_list('pk', flat=True))
+    already_viewed = set(
+        ProcedureInteraction.objects.filter(
+            interaction_type='view',
+            procedure_id__in=procedure_ids,
+            user_id__in={user_id for user_id, _ in viewers},
+        ).values_list('user_id', 'procedure_id')
+    )
+    new_views = [
+        ProcedureInteraction(
+            user_id=user_id, procedure_id=procedure_id, interaction_type='view',
+            ip_address=ip, user_agent=user_agent,
+        )
+        for (user_id, procedure_id), (ip, user_agent) in viewers.items()
+        if procedure_id in existing_procedures and (user_id, procedure_id) not in already_viewed
+    ]
+    if not new_views:
+        return Counter()
+    ProcedureInteraction.objects.bulk_create(new_views, ignore_conflicts=True)
+
+    # Une ligne écartée par un autre processus (même utilisateur et procédure)
+    # n'a pas été écrite avec notre id : seules nos lignes sont comptées
+    inserted = ProcedureInteraction.objects.filter(
+        pk__in=[interaction.pk for interaction in new_views]
+    ).values_list('procedure_id', flat=True)
+    return Counter(inserted)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Report des vues de procédures impossible à l'arrêt")
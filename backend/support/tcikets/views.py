@@ -25,6 +25,8 @@ from support.utils.export_utils import export_ticket_pdf, export_tickets_excel
 from support.utils.report_utils import export_intervention_pdf, export_monthly_report_excel
 from support.utils.pdf_utils import intervention_to_pdf_buffer
 from .permissions import IsAdminOrOwner
+from .mixins import CompactTicketListMixin, InstrumentedViewMixin
+from support.utils.request_metrics import serializer_timer
 from .models import (
     User, Client, Technician, Ticket, Intervention, TicketImage, TechnicianRating, ClientRating,
     Message, PendingConfirmation
@@ -90,7 +92,7 @@ class TechnicianRetrieveUpdateDestroyView(RetrieveUpdateDestroyAPIView):
             return TechnicianCreateSerializer
         return TechnicianSerializer
 
-class TicketListCreateView(ListCreateAPIView):
+class TicketListCreateView(CompactTicketListMixin, InstrumentedViewMixin, ListCreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
@@ -153,7 +155,7 @@ class TicketListCreateView(ListCreateAPIView):
 
         return ticket
 
-class TicketRetrieveUpdateDestroyView(RetrieveUpdateDestroyAPIView):
+class TicketRetrieveUpdateDestroyView(InstrumentedViewMixin, RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
     lookup_field = "id"
 
@@ -253,7 +255,7 @@ class TicketActionsView(APIView):
         ticket.save()
         return Response({'status': 'diagnostic started'})
 
-class InterventionListView(ListCreateAPIView):
+class InterventionListView(InstrumentedViewMixin, ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = InterventionSerializer
 
@@ -289,7 +291,7 @@ class UserProfileView(RetrieveAPIView):
     def get_object(self):
         return self.request.user
 
-class ClientListCreateView(ListCreateAPIView):
+class ClientListCreateView(InstrumentedViewMixin, ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     
     def get_queryset(self):
@@ -308,7 +310,7 @@ class InterventionByTicketView(ListAPIView):
         ticket_id = self.kwargs['ticket_id']
         return Intervention.objects.filter(ticket_id=ticket_id)
 
-class UserListView(ListCreateAPIView):
+class UserListView(InstrumentedViewMixin, ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -459,9 +461,10 @@ class UserRatingsView(APIView):
             technician = user.technician_profile
             ratings = TechnicianRating.objects.filter(technician=technician)
 
-            response_data["technician_ratings"] = TechnicianRatingSerializer(
-                ratings, many=True
-            ).data
+            with serializer_timer(request):
+                response_data["technician_ratings"] = TechnicianRatingSerializer(
+                    ratings, many=True
+                ).data
             response_data["average_rating"] = (
                 sum([r.rating for r in ratings]) / ratings.count()
                 if ratings.exists()
@@ -473,9 +476,10 @@ class UserRatingsView(APIView):
             client = user.client_profile
             ratings = ClientRating.objects.filter(client=client)
 
-            response_data["client_ratings"] = ClientRatingSerializer(
-                ratings, many=True
-            ).data
+            with serializer_timer(request):
+                response_data["client_ratings"] = ClientRatingSerializer(
+                    ratings, many=True
+                ).data
             response_data["average_rating"] = (
                 sum([r.rating for r in ratings]) / ratings.count()
                 if ratings.exists()
@@ -440,6 +440,11 @@ export const proceduresAPI = {
       },
     });
   },
+
+  // Import et export ZIP en arrière-plan : état du job renvoyé par le POST (202)
+  getTransferJob: (jobId) => {
+    return api.get(`/procedures/jobs/${jobId}/`);
+  },
 };
 
 export default api;
\ No newline at end of file